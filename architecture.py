@@ -1,20 +1,21 @@
-from exceptions import UnknownOpCodeException
-from keyboard import KEY_MAPPINGS
-from screen import Screen
+from audio import NullAudio, DEFAULT_PATTERN, DEFAULT_PITCH
+from exceptions import MemoryAccessException, StackException, UnknownOpCodeException
+from quirks import QUIRK_PROFILES, DEFAULT_PROFILE
+from keyboard import Keypad
+from screen import FrameBuffer, PLANE_1, PLANE_2
 
-import pygame
-from pygame import key
-from random import randint
+from random import Random
 
 class Architecture:
     # Constants:
     MAX_MEMORY = 4096
+    XO_MEMORY = 0x10000
     PROGRAM_COUNTER_START = 0x200
     STACK_POINTER_START = 0x52
     NORMAL = 'normal'
     EXTENDED = 'extended'
 
-    def __init__(self, scale):
+    def __init__(self, scale=None, screen=None, seed=None, quirks=DEFAULT_PROFILE, audio=None):
 
         # The CHIP-8 had 4k (4096 bytes) of memory
         self.memory = bytearray(self.MAX_MEMORY)
@@ -55,6 +56,9 @@ class Architecture:
             'RPL': bytearray(16)
         }
 
+        # Return addresses, only used with the 'internal' stack quirk
+        self.STACK = []
+
         self.Timers = {
             'DT': 0,
             'ST': 0,
@@ -113,11 +117,39 @@ class Architecture:
             0x85: self.LD_REG_RPL,                  # FS85 - LRPL VS        (LOAD V0 - VS FROM RPL)
         }
 
+        #  XO-CHIP only, self.RANGE gets called when 0x5NNN is loaded into the CPU
+        #  The last nibble is used to define the instruction
+        self.RANGELookup = {
+            0x0: self.SKIP_REG_E_REG,               # 5ST0 - SKE  VS, VT       (SKIP IF VS == VT)
+            0x2: self.STR_RANGE_MEM,                # 5ST2 - SAVE VS - VT      (STORE VS - VT INTO MEMORY[I])
+            0x3: self.LD_RANGE_MEM,                 # 5ST3 - LOAD VS - VT      (LOAD VS - VT FROM MEMORY[I])
+        }
+
+        # XO-CHIP bitplanes that drawing, clearing and scrolling apply to
+        self.PLANES = PLANE_1
+
+        # Swap in the handler variants for the selected quirk profile
+        self.QUIRKS = QUIRK_PROFILES[quirks]
+        self.APPLY_QUIRKS(self.QUIRKS)
+
         # Settings the current operand 
         self.CurrentOperand = 0
 
-        # Create and initialize screen class
-        self.screen = Screen(SCALE=scale)
+        # Use the screen given, otherwise open a pygame window if a scale was
+        # given or run headless. pygame is only imported for the window.
+        if screen is None and scale is not None:
+            from presenter import Screen
+            screen = Screen(SCALE=scale)
+        self.screen = screen if screen is not None else FrameBuffer()
+
+        # The 16 key keypad, updated by the frontend
+        self.keypad = Keypad()
+
+        # Sound backend, silent unless the frontend passes one in
+        self.audio = audio if audio is not None else NullAudio()
+
+        # Random number generator for RND_REG, seeded for reproducible runs
+        self.RANDOM = Random(seed)
 
         # Setting default operating mode
         self.MODE = self.NORMAL
@@ -125,6 +157,52 @@ class Architecture:
         # Reset memory function
         self.RESET()
 
+    def APPLY_QUIRKS(self, profile):
+        """
+        Replace the handlers that differ between interpreters with the
+        variants selected by the quirk profile (see quirks.py). This is done
+        once here so no handler has to check the profile when it runs.
+        """
+
+        if profile['shift'] == 'VT':
+            self.ELILookup[0x6] = self.R_SHFT_REG_VT
+            self.ELILookup[0xE] = self.L_SHFT_REG_VT
+
+        if profile['load_store_i'] == 'increment':
+            self.MSCLookup[0x55] = self.STR_REG_MEM_INC
+            self.MSCLookup[0x65] = self.LD_REG_MEM_INC
+
+        if profile['jump'] == 'V0':
+            self.OperationLookupTable[0xB] = self.JMP_V0_VAL
+        elif profile['jump'] == 'VX':
+            self.OperationLookupTable[0xB] = self.JMP_REG_VAL
+
+        self.CLIP_SPRITES = profile['draw'] == 'clip'
+        if self.CLIP_SPRITES:
+            self.DRAW_NORM = self.DRAW_NORM_CLIP
+            self.DRAW_EXT = self.DRAW_EXT_CLIP
+
+        if profile['stack'] == 'internal':
+            self.OperationLookupTable[0x2] = self.JMP_SBR_INTERNAL
+            self.RETURN = self.RETURN_INTERNAL
+            self.CALL_STACK = self.CALL_STACK_INTERNAL
+
+        if profile['vf_reset']:
+            self.ELILookup[0x1] = self.OR_VF_RESET
+            self.ELILookup[0x2] = self.AND_VF_RESET
+            self.ELILookup[0x3] = self.XOR_VF_RESET
+
+        if profile['xochip']:
+            self.MAX_MEMORY = self.XO_MEMORY
+            self.memory = bytearray(self.MAX_MEMORY)
+            self.SKIP = self.SKIP_LONG
+            self.OperationLookupTable[0x5] = self.RANGE
+            self.OperationLookupTable[0xD] = self.DRAW_PLANES
+            self.MSCLookup[0x00] = self.LD_LONG_I           # F000 NNNN - LOAD I, NNNN  (LOAD 16-BIT NNNN INTO I)
+            self.MSCLookup[0x01] = self.SELECT_PLANES       # FN01 - PLANE N            (DRAW INTO PLANES N)
+            self.MSCLookup[0x02] = self.LD_PATTERN          # F002 - AUDIO              (LOAD AUDIO PATTERN FROM MEMORY[I])
+            self.MSCLookup[0x3A] = self.LD_PITCH            # FS3A - PITCH VS           (SET AUDIO PITCH TO VS)
+
     def LOAD_ROMFILE(self, filename, offset=PROGRAM_COUNTER_START):
         """
         Load the ROM indicated by the filename into memory.
@@ -146,9 +224,12 @@ class Architecture:
             # Shifting it 8 bits to the left to make it most significant
             # Adding the next byte to it for subinstructions
             # Increment the Program Counter [PC] by 2
-            self.CurrentOperand = int(self.memory[self.CpuRegisters['PC']]) 
-            self.CurrentOperand = self.CurrentOperand << 8                  
-            self.CurrentOperand += int(self.memory[self.CpuRegisters['PC'] + 1])
+            try:
+                self.CurrentOperand = int(self.memory[self.CpuRegisters['PC']]) 
+                self.CurrentOperand = self.CurrentOperand << 8                  
+                self.CurrentOperand += int(self.memory[self.CpuRegisters['PC'] + 1])
+            except IndexError:
+                raise MemoryAccessException('fetch', self.CpuRegisters['PC'], 2) from None
             self.CpuRegisters['PC'] += 2
 
         # The operation index being formatted for the lookup table
@@ -174,6 +255,20 @@ class Architecture:
             # If operation not found, throw exception
             raise UnknownOpCodeException(self.CurrentOperand)
 
+    def RANGE(self):
+        """
+        XO-CHIP: Defining the 5STN Operation from the Lookup Table
+        """
+
+        # Formatting operation for lookup table
+        OPERATION = self.CurrentOperand & 0x000F
+
+        try:
+            self.RANGELookup[OPERATION]()
+        except KeyError:
+            # If operation not found, throw exception
+            raise UnknownOpCodeException(self.CurrentOperand)
+
     def KBRD(self):
         """
         Runs the correct keyboard routine based on CurrentOperand
@@ -189,21 +284,20 @@ class Architecture:
         # Getting Key Register from CurrentOperand (get second byte)
         KEY_REGISTER = (self.CurrentOperand & 0x0F00) >> 8
 
-        KEY_TO_CHECK = self.GeneralRegisters[KEY_REGISTER]
+        KEY_TO_CHECK = self.GeneralRegisters[KEY_REGISTER] & 0xF
 
-        # Get array of all pressed keys
-        ALL_PRESSED_KEYS = key.get_pressed()
-        
+        # Test the key's bit in the keypad mask
+        PRESSED = (self.keypad.MASK >> KEY_TO_CHECK) & 1
 
         # Skip if the key specified in the source register is pressed
         if OPERATION == 0x9E:
-            if ALL_PRESSED_KEYS[int(KEY_MAPPINGS[KEY_TO_CHECK])] == 1:
-                self.CpuRegisters['PC'] += 2
+            if PRESSED == 1:
+                self.SKIP()
 
         # Skip if the key specified in the source register is not pressed
         if OPERATION == 0xA1:
-            if ALL_PRESSED_KEYS[int(KEY_MAPPINGS[KEY_TO_CHECK])] == 0:
-                self.CpuRegisters['PC'] += 2
+            if PRESSED == 0:
+                self.SKIP()
 
     def MSC(self):
         """
@@ -226,6 +320,7 @@ class Architecture:
         Opcodes starting with a 0 are one of the following instructions:
             0NNN - Jump to machine code function (ignored)
             00CN - Scroll n pixels down
+            00DN - Scroll n pixels up (XO-CHIP)
             00E0 - Clear the display
             00EE - Return from subroutine
             00FB - Scroll 4 pixels right
@@ -241,19 +336,23 @@ class Architecture:
 
         if SUB_OPERATION == 0x00C0:
             SCROLL_PIXELS = self.CurrentOperand & 0x000F
-            self.screen.SCROLL_DOWN(SCROLL_PIXELS)
+            self.screen.SCROLL_DOWN(SCROLL_PIXELS, self.PLANES)
+
+        if SUB_OPERATION == 0x00D0 and self.QUIRKS['xochip']:
+            SCROLL_PIXELS = self.CurrentOperand & 0x000F
+            self.screen.SCROLL_UP(SCROLL_PIXELS, self.PLANES)
 
         if OPERATION == 0x00E0:
-            self.screen.CLEAR()
+            self.screen.CLEAR(self.PLANES)
 
         if OPERATION == 0x00EE:
             self.RETURN()
 
         if OPERATION == 0x00FB:
-            self.screen.SCROLL_RIGHT()
+            self.screen.SCROLL_RIGHT(self.PLANES)
 
         if OPERATION == 0x00FC:
-            self.screen.SCROLL_LEFT()
+            self.screen.SCROLL_LEFT(self.PLANES)
 
         if OPERATION == 0x00FD:
             pass
@@ -299,6 +398,63 @@ class Architecture:
         self.CpuRegisters['SP'] += 1
         self.CpuRegisters['PC'] = self.CurrentOperand & 0x0FFF
 
+    def JMP_SBR_INTERNAL(self):
+        """
+        QUIRK (stack = internal): 0x2NNN - CALL NNN Subroutine, keeping the
+        return address in self.STACK instead of memory
+        """
+
+        self.STACK.append(self.CpuRegisters['PC'])
+        self.CpuRegisters['SP'] += 2
+        self.CpuRegisters['PC'] = self.CurrentOperand & 0x0FFF
+
+    def RETURN_INTERNAL(self):
+        """
+        QUIRK (stack = internal): 00EE, return to the address in self.STACK
+        """
+
+        if not self.STACK:
+            raise StackException('underflow', self.CpuRegisters['SP'])
+
+        self.CpuRegisters['SP'] -= 2
+        self.CpuRegisters['PC'] = self.STACK.pop()
+
+    def CALL_STACK(self):
+        """
+        Returns the return addresses on the call stack, oldest first.
+
+        JMP_SBR pushes the low byte of PC then the high byte, starting at
+        STACK_POINTER_START.
+        """
+        return [
+            self.memory[sp] | (self.memory[sp + 1] << 8)
+            for sp in range(self.STACK_POINTER_START, self.CpuRegisters['SP'] - 1, 2)
+        ]
+
+    def CALL_STACK_INTERNAL(self):
+        """
+        QUIRK (stack = internal): Returns the return addresses, oldest first
+        """
+        return list(self.STACK)
+
+    def SKIP(self):
+        """
+        Skip the next instruction
+        """
+
+        self.CpuRegisters['PC'] += 2
+
+    def SKIP_LONG(self):
+        """
+        XO-CHIP: Skip the next instruction, stepping over both halves of F000 NNNN
+        """
+
+        pc = self.CpuRegisters['PC']
+        self.CHECK_MEMORY('fetch', pc, 2)
+        if self.memory[pc] == 0xF0 and self.memory[pc + 1] == 0x00:
+            pc += 2
+        self.CpuRegisters['PC'] = pc + 2
+
     def SKIP_REG_E_VAL(self):
         """
         Triggered by 0x3SNN = SKIP IF REGISTER VS == NN
@@ -308,7 +464,7 @@ class Architecture:
         register = (self.CurrentOperand & 0x0F00) >> 8
 
         if self.GeneralRegisters[register] == self.CurrentOperand & 0x00FF:
-            self.CpuRegisters['PC'] += 2
+            self.SKIP()
 
     def SKIP_REG_NE_VAL(self):
         """
@@ -319,7 +475,7 @@ class Architecture:
         register = (self.CurrentOperand & 0x0F00) >> 8
 
         if self.GeneralRegisters[register] != self.CurrentOperand & 0x00FF:
-            self.CpuRegisters['PC'] += 2
+            self.SKIP()
 
     def SKIP_REG_E_REG(self):
         """
@@ -329,8 +485,8 @@ class Architecture:
         register1 = (self.CurrentOperand & 0x0F00) >> 8
         register2 = (self.CurrentOperand & 0x00F0) >> 4
 
-        if self.GeneralRegisters[register1] == self.GeneralRegisters[regsiter2]:
-            self.CpuRegisters['PC'] += 2
+        if self.GeneralRegisters[register1] == self.GeneralRegisters[register2]:
+            self.SKIP()
 
     def SKIP_REG_NE_REG(self):
         """
@@ -341,7 +497,7 @@ class Architecture:
         register2 = (self.CurrentOperand & 0x00F0) >> 4
 
         if self.GeneralRegisters[register1] != self.GeneralRegisters[register2]:
-            self.CpuRegisters['PC'] += 2
+            self.SKIP()
 
     def LD_VAL_REG(self):
         """
@@ -400,7 +556,7 @@ class Architecture:
         register1 = (self.CurrentOperand & 0x0F00) >> 8
         register2 = (self.CurrentOperand & 0x00F0) >> 4
 
-        if self.GeneralRegisters[register1] > self.GeneralRegisters[register2]:
+        if self.GeneralRegisters[register1] >= self.GeneralRegisters[register2]:
             self.GeneralRegisters[register1] -= self.GeneralRegisters[register2]
             self.GeneralRegisters[0xF] = 1
         else:
@@ -416,7 +572,7 @@ class Architecture:
         register1 = (self.CurrentOperand & 0x0F00) >> 8
         register2 = (self.CurrentOperand & 0x00F0) >> 4
 
-        if self.GeneralRegisters[register1] < self.GeneralRegisters[register2]:
+        if self.GeneralRegisters[register1] <= self.GeneralRegisters[register2]:
             self.GeneralRegisters[register1] = self.GeneralRegisters[register2] - self.GeneralRegisters[register1]
             self.GeneralRegisters[0xF] = 1
         else:
@@ -453,6 +609,30 @@ class Architecture:
 
         self.GeneralRegisters[register1] ^= self.GeneralRegisters[register2]
 
+    def OR_VF_RESET(self):
+        """
+        QUIRK (vf_reset): 0x8ST1 = VS = VS | VT, VF = 0
+        """
+
+        self.OR()
+        self.GeneralRegisters[0xF] = 0
+
+    def AND_VF_RESET(self):
+        """
+        QUIRK (vf_reset): 0x8ST2 = VS = VS & VT, VF = 0
+        """
+
+        self.AND()
+        self.GeneralRegisters[0xF] = 0
+
+    def XOR_VF_RESET(self):
+        """
+        QUIRK (vf_reset): 0x8ST3 = VS = VS ^ VT, VF = 0
+        """
+
+        self.XOR()
+        self.GeneralRegisters[0xF] = 0
+
     def R_SHFT_REG(self):
         """
         PART OF ELI: Triggered by 0x8S06 = VS = VS >> 1 and VF = VS[0] & 0x1 (bit 0 not byte 0)
@@ -470,8 +650,32 @@ class Architecture:
 
         register = (self.CurrentOperand & 0x0F00) >> 8
 
-        self.GeneralRegisters[0xF] = (self.GeneralRegisters[register] & 0x80) >> 8
-        self.GeneralRegisters[register] = self.GeneralRegisters[register] << 1
+        self.GeneralRegisters[0xF] = (self.GeneralRegisters[register] & 0x80) >> 7
+        self.GeneralRegisters[register] = (self.GeneralRegisters[register] << 1) & 0xFF
+
+    def R_SHFT_REG_VT(self):
+        """
+        QUIRK (shift = VT): 0x8ST6 = VS = VT >> 1 and VF = VT[0]
+        """
+
+        register1 = (self.CurrentOperand & 0x0F00) >> 8
+        register2 = (self.CurrentOperand & 0x00F0) >> 4
+
+        value = self.GeneralRegisters[register2]
+        self.GeneralRegisters[0xF] = value & 0x1
+        self.GeneralRegisters[register1] = value >> 1
+
+    def L_SHFT_REG_VT(self):
+        """
+        QUIRK (shift = VT): 0x8STE = VS = VT << 1 and VF = VT[7]
+        """
+
+        register1 = (self.CurrentOperand & 0x0F00) >> 8
+        register2 = (self.CurrentOperand & 0x00F0) >> 4
+
+        value = self.GeneralRegisters[register2]
+        self.GeneralRegisters[0xF] = (value & 0x80) >> 7
+        self.GeneralRegisters[register1] = (value << 1) & 0xFF
 
     def LD_I_VAL(self):
         """
@@ -486,6 +690,22 @@ class Architecture:
         """
 
         self.CpuRegisters['PC'] = self.CpuRegisters['I'] + (self.CurrentOperand & 0x0FFF)
+
+    def JMP_V0_VAL(self):
+        """
+        QUIRK (jump = V0): 0xBNNN = JUMP to [V0] + NNN
+        """
+
+        self.CpuRegisters['PC'] = self.GeneralRegisters[0x0] + (self.CurrentOperand & 0x0FFF)
+
+    def JMP_REG_VAL(self):
+        """
+        QUIRK (jump = VX): 0xBSNN = JUMP to [VS] + SNN
+        """
+
+        register = (self.CurrentOperand & 0x0F00) >> 8
+
+        self.CpuRegisters['PC'] = self.GeneralRegisters[register] + (self.CurrentOperand & 0x0FFF)
     
     def RND_REG(self):
         """
@@ -496,7 +716,7 @@ class Architecture:
         value = self.CurrentOperand & 0x00FF
         register = (self.CurrentOperand & 0x0F00) >> 8
 
-        self.GeneralRegisters[register] = value & randint(0, 255)
+        self.GeneralRegisters[register] = value & self.RANDOM.randint(0, 255)
 
     def LD_DT_REG(self):
         """
@@ -510,24 +730,21 @@ class Architecture:
     def WAIT_KEYPRESS(self):
         """
         PART OF MSC - Triggerd by 0xFS0A = WAIT FOR KEYPRESS, STORE KEYPRESS INTO VS
+
+        Rather than blocking, the instruction runs again until a key goes down,
+        so the frontend keeps handling events and timers while it waits.
         """
 
         register = (self.CurrentOperand & 0x0F00) >> 8
 
-        key_pressed = False
-        while not key_pressed:
-            event = pygame.event.wait()
-            if event.type == pygame.KEYDOWN:
-                all_keys_down = key.get_pressed()
-                if all_keys_down[pygame.K_q]:
-                    self.CurrentOperand = 0x00FD
-                    key_pressed = True
-                    break
-                for keyval, lookup_key in KEY_MAPPINGS.items():
-                    if all_keys_down[lookup_key]:
-                        self.GeneralRegisters[register] = keyval
-                        key_pressed = True
-                        break
+        if not self.keypad.EDGES:
+            self.CpuRegisters['PC'] -= 2
+            return
+
+        # Take the lowest key that was pressed
+        key_bit = self.keypad.EDGES & -self.keypad.EDGES
+        self.keypad.EDGES &= ~key_bit
+        self.GeneralRegisters[register] = key_bit.bit_length() - 1
     
     def LD_REG_DT(self):
         """
@@ -546,6 +763,18 @@ class Architecture:
         register = (self.CurrentOperand & 0x0F00) >> 8
 
         self.Timers['ST'] = self.GeneralRegisters[register]
+        self.UPDATE_TONE()
+
+    def UPDATE_TONE(self):
+        """
+        Start the tone when ST is set and stop it when ST is zero. Only the
+        change is passed on to the audio backend.
+        """
+        if (self.Timers['ST'] > 0) != self.audio.PLAYING:
+            if self.audio.PLAYING:
+                self.audio.STOP()
+            else:
+                self.audio.START()
 
     def LD_I_REG(self):
         """
@@ -572,11 +801,13 @@ class Architecture:
     def ADD_REG_I(self):
         """
         PART OF MSC - Triggered by 0xFT1E = I = [VT] + [I]
+
+        I is a 16-bit register and wraps around like one
         """
 
         register = (self.CurrentOperand & 0x0F00) >> 8
 
-        self.CpuRegisters['I'] += self.GeneralRegisters[register]
+        self.CpuRegisters['I'] = (self.CpuRegisters['I'] + self.GeneralRegisters[register]) & 0xFFFF
 
     def STR_BCD_MEM(self):
         """
@@ -591,6 +822,7 @@ class Architecture:
         register = (self.CurrentOperand & 0x0F00) >> 8
         binary_value = '{:03d}'.format(self.GeneralRegisters[register])
 
+        self.CHECK_MEMORY('write', self.CpuRegisters['I'], 3)
         self.memory[self.CpuRegisters['I']] = int(binary_value[0])
         self.memory[self.CpuRegisters['I'] + 1] = int(binary_value[1])
         self.memory[self.CpuRegisters['I'] + 2] = int(binary_value[2])
@@ -602,9 +834,18 @@ class Architecture:
 
         register = (self.CurrentOperand & 0x0F00) >> 8
 
+        self.CHECK_MEMORY('write', self.CpuRegisters['I'], register + 1)
         for i in range(register + 1):
             self.memory[self.CpuRegisters['I'] + i] = self.GeneralRegisters[i]
 
+    def STR_REG_MEM_INC(self):
+        """
+        QUIRK (load_store_i = increment): 0xFT55, then I = I + T + 1
+        """
+
+        self.STR_REG_MEM()
+        self.CpuRegisters['I'] = (self.CpuRegisters['I'] + ((self.CurrentOperand & 0x0F00) >> 8) + 1) & 0xFFFF
+
     def LD_REG_MEM(self):
         """
         PART OF MSC - Triggered by 0xFST65 = LOAD V0-VT FROM MEMORY AT [I]
@@ -612,9 +853,18 @@ class Architecture:
 
         register = (self.CurrentOperand & 0x0F00) >> 8
 
+        self.CHECK_MEMORY('read', self.CpuRegisters['I'], register + 1)
         for i in range(register + 1):
             self.GeneralRegisters[i] = self.memory[self.CpuRegisters['I'] + i]
 
+    def LD_REG_MEM_INC(self):
+        """
+        QUIRK (load_store_i = increment): 0xFT65, then I = I + T + 1
+        """
+
+        self.LD_REG_MEM()
+        self.CpuRegisters['I'] = (self.CpuRegisters['I'] + ((self.CurrentOperand & 0x0F00) >> 8) + 1) & 0xFFFF
+
     def STR_REG_RPL(self):
         """
         PART OF MSC - Triggered by 0xFT75 = STORE V0 - VT INTO RPL
@@ -635,6 +885,88 @@ class Architecture:
         for i in range(register + 1):
             self.GeneralRegisters[i] = self.CpuRegisters['RPL'][i]
 
+    def STR_RANGE_MEM(self):
+        """
+        XO-CHIP: Triggered by 0x5ST2 = STORE VS - VT INTO MEMORY AT [I], I is unchanged.
+        If S > T the registers are stored in reverse order.
+        """
+
+        register1 = (self.CurrentOperand & 0x0F00) >> 8
+        register2 = (self.CurrentOperand & 0x00F0) >> 4
+        step = 1 if register1 <= register2 else -1
+
+        self.CHECK_MEMORY('write', self.CpuRegisters['I'], abs(register2 - register1) + 1)
+        for offset, register in enumerate(range(register1, register2 + step, step)):
+            self.memory[self.CpuRegisters['I'] + offset] = self.GeneralRegisters[register]
+
+    def LD_RANGE_MEM(self):
+        """
+        XO-CHIP: Triggered by 0x5ST3 = LOAD VS - VT FROM MEMORY AT [I], I is unchanged.
+        If S > T the registers are loaded in reverse order.
+        """
+
+        register1 = (self.CurrentOperand & 0x0F00) >> 8
+        register2 = (self.CurrentOperand & 0x00F0) >> 4
+        step = 1 if register1 <= register2 else -1
+
+        self.CHECK_MEMORY('read', self.CpuRegisters['I'], abs(register2 - register1) + 1)
+        for offset, register in enumerate(range(register1, register2 + step, step)):
+            self.GeneralRegisters[register] = self.memory[self.CpuRegisters['I'] + offset]
+
+    def LD_LONG_I(self):
+        """
+        XO-CHIP: PART OF MSC - Triggered by 0xF000 NNNN = LOAD NNNN INTO I
+
+        The address is the 16-bit word after the instruction, which is skipped
+        """
+
+        pc = self.CpuRegisters['PC']
+        self.CHECK_MEMORY('fetch', pc, 2)
+        self.CpuRegisters['I'] = (self.memory[pc] << 8) | self.memory[pc + 1]
+        self.CpuRegisters['PC'] = pc + 2
+
+    def SELECT_PLANES(self):
+        """
+        XO-CHIP: PART OF MSC - Triggered by 0xFN01 = SELECT BITPLANES N (0 - 3)
+        """
+
+        self.PLANES = ((self.CurrentOperand & 0x0F00) >> 8) & (PLANE_1 | PLANE_2)
+
+    def LD_PATTERN(self):
+        """
+        XO-CHIP: PART OF MSC - Triggered by 0xF002 = LOAD 16 BYTE AUDIO PATTERN FROM MEMORY AT [I]
+        """
+
+        self.audio.SET_PATTERN(self.READ_MEMORY(self.CpuRegisters['I'], 16))
+
+    def LD_PITCH(self):
+        """
+        XO-CHIP: PART OF MSC - Triggered by 0xFS3A = SET AUDIO PITCH TO VS
+        """
+
+        register = (self.CurrentOperand & 0x0F00) >> 8
+
+        self.audio.SET_PITCH(self.GeneralRegisters[register])
+
+    def CHECK_MEMORY(self, access, address, size):
+        """
+        Raise MemoryAccessException if size bytes starting at address run
+        past the end of memory. Checked before the access, so an instruction
+        that fails has not changed anything.
+        """
+
+        if address + size > len(self.memory):
+            raise MemoryAccessException(access, address, size)
+
+    def READ_MEMORY(self, address, size):
+        """
+        Returns size bytes of memory starting at address, raises
+        MemoryAccessException if that runs past the end.
+        """
+
+        self.CHECK_MEMORY('read', address, size)
+        return self.memory[address:address + size]
+
     def DRAW(self):
         """
         The draw method for actually drawing output to the screen
@@ -681,62 +1013,78 @@ class Architecture:
         Called by draw function in normal mode
         """
 
-        for y_layer in range(height):
-
-            pixel_array = bin(self.memory[self.CpuRegisters['I'] + y_layer])
-            pixel_array = pixel_array[2:].zfill(8)
+        data = self.READ_MEMORY(self.CpuRegisters['I'], height)
+        if self.screen.DRAW_SPRITE(x, y, data):
+            self.GeneralRegisters[0xF] = 1
 
-            y_coordinate = (y + y_layer) % self.screen.HEIGHT
+        self.screen.UPDATE()
 
-            for x_layer in range(8):
+    def DRAW_EXT(self, x, y, height):
+        """
+        Called by draw function in extended mode where sprites are
+        supposed to be 16 x 16
+        """
 
-                x_coordinate = (x + x_layer) % self.screen.WIDTH
-                new_state = int(pixel_array[x_layer])
+        data = self.READ_MEMORY(self.CpuRegisters['I'], height * 2)
+        if self.screen.DRAW_SPRITE(x, y, data, 2):
+            self.GeneralRegisters[0xF] = 1
 
-                current_state = self.screen.GET_STATE(x_coordinate, y_coordinate)
+        self.screen.UPDATE()
 
-                if current_state == 1 and new_state == 1:
-                    self.GeneralRegisters[0xF] = self.GeneralRegisters[0xF] | 1
-                    new_state = 0
-                elif new_state == 0 and current_state == 1:
-                    self.GeneralRegisters[0xF] = self.GeneralRegisters[0xF] | 0
-                    new_state = 1
+    def DRAW_NORM_CLIP(self, x, y, height):
+        """
+        QUIRK (draw = clip): DRAW_NORM, but pixels past the edges of the
+        screen are cut off instead of wrapping. Only the start position wraps.
+        """
 
-                self.screen.DRAW(x_coordinate, y_coordinate, new_state)
+        data = self.READ_MEMORY(self.CpuRegisters['I'], height)
+        if self.screen.DRAW_SPRITE(x, y, data, clip=True):
+            self.GeneralRegisters[0xF] = 1
 
         self.screen.UPDATE()
 
-    def DRAW_EXT(self,x, y, height):
+    def DRAW_EXT_CLIP(self, x, y, height):
         """
-        Called by draw function in extended mode where sprites are 
-        supposed to be 16 x 16
+        QUIRK (draw = clip): DRAW_EXT, but pixels past the edges of the
+        screen are cut off instead of wrapping. Only the start position wraps.
         """
 
-        for y_layer in range(height):
-
-            for offset in range(2):
+        data = self.READ_MEMORY(self.CpuRegisters['I'], height * 2)
+        if self.screen.DRAW_SPRITE(x, y, data, 2, clip=True):
+            self.GeneralRegisters[0xF] = 1
 
-                pixel_array = bin(self.memory[self.CpuRegisters['I'] + (y_layer*2) + offset])
-                pixel_array = pixel_array[2:].zfill(8)
+        self.screen.UPDATE()
 
-                y_coordinate = (y + y_layer) % self.screen.HEIGHT
+    def DRAW_PLANES(self):
+        """
+        XO-CHIP: Triggered by DSTN - DRAW VS, VT, N into every selected plane
 
-                for x_layer in range(8):
+        N = 0 draws a 16 x 16 sprite in either mode. When both planes are
+        selected the sprite for plane 2 follows the one for plane 1 at [I].
+        """
 
-                    x_coordinate = (x + x_layer + (offset * 8)) % self.screen.WIDTH
+        register_x = (self.CurrentOperand & 0x0F00) >> 8
+        register_y = (self.CurrentOperand & 0x00F0) >> 4
 
-                    new_state = int(pixel_array[x_layer])
+        x = self.GeneralRegisters[register_x]
+        y = self.GeneralRegisters[register_y]
 
-                    current_state = self.screen.GET_STATE(x_coordinate, y_coordinate)
+        height = self.CurrentOperand & 0x000F
+        row_bytes = 1
+        if height == 0:
+            height, row_bytes = 16, 2
 
-                    if current_state == 1 and new_state == 1:
-                        self.GeneralRegisters[0xF] = self.GeneralRegisters[0xF] | 1
-                        new_state = 0
-                    elif new_state == 0 and current_state == 1:
-                        new_state = 1
+        address = self.CpuRegisters['I']
+        size = height * row_bytes
+        collided = False
 
-                    self.screen.DRAW(x_coordinate, y_coordinate, new_state)
+        for plane in (PLANE_1, PLANE_2):
+            if self.PLANES & plane:
+                data = self.READ_MEMORY(address, size)
+                collided |= self.screen.DRAW_SPRITE(x, y, data, row_bytes, plane, self.CLIP_SPRITES)
+                address += size
 
+        self.GeneralRegisters[0xF] = 1 if collided else 0
         self.screen.UPDATE()
 
     def RESET(self):
@@ -750,9 +1098,14 @@ class Architecture:
         self.CpuRegisters['PC'] = self.PROGRAM_COUNTER_START
         self.CpuRegisters['SP'] = self.STACK_POINTER_START
         self.CpuRegisters['I'] = 0
+        self.STACK = []
+        self.PLANES = PLANE_1
         
         self.Timers['DT'] = 0
         self.Timers['ST'] = 0
+        self.audio.STOP()
+        self.audio.SET_PATTERN(DEFAULT_PATTERN)
+        self.audio.SET_PITCH(DEFAULT_PITCH)
 
     def ENABLE_EXT(self):
         """
@@ -768,16 +1121,72 @@ class Architecture:
         self.screen.SET_NORM()
         self.MODE = self.NORMAL
         
+    def SNAPSHOT(self):
+        """
+        Returns a copy of the complete machine state
+        """
+        return {
+            'memory': bytes(self.memory),
+            'V': [self.GeneralRegisters[i] for i in range(16)],
+            'I': self.CpuRegisters['I'],
+            'SP': self.CpuRegisters['SP'],
+            'STACK': list(self.STACK),
+            'PC': self.CpuRegisters['PC'],
+            'RPL': bytes(self.CpuRegisters['RPL']),
+            'DT': self.Timers['DT'],
+            'ST': self.Timers['ST'],
+            'MODE': self.MODE,
+            'PLANES': self.PLANES,
+            'PATTERN': self.audio.PATTERN,
+            'PITCH': self.audio.PITCH,
+            'screen': self.screen.SNAPSHOT(),
+        }
+
+    def RESTORE(self, snapshot):
+        """
+        Restore a state returned by SNAPSHOT. Raises ValueError, leaving
+        the state alone, if it was taken with another memory size.
+        """
+        if len(snapshot['memory']) != len(self.memory):
+            raise ValueError('snapshot has {} bytes of memory, not {}'.format(
+                len(snapshot['memory']), len(self.memory)))
+
+        self.memory[:] = snapshot['memory']
+        for i in range(16):
+            self.GeneralRegisters[i] = snapshot['V'][i]
+        self.CpuRegisters['I'] = snapshot['I']
+        self.CpuRegisters['SP'] = snapshot['SP']
+        self.STACK = list(snapshot['STACK'])
+        self.CpuRegisters['PC'] = snapshot['PC']
+        # Save states leave out the persistent RPL flags
+        if 'RPL' in snapshot:
+            self.CpuRegisters['RPL'][:] = snapshot['RPL']
+        self.Timers['DT'] = snapshot['DT']
+        self.Timers['ST'] = snapshot['ST']
+        self.MODE = snapshot['MODE']
+        self.PLANES = snapshot['PLANES']
+        if snapshot['PATTERN'] != self.audio.PATTERN:
+            self.audio.SET_PATTERN(snapshot['PATTERN'])
+        if snapshot['PITCH'] != self.audio.PITCH:
+            self.audio.SET_PITCH(snapshot['PITCH'])
+        # Only start the tone once it has its restored pattern and pitch
+        self.UPDATE_TONE()
+        self.screen.RESTORE(snapshot['screen'])
+
     # Debug functions
     def DECREMENT_TIMERS(self):
         """
-        Decrement both the sound and delay timer.
+        Decrement both the sound and delay timer, and stop the tone when the
+        sound timer reaches zero. Called once per 60 Hz frame. The tone is
+        started by FX18 itself, so even an ST of 1 sounds for a frame.
         """
         if self.Timers['DT'] > 0:
             self.Timers['DT'] -= 1
 
         if self.Timers['ST'] > 0:
             self.Timers['ST'] -= 1
+            if self.Timers['ST'] == 0 and self.audio.PLAYING:
+                self.audio.STOP()
 
     def DUMP_MEMORY(self):
         """
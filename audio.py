@@ -0,0 +1,123 @@
+# Sound for the sound timer. The tone is a 16 byte (128 bit) pattern played
+# one bit at a time, the way XO-CHIP defines it, at
+#
+#   4000 * 2 ** ((pitch - 64) / 48) bits per second
+#
+# The default pattern is 8 bits on, 8 bits off, which at the default pitch
+# is the usual 250 Hz CHIP-8 square wave. Architecture calls START when FX18
+# sets the sound timer and STOP when the timer runs out on a 60 Hz tick, only
+# on a change, so a backend does no work per instruction.
+
+from array import array
+
+
+DEFAULT_PATTERN = bytes([0xFF, 0x00] * 8)
+DEFAULT_PITCH = 64
+
+SAMPLE_RATE = 44100
+
+# Samples buffered by the mixer, 256 is about 6 ms, well under one 60 Hz frame
+# (16.7 ms) even with the device buffer on top
+MIXER_BUFFER = 256
+
+# Shortest looping buffer rendered for a pattern, in samples
+MIN_LOOP_SAMPLES = 4096
+
+AMPLITUDE = 8000
+
+
+def BIT_RATE(pitch):
+    return 4000 * 2 ** ((pitch - 64) / 48)
+
+
+def RENDER_PATTERN(pattern, pitch, sample_rate=SAMPLE_RATE, amplitude=AMPLITUDE):
+    """
+    Render the pattern as signed 16-bit mono samples. The buffer holds whole
+    repeats of the pattern so it can be looped, rounded to the nearest sample.
+    """
+    bits = [(pattern[index >> 3] >> (7 - (index & 7))) & 1 for index in range(128)]
+    rate = BIT_RATE(pitch)
+
+    repeat_samples = sample_rate * 128 / rate
+    repeats = max(1, int(-(-MIN_LOOP_SAMPLES // repeat_samples)))
+    length = max(1, round(repeat_samples * repeats))
+
+    step = rate / sample_rate
+    return array('h', (amplitude if bits[int(n * step) & 127] else -amplitude for n in range(length)))
+
+
+class NullAudio(object):
+    """
+    Silent backend for headless runs, keeps track of state only
+    """
+
+    def __init__(self):
+        self.PATTERN = DEFAULT_PATTERN
+        self.PITCH = DEFAULT_PITCH
+        self.PLAYING = False
+
+    def START(self):
+        self.PLAYING = True
+
+    def STOP(self):
+        self.PLAYING = False
+
+    def SET_PATTERN(self, pattern):
+        self.PATTERN = bytes(pattern)
+
+    def SET_PITCH(self, pitch):
+        self.PITCH = pitch
+
+
+class PygameAudio(NullAudio):
+    """
+    Plays the pattern through pygame.mixer as a looping Sound. Rendered
+    buffers are cached by (pattern, pitch), so a ROM switching between a few
+    sounds only renders each of them once.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        from pygame import mixer
+
+        NullAudio.__init__(self)
+        self.MIXER = mixer
+        self.SAMPLE_RATE = sample_rate
+        self.SOUNDS = {}
+        self.CURRENT = None
+
+        mixer.init(frequency=sample_rate, size=-16, channels=1, buffer=MIXER_BUFFER)
+
+    def SOUND(self):
+        key = (self.PATTERN, self.PITCH)
+        sound = self.SOUNDS.get(key)
+        if sound is None:
+            samples = RENDER_PATTERN(self.PATTERN, self.PITCH, self.SAMPLE_RATE)
+            sound = self.SOUNDS[key] = self.MIXER.Sound(buffer=samples.tobytes())
+        return sound
+
+    def START(self):
+        NullAudio.START(self)
+        self.CURRENT = self.SOUND()
+        self.CURRENT.play(loops=-1)
+
+    def STOP(self):
+        NullAudio.STOP(self)
+        if self.CURRENT is not None:
+            self.CURRENT.stop()
+            self.CURRENT = None
+
+    def SET_PATTERN(self, pattern):
+        NullAudio.SET_PATTERN(self, pattern)
+        self.RESTART()
+
+    def SET_PITCH(self, pitch):
+        NullAudio.SET_PITCH(self, pitch)
+        self.RESTART()
+
+    def RESTART(self):
+        """
+        Switch a playing tone over to the current pattern and pitch
+        """
+        if self.PLAYING:
+            self.STOP()
+            self.START()
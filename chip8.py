@@ -0,0 +1,276 @@
+"""
+Command line entry point, run as python -m chip8 <command>
+
+    run     play a ROM in a window
+    bench   measure headless instructions per second, or cold start time
+    disasm  disassemble a ROM
+    batch   run several ROMs headless and summarize them
+
+Only the run command imports pygame.
+"""
+
+import hashlib
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_FONT = os.path.join(ROOT, 'c8games', 'FONTS.chip8')
+
+
+def RUN_HEADLESS(rom, font=DEFAULT_FONT, instructions=100000, quirks=None, key_mask=0,
+                 resume=None, save=None, store=None, realtime=False):
+    """
+    Run a ROM without a window for a number of instructions, ticking the
+    timers once every cycles_per_frame instructions. Returns a summary.
+
+    With realtime set the frames are paced at 60 Hz by a FrameGovernor
+    instead of running flat out, and its telemetry is added to the summary.
+
+    resume and save name save state slots in the save store (in directory
+    store, or the default one): the run starts from the state in the resume
+    slot if there is one, and its final state is written to the save slot.
+    A resume state that can not be loaded is reported as the result, and
+    the run is skipped without saving.
+    """
+    from architecture import Architecture
+    from romdb import RomDatabase
+
+    settings = RomDatabase().LOOKUP_FILE(rom)
+
+    CPU = Architecture(quirks=quirks or settings['quirks'])
+    CPU.keypad.SET_MASK(key_mask)
+
+    CPU.LOAD_ROMFILE(font, 0)
+    CPU.LOAD_ROMFILE(rom)
+
+    saves = None
+    if resume is not None or save is not None:
+        from savestore import SaveStore
+
+        saves = SaveStore(store) if store else SaveStore()
+        with open(rom, 'rb') as rom_file:
+            rom_bytes = rom_file.read()
+
+    cycles_per_frame = settings['cycles_per_frame']
+    execute = CPU.EXECUTE
+    executed = 0
+    result = 'ok'
+
+    if resume is not None:
+        try:
+            saves.LOAD_STATE(CPU, rom_bytes, resume)
+        except Exception as exception:
+            result = '{}: {}'.format(type(exception).__name__, exception)
+            # Nothing ran, so leave the save slot as it is
+            save = None
+
+    governor = None
+    if realtime:
+        from governor import FrameGovernor
+
+        governor = FrameGovernor(cycles_per_frame)
+
+    start = time.perf_counter()
+    try:
+        while result == 'ok' and executed < instructions:
+            if governor is not None:
+                cycles_per_frame = governor.BEGIN_FRAME()
+            frame_start = executed
+            for _ in range(cycles_per_frame):
+                executed += 1
+                if execute() == 0x00FD:
+                    result = 'exit'
+                    break
+            if result != 'ok':
+                break
+            CPU.DECREMENT_TIMERS()
+            CPU.keypad.NEXT_FRAME()
+            if governor is not None:
+                governor.END_FRAME(executed - frame_start)
+    except Exception as exception:
+        result = '{}: {}'.format(type(exception).__name__, exception)
+    elapsed = time.perf_counter() - start
+
+    if save is not None:
+        saves.SAVE_STATE(CPU, rom_bytes, save)
+
+    summary = {
+        'rom': os.path.basename(rom),
+        'instructions': executed,
+        'seconds': elapsed,
+        'ips': executed / elapsed if elapsed else 0,
+        'result': result,
+        'screen': hashlib.sha1(bytes(CPU.screen.PIXELS)).hexdigest()[:12],
+    }
+    if governor is not None:
+        summary['telemetry'] = governor.STATS()
+    return summary
+
+
+def STARTUP_TIME(rom, runs=10, instructions=1000):
+    """
+    Cold start time of a short headless run, in milliseconds per run, measured
+    in fresh interpreters. Also checks that pygame was never imported.
+    """
+    code = (
+        'import sys; sys.path.insert(0, {root!r}); import chip8; '
+        'chip8.RUN_HEADLESS({rom!r}, instructions={instructions}); '
+        'sys.exit(1 if "pygame" in sys.modules else 0)'
+    ).format(root=ROOT, rom=os.path.abspath(rom), instructions=instructions)
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, '-c', code])
+        timings.append((time.perf_counter() - start) * 1000)
+        if process.returncode:
+            raise RuntimeError('headless run imported pygame or failed')
+
+    return timings
+
+
+def RUN(args):
+    from main import Emulator
+
+    Emulator(rom=args.rom, font_file=args.font, scale=args.scale, quirks=args.quirks, cycles_per_frame=args.cycles,
+             palette=args.palette, fade=args.fade, telemetry=args.telemetry)
+
+
+def BENCH(args):
+    if args.startup:
+        timings = STARTUP_TIME(args.rom, args.runs)
+        median = statistics.median(timings)
+        print('cold start: median {:.1f} ms, min {:.1f} ms, max {:.1f} ms over {} runs'.format(
+            median, min(timings), max(timings), len(timings)))
+        if args.max_ms is not None and median > args.max_ms:
+            print('median cold start is over the {:.1f} ms limit'.format(args.max_ms))
+            return 1
+        return 0
+
+    summary = RUN_HEADLESS(args.rom, args.font, args.instructions, args.quirks)
+    print('{rom}: {instructions} instructions in {seconds:.3f} s, {ips:,.0f} instructions/s ({result})'.format(**summary))
+    return 0
+
+
+def DISASM(args):
+    from disassembler import Disassembler
+    from romdb import RomDatabase
+
+    quirks = args.quirks or RomDatabase().LOOKUP_FILE(args.rom)['quirks']
+    disassembler = Disassembler.FROM_FILE(args.rom, quirks=quirks)
+    cfg = disassembler.TRACE()
+
+    if not args.quiet:
+        sys.stdout.write('\n'.join(disassembler.LISTING()) + '\n')
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json_file.write(cfg.TO_JSON(indent=2))
+
+    if args.dot:
+        with open(args.dot, 'w') as dot_file:
+            dot_file.write(cfg.TO_DOT(disassembler))
+    return 0
+
+
+def BATCH_ONE(job):
+    return RUN_HEADLESS(*job)
+
+
+def BATCH(args):
+    roms = [rom for rom in args.roms if os.path.abspath(rom) != os.path.abspath(args.font)]
+    jobs = [
+        (rom, args.font, args.instructions, args.quirks, 0, args.resume, args.save, args.store, args.realtime)
+        for rom in roms
+    ]
+
+    if args.jobs > 1:
+        from multiprocessing import Pool
+
+        with Pool(args.jobs) as pool:
+            summaries = pool.map(BATCH_ONE, jobs)
+    else:
+        summaries = [BATCH_ONE(job) for job in jobs]
+
+    failed = 0
+    for summary in summaries:
+        print('{rom:<12} {instructions:>9} {ips:>12,.0f}/s  screen {screen}  {result}'.format(**summary))
+        if 'telemetry' in summary:
+            print('{:<12} {fps:.2f} fps, frame time p50 {p50:.2f} ms p99 {p99:.2f} ms, {late_frames} late, '
+                  '{dropped_frames} dropped, {cycles_per_frame}/{target_cycles_per_frame} instructions per frame'.format(
+                      '', **dict(summary['telemetry'], **summary['telemetry']['frame_ms'])))
+        failed += summary['result'] not in ('ok', 'exit')
+    return 1 if failed else 0
+
+
+def FADE_FRAMES(value):
+    """
+    argparse type for --fade, a number of frames the palette has room for
+    """
+    import argparse
+
+    from presenter import MAX_FADE
+
+    frames = int(value)
+    if not 0 <= frames <= MAX_FADE:
+        raise argparse.ArgumentTypeError('must be between 0 and {}'.format(MAX_FADE))
+    return frames
+
+
+def MAIN(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='python -m chip8', description='CHIP-8 emulator')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='play a ROM in a window')
+    run.add_argument('rom')
+    run.add_argument('--scale', type=int, default=10)
+    run.add_argument('--quirks', help='quirk profile, default from the ROM database')
+    run.add_argument('--cycles', type=int, help='instructions per frame, default from the ROM database')
+    run.add_argument('--palette', default='mono', choices=['mono', 'green', 'amber', 'octo'])
+    run.add_argument('--fade', type=FADE_FRAMES, default=0, metavar='FRAMES', help='phosphor fade length, 0 for none')
+    run.add_argument('--telemetry', metavar='FILE', help='write frame pacing telemetry as JSON on exit')
+    run.set_defaults(handler=RUN)
+
+    bench = commands.add_parser('bench', help='measure headless speed or cold start time')
+    bench.add_argument('rom')
+    bench.add_argument('--instructions', type=int, default=200000)
+    bench.add_argument('--quirks')
+    bench.add_argument('--startup', action='store_true', help='measure cold start time instead')
+    bench.add_argument('--runs', type=int, default=10)
+    bench.add_argument('--max-ms', type=float, help='fail if the median cold start is slower')
+    bench.set_defaults(handler=BENCH)
+
+    disasm = commands.add_parser('disasm', help='disassemble a ROM')
+    disasm.add_argument('rom')
+    disasm.add_argument('--quirks', help='quirk profile, default from the ROM database')
+    disasm.add_argument('--json', metavar='FILE', help='write the control flow graph as JSON')
+    disasm.add_argument('--dot', metavar='FILE', help='write the control flow graph in DOT format')
+    disasm.add_argument('--quiet', action='store_true', help='do not print the listing')
+    disasm.set_defaults(handler=DISASM)
+
+    batch = commands.add_parser('batch', help='run ROMs headless and summarize them')
+    batch.add_argument('roms', nargs='+')
+    batch.add_argument('--instructions', type=int, default=100000)
+    batch.add_argument('--quirks')
+    batch.add_argument('--jobs', type=int, default=1)
+    batch.add_argument('--resume', metavar='SLOT', help='start each ROM from its save state in SLOT, if any')
+    batch.add_argument('--save', metavar='SLOT', help='save the final state of each ROM in SLOT')
+    batch.add_argument('--store', metavar='DIR', help='save store directory')
+    batch.add_argument('--realtime', action='store_true', help='pace each ROM at 60 frames per second')
+    batch.set_defaults(handler=BATCH)
+
+    for command in (run, bench, batch):
+        command.add_argument('--font', default=DEFAULT_FONT)
+
+    args = parser.parse_args(argv)
+    return args.handler(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(MAIN())
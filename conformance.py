@@ -0,0 +1,400 @@
+from architecture import Architecture
+from exceptions import UnknownOpCodeException
+from quirks import QUIRK_PROFILES, DEFAULT_PROFILE
+
+import functools
+import hashlib
+import json
+import os
+import random
+import sys
+
+
+def REFERENCE_CORE(seed=None, quirks=DEFAULT_PROFILE):
+    return Architecture(seed=seed, quirks=quirks)
+
+
+# Cores the harness can compare, by name. Every factory takes a seed for
+# RND_REG and returns a headless core. Every quirk profile is available
+# under its own name.
+CORES = {
+    'reference': REFERENCE_CORE,
+}
+
+for profile in QUIRK_PROFILES:
+    CORES[profile] = functools.partial(REFERENCE_CORE, quirks=profile)
+
+# Cache of randomized opcode test results, see TEST_OPCODES
+DEFAULT_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.conformance_cache.json')
+
+
+def STATE(cpu):
+    """
+    The full state of a core in comparable form, with the frame buffer hashed
+    """
+    state = cpu.SNAPSHOT()
+    HEIGHT, WIDTH, PIXELS = state['screen']
+    state['screen'] = '{}x{}:{}'.format(WIDTH, HEIGHT, hashlib.sha1(PIXELS).hexdigest())
+    return state
+
+
+def COMPARE(state_a, state_b):
+    """
+    Returns a list of human readable differences between two STATEs
+    """
+    differences = []
+    for field in state_a:
+        a, b = state_a[field], state_b[field]
+        if a == b:
+            continue
+
+        if field == 'memory':
+            address = next(i for i in range(len(a)) if a[i] != b[i])
+            differences.append('memory[{:03X}]: {:02X} != {:02X}'.format(address, a[address], b[address]))
+        elif field == 'V':
+            register = next(i for i in range(16) if a[i] != b[i])
+            differences.append('V{:X}: {:02X} != {:02X}'.format(register, a[register], b[register]))
+        else:
+            differences.append('{}: {} != {}'.format(field, a, b))
+
+    return differences
+
+
+def RUN_ONE(cpu, operand=None):
+    """
+    Execute one instruction, returning the exception type raised if any
+    """
+    try:
+        cpu.EXECUTE(operand)
+    except Exception as exception:
+        return type(exception).__name__
+    return None
+
+
+def LOCKSTEP(rom, font, reference='reference', candidate='reference', instructions=100000,
+             every=1, script=None, seed=0, ticks=10):
+    """
+    Run two cores on the same ROM and input script, comparing their full
+    state every `every` instructions. The script is a list of
+    (instruction, key mask) pairs. Returns None if the cores agree, or a
+    dictionary describing the first mismatch.
+    """
+
+    cores = [CORES[reference](seed), CORES[candidate](seed)]
+    for cpu in cores:
+        cpu.LOAD_ROMFILE(font, 0)
+        cpu.LOAD_ROMFILE(rom)
+
+    script = sorted(script or [])
+    next_event = 0
+    last_checked = 0
+
+    for count in range(instructions):
+        while next_event < len(script) and script[next_event][0] <= count:
+            for cpu in cores:
+                cpu.keypad.SET_MASK(script[next_event][1])
+            next_event += 1
+
+        pc = cores[0].CpuRegisters['PC']
+        errors = [RUN_ONE(cpu) for cpu in cores]
+
+        if count % ticks == ticks - 1:
+            for cpu in cores:
+                cpu.DECREMENT_TIMERS()
+                cpu.keypad.NEXT_FRAME()
+
+        exited = [cpu.CurrentOperand == 0x00FD for cpu in cores]
+        if errors[0] or errors[1] or exited[0] or exited[1] or (count + 1) % every == 0:
+            differences = COMPARE(STATE(cores[0]), STATE(cores[1]))
+            if errors[0] != errors[1]:
+                differences.insert(0, 'exception: {} != {}'.format(errors[0], errors[1]))
+
+            if differences:
+                return {
+                    'instruction': count,
+                    'last_agreed': last_checked,
+                    'pc': pc,
+                    'opcode': cores[0].CurrentOperand,
+                    'differences': differences,
+                }
+
+            last_checked = count
+            if errors[0] or exited[0]:
+                break
+
+    return None
+
+
+def RANDOM_STATE(cpu, rng):
+    """
+    A random but valid machine state for the given core
+    """
+    cpu.RESET()
+    if rng.random() < 0.5:
+        cpu.ENABLE_EXT()
+    else:
+        cpu.DISABLE_EXT()
+
+    state = cpu.SNAPSHOT()
+    HEIGHT, WIDTH, _ = state['screen']
+
+    state['memory'] = rng.randbytes(cpu.MAX_MEMORY)
+    state['V'] = [rng.getrandbits(8) for _ in range(16)]
+    state['I'] = rng.randrange(0, cpu.MAX_MEMORY - 0x40)
+    depth = rng.randint(1, 8)
+    state['SP'] = cpu.STACK_POINTER_START + 2 * depth
+    state['STACK'] = [rng.randrange(cpu.PROGRAM_COUNTER_START, cpu.MAX_MEMORY, 2) for _ in range(depth)]
+    state['PC'] = rng.randrange(cpu.PROGRAM_COUNTER_START, cpu.MAX_MEMORY - 0x100, 2)
+    state['RPL'] = bytes(rng.getrandbits(8) for _ in range(16))
+    state['DT'] = rng.getrandbits(8)
+    state['ST'] = rng.getrandbits(8)
+    if cpu.QUIRKS['xochip']:
+        state['PLANES'] = rng.randrange(4)
+        state['PATTERN'] = rng.randbytes(16)
+        state['PITCH'] = rng.getrandbits(8)
+        pixels = bytes(rng.getrandbits(2) for _ in range(HEIGHT * WIDTH))
+    else:
+        pixels = bytes(rng.getrandbits(1) for _ in range(HEIGHT * WIDTH))
+    state['screen'] = (HEIGHT, WIDTH, pixels)
+    return state
+
+
+def OPCODE_CASES(cpu):
+    """
+    Returns (name, handler, opcode generator) for every entry of the lookup
+    tables, including the XO-CHIP 5STN table if the core dispatches to it.
+    The generators take a random.Random and return an opcode that
+    dispatches to the entry.
+    """
+
+    def fields(rng):
+        return (rng.getrandbits(4) << 8) | (rng.getrandbits(4) << 4)
+
+    SYS_OPCODES = [0x00C0 | n for n in range(1, 16)] + [0x00D0 | n for n in range(1, 16)]
+    SYS_OPCODES += [0x00E0, 0x00EE, 0x00FB, 0x00FC, 0x00FD, 0x00FE, 0x00FF]
+
+    cases = []
+    for key, handler in sorted(cpu.OperationLookupTable.items()):
+        if key == 0x0:
+            generator = lambda rng: rng.choice(SYS_OPCODES)
+        elif key == 0xE:
+            generator = lambda rng: 0xE000 | (rng.getrandbits(4) << 8) | rng.choice([0x9E, 0xA1])
+        else:
+            generator = lambda rng, key=key: (key << 12) | rng.randrange(1, 0x1000)
+        cases.append(('OperationLookupTable[{:X}]'.format(key), handler, generator))
+
+    for key, handler in sorted(cpu.ELILookup.items()):
+        generator = lambda rng, key=key: 0x8000 | fields(rng) | key
+        cases.append(('ELILookup[{:X}]'.format(key), handler, generator))
+
+    for key, handler in sorted(cpu.MSCLookup.items()):
+        generator = lambda rng, key=key: 0xF000 | (rng.getrandbits(4) << 8) | key
+        cases.append(('MSCLookup[{:02X}]'.format(key), handler, generator))
+
+    if cpu.OperationLookupTable[0x5] == cpu.RANGE:
+        for key, handler in sorted(cpu.RANGELookup.items()):
+            generator = lambda rng, key=key: 0x5000 | fields(rng) | key
+            cases.append(('RANGELookup[{:X}]'.format(key), handler, generator))
+
+    return cases
+
+
+# Types of module globals and class constants whose value is hashed with
+# the code that uses them, the lookup tables and constants handlers read
+DATA_TYPES = (int, str, bytes, bytearray, tuple, list, dict, frozenset, bool, type(None))
+
+
+def HANDLER_HASH(cpu, handler):
+    """
+    Hash of the code of a handler and every method of the core, or its
+    screen, keypad and audio backend, that it reaches by name, together
+    with the module globals and class constants that code reads (tables
+    such as screen.EXPAND) and the quirk profile of the core. A change
+    anywhere in those changes the hash, which invalidates the cached test
+    result.
+    """
+    digest = hashlib.sha1()
+    digest.update(repr(sorted(cpu.QUIRKS.items())).encode())
+
+    owners = (cpu, cpu.screen, cpu.keypad, cpu.audio)
+    seen = set()
+    hashed = set()
+    pending = [handler]
+
+    def HASH_VALUE(name, value):
+        if isinstance(value, DATA_TYPES) and (name, id(value)) not in hashed:
+            hashed.add((name, id(value)))
+            digest.update('{}={!r}'.format(name, value).encode())
+
+    while pending:
+        function = pending.pop()
+        function = getattr(function, '__func__', function)
+        code = getattr(function, '__code__', None)
+        if code is None or code in seen:
+            continue
+        seen.add(code)
+
+        codes = [code]
+        while codes:
+            current = codes.pop()
+            digest.update(current.co_code)
+            digest.update(repr([c for c in current.co_consts if not hasattr(c, 'co_code')]).encode())
+            digest.update(repr(current.co_names).encode())
+            codes.extend(c for c in current.co_consts if hasattr(c, 'co_code'))
+
+            for name in current.co_names:
+                for owner in owners:
+                    attribute = getattr(owner, name, None)
+                    if callable(attribute) and hasattr(getattr(attribute, '__func__', attribute), '__code__'):
+                        pending.append(attribute)
+
+                    # Constants defined on the class, not the state of the instance
+                    HASH_VALUE(name, getattr(type(owner), name, None))
+
+                if name in function.__globals__:
+                    value = function.__globals__[name]
+                    if callable(value) and hasattr(value, '__code__'):
+                        pending.append(value)
+                    else:
+                        HASH_VALUE(name, value)
+
+        for cell in function.__closure__ or ():
+            if callable(cell.cell_contents):
+                pending.append(cell.cell_contents)
+
+    return digest.hexdigest()
+
+
+def TEST_OPCODES(reference='reference', candidate='reference', trials=200, seed=0,
+                 cache=DEFAULT_CACHE, force=False):
+    """
+    Randomized opcode level test of every lookup table entry. Each trial
+    puts both cores in the same random state, executes one generated opcode
+    and compares the full state afterwards.
+
+    Results are cached by the hash of the handler code of both cores, so
+    running this again only retests handlers that changed. Returns a list of
+    (name, result, detail, cached) tuples.
+    """
+
+    cores = [CORES[reference](seed), CORES[candidate](seed)]
+
+    results = {}
+    if cache and os.path.exists(cache) and not force:
+        with open(cache) as cache_file:
+            results = json.load(cache_file)
+
+    # Match the entries of both cores by name, the XO-CHIP tables have more of them
+    candidate_handlers = {name: handler for name, handler, _ in OPCODE_CASES(cores[1])}
+
+    report = []
+    for name, handler_a, generator in OPCODE_CASES(cores[0]):
+        if name not in candidate_handlers:
+            report.append((name, 'fail', 'not implemented by {}'.format(candidate), False))
+            continue
+
+        handler_b = candidate_handlers[name]
+        cache_key = '{}/{}:{}'.format(reference, candidate, name)
+        fingerprint = '{}:{}:{}:{}'.format(
+            HANDLER_HASH(cores[0], handler_a), HANDLER_HASH(cores[1], handler_b), trials, seed
+        )
+
+        cached = results.get(cache_key)
+        if cached and cached['fingerprint'] == fingerprint:
+            report.append((name, cached['result'], cached['detail'], True))
+            continue
+
+        rng = random.Random('{}:{}'.format(seed, name))
+        result, detail = 'pass', ''
+
+        for trial in range(trials):
+            state = RANDOM_STATE(cores[0], rng)
+            opcode = generator(rng)
+            mask = rng.getrandbits(16)
+            trial_seed = rng.getrandbits(32)
+
+            outcomes = []
+            for cpu in cores:
+                cpu.RESTORE(state)
+                cpu.RANDOM.seed(trial_seed)
+                cpu.keypad.RESET()
+                cpu.keypad.SET_MASK(mask)
+                outcomes.append((RUN_ONE(cpu, opcode), STATE(cpu)))
+
+            (error_a, state_a), (error_b, state_b) = outcomes
+            differences = COMPARE(state_a, state_b)
+            if error_a != error_b:
+                differences.insert(0, 'exception: {} != {}'.format(error_a, error_b))
+
+            # The reference must keep every register in range as well
+            if error_a is None and not all(0 <= value <= 0xFF for value in state_a['V']):
+                differences.append('register out of range: {}'.format(state_a['V']))
+
+            if differences:
+                result = 'fail'
+                detail = '{:04X}: {}'.format(opcode, '; '.join(differences))
+                break
+
+            if error_a is not None and error_a != UnknownOpCodeException.__name__:
+                result = 'error'
+                detail = '{:04X}: {}'.format(opcode, error_a)
+
+        results[cache_key] = {'fingerprint': fingerprint, 'result': result, 'detail': detail}
+        report.append((name, result, detail, False))
+
+    if cache:
+        with open(cache, 'w') as cache_file:
+            json.dump(results, cache_file, indent=2, sort_keys=True)
+
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from chip8 import DEFAULT_FONT
+
+    parser = argparse.ArgumentParser(description='Check that two CHIP-8 cores behave identically')
+    parser.add_argument('--reference', default='reference', choices=sorted(CORES))
+    parser.add_argument('--candidate', default='reference', choices=sorted(CORES))
+    parser.add_argument('--seed', type=int, default=0)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    lockstep = commands.add_parser('lockstep', help='run both cores on a ROM in lockstep')
+    lockstep.add_argument('rom')
+    lockstep.add_argument('--font', default=DEFAULT_FONT)
+    lockstep.add_argument('--instructions', type=int, default=100000)
+    lockstep.add_argument('--every', type=int, default=1, help='compare state every N instructions')
+    lockstep.add_argument('--script', help='JSON list of [instruction, key mask] pairs')
+
+    opcodes = commands.add_parser('opcodes', help='randomized test of every lookup table entry')
+    opcodes.add_argument('--trials', type=int, default=200)
+    opcodes.add_argument('--cache', default=DEFAULT_CACHE)
+    opcodes.add_argument('--force', action='store_true', help='ignore cached results')
+
+    args = parser.parse_args()
+
+    if args.command == 'lockstep':
+        script = None
+        if args.script:
+            with open(args.script) as script_file:
+                script = json.load(script_file)
+
+        mismatch = LOCKSTEP(args.rom, args.font, args.reference, args.candidate,
+                            args.instructions, args.every, script, args.seed)
+        if mismatch is None:
+            print('Cores agree')
+        else:
+            print('Mismatch after instruction {} (PC {:03X}, opcode {:04X}), last agreed at {}'.format(
+                mismatch['instruction'], mismatch['pc'], mismatch['opcode'], mismatch['last_agreed']))
+            for difference in mismatch['differences']:
+                print('  ' + difference)
+            sys.exit(1)
+
+    if args.command == 'opcodes':
+        failed = False
+        for name, result, detail, cached in TEST_OPCODES(args.reference, args.candidate, args.trials,
+                                                         args.seed, args.cache, args.force):
+            failed = failed or result != 'pass'
+            print('{:<24} {:<5} {}{}'.format(name, result, '(cached) ' if cached else '', detail).rstrip())
+        sys.exit(1 if failed else 0)
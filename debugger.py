@@ -0,0 +1,500 @@
+from architecture import Architecture
+from disassembler import Disassembler
+from exceptions import WatchpointException
+
+import cmd
+import keyboard
+import sys
+import time
+
+
+class Debugger(object):
+    """
+    Breakpoints, watchpoints and stepping on top of an Architecture.
+
+    Breakpoints are kept in a bitmap with one byte per address, and RUN
+    picks its inner loop from what is currently set: with no breakpoints it
+    is the same bare EXECUTE loop the emulator uses, so an attached debugger
+    costs nothing until something is set. Watchpoints work the same way by
+    swapping the handlers that write to memory in the CPU lookup tables,
+    only while at least one watchpoint exists.
+
+    While running, the timers tick at 60 Hz of wall clock time. pygame is
+    never imported here, window events are only read when a window is open.
+    """
+
+    # Stop reasons returned by RUN and the stepping functions
+    STEPPED = 'step'
+    BREAKPOINT = 'breakpoint'
+    WATCHPOINT = 'watchpoint'
+    EXIT = 'exit'
+    LIMIT = 'limit'
+    STOPPED = 'stop'
+    QUIT = 'quit'
+
+    # Instructions executed between looks at the clock while running
+    INSTRUCTIONS_PER_CHECK = 64
+
+    # Timer ticks per second of wall clock time
+    TICK_RATE = 60
+
+    # Names usable in breakpoint conditions
+    REGISTER_NAMES = ['V{:X}'.format(i) for i in range(16)] + ['I', 'PC', 'SP', 'DT', 'ST']
+
+    def __init__(self, cpu):
+        self.CPU = cpu
+
+        self.BREAKPOINTS = bytearray(cpu.MAX_MEMORY)
+        self.BREAKPOINT_COUNT = 0
+        self.CONDITIONS = {}            # address -> (expression, code object)
+
+        self.WATCHPOINTS = bytearray(cpu.MAX_MEMORY)
+        self.WATCHPOINT_COUNT = 0
+        self.ORIGINAL_HANDLERS = None
+
+        self.INSTRUCTION_COUNT = 0
+        self.LAST_WATCHPOINT = None
+        self.NEXT_TICK = None
+
+    # Breakpoints
+    def ADD_BREAKPOINT(self, address, condition=None):
+        """
+        Break before executing the instruction at address. If a condition is
+        given (a python expression over V0-VF, I, PC, SP, DT and ST) the
+        breakpoint only triggers when it evaluates to true.
+        """
+        if condition:
+            self.CONDITIONS[address] = (condition, compile(condition, '<condition>', 'eval'))
+        else:
+            self.CONDITIONS.pop(address, None)
+
+        if not self.BREAKPOINTS[address]:
+            self.BREAKPOINTS[address] = 1
+            self.BREAKPOINT_COUNT += 1
+
+    def REMOVE_BREAKPOINT(self, address):
+        self.CONDITIONS.pop(address, None)
+
+        if self.BREAKPOINTS[address]:
+            self.BREAKPOINTS[address] = 0
+            self.BREAKPOINT_COUNT -= 1
+
+    def SHOULD_BREAK(self, address):
+        """
+        Called only for addresses set in the bitmap, evaluates the condition
+        """
+        if address not in self.CONDITIONS:
+            return True
+
+        return bool(eval(self.CONDITIONS[address][1], {}, self.REGISTERS()))
+
+    # Watchpoints
+    def ADD_WATCHPOINT(self, start, end=None):
+        """
+        Break after any instruction that writes to memory in [start, end]
+        """
+        end = start if end is None else end
+
+        for address in range(start, end + 1):
+            if not self.WATCHPOINTS[address]:
+                self.WATCHPOINTS[address] = 1
+                self.WATCHPOINT_COUNT += 1
+
+        if self.WATCHPOINT_COUNT and self.ORIGINAL_HANDLERS is None:
+            self.INSTALL_WATCH_HANDLERS()
+
+    def REMOVE_WATCHPOINT(self, start, end=None):
+        end = start if end is None else end
+
+        for address in range(start, end + 1):
+            if self.WATCHPOINTS[address]:
+                self.WATCHPOINTS[address] = 0
+                self.WATCHPOINT_COUNT -= 1
+
+        if not self.WATCHPOINT_COUNT and self.ORIGINAL_HANDLERS is not None:
+            self.REMOVE_WATCH_HANDLERS()
+
+    def INSTALL_WATCH_HANDLERS(self):
+        """
+        Swap every handler that writes to memory for a version that checks
+        the written range against the watchpoint bitmap once it is done.
+        """
+        cpu = self.CPU
+        call = cpu.OperationLookupTable[0x2]
+        bcd = cpu.MSCLookup[0x33]
+        store = cpu.MSCLookup[0x55]
+        save = cpu.RANGELookup[0x2]
+        self.ORIGINAL_HANDLERS = (call, bcd, store, save)
+
+        def WATCHED_JMP_SBR():
+            address = cpu.CpuRegisters['SP']
+            call()
+            self.CHECK_WRITE(address, 2)
+
+        def WATCHED_STR_BCD_MEM():
+            address = cpu.CpuRegisters['I']
+            bcd()
+            self.CHECK_WRITE(address, 3)
+
+        def WATCHED_STR_REG_MEM():
+            address = cpu.CpuRegisters['I']
+            count = ((cpu.CurrentOperand & 0x0F00) >> 8) + 1
+            store()
+            self.CHECK_WRITE(address, count)
+
+        def WATCHED_STR_RANGE_MEM():
+            address = cpu.CpuRegisters['I']
+            count = abs(((cpu.CurrentOperand & 0x0F00) >> 8) - ((cpu.CurrentOperand & 0x00F0) >> 4)) + 1
+            save()
+            self.CHECK_WRITE(address, count)
+
+        # With the internal stack quirk calls do not write to memory
+        if cpu.QUIRKS['stack'] == 'memory':
+            cpu.OperationLookupTable[0x2] = WATCHED_JMP_SBR
+        cpu.MSCLookup[0x33] = WATCHED_STR_BCD_MEM
+        cpu.MSCLookup[0x55] = WATCHED_STR_REG_MEM
+        cpu.RANGELookup[0x2] = WATCHED_STR_RANGE_MEM
+
+    def REMOVE_WATCH_HANDLERS(self):
+        cpu = self.CPU
+        call, bcd, store, save = self.ORIGINAL_HANDLERS
+        cpu.OperationLookupTable[0x2] = call
+        cpu.MSCLookup[0x33] = bcd
+        cpu.MSCLookup[0x55] = store
+        cpu.RANGELookup[0x2] = save
+        self.ORIGINAL_HANDLERS = None
+
+    def CHECK_WRITE(self, start, count):
+        for address in range(start, start + count):
+            if self.WATCHPOINTS[address]:
+                raise WatchpointException(address, self.CPU.memory[address])
+
+    # Execution
+    def RUN(self, limit=None, stop=None):
+        """
+        Run until a breakpoint, a watchpoint, an exit instruction or until
+        limit instructions have executed. Returns the reason for stopping.
+
+        stop is an address to stop at, whatever the breakpoints there say,
+        used by RUN_TO so its stops never mix with the user's breakpoints.
+        """
+        cpu = self.CPU
+        execute = cpu.EXECUTE
+        registers = cpu.CpuRegisters
+        breakpoints = self.BREAKPOINTS
+        remaining = limit
+
+        # Resuming from a breakpoint or the stop, execute the instruction under it first
+        address = registers['PC']
+        if address == stop or (self.BREAKPOINT_COUNT and breakpoints[address]):
+            reason = self.STEP()
+            if reason != self.STEPPED:
+                return reason
+            if remaining is not None:
+                remaining -= 1
+
+        # Ticks are due from now on, not for the time spent at the prompt
+        frame_time = 1.0 / self.TICK_RATE
+        now = time.perf_counter()
+        if self.NEXT_TICK is None or now - self.NEXT_TICK > frame_time:
+            self.NEXT_TICK = now + frame_time
+
+        while remaining is None or remaining > 0:
+            count = self.INSTRUCTIONS_PER_CHECK if remaining is None else min(self.INSTRUCTIONS_PER_CHECK, remaining)
+            executed = 0
+
+            try:
+                if not self.BREAKPOINT_COUNT and stop is None:
+                    while executed < count:
+                        executed += 1
+                        if execute() == 0x00FD:
+                            return self.EXIT
+                else:
+                    while executed < count:
+                        address = registers['PC']
+                        if address == stop:
+                            return self.STOPPED
+                        if breakpoints[address] and self.SHOULD_BREAK(address):
+                            return self.BREAKPOINT
+                        executed += 1
+                        if execute() == 0x00FD:
+                            return self.EXIT
+            except WatchpointException as exception:
+                self.LAST_WATCHPOINT = exception
+                return self.WATCHPOINT
+            finally:
+                self.INSTRUCTION_COUNT += executed
+
+            if remaining is not None:
+                remaining -= count
+
+            now = time.perf_counter()
+            if now >= self.NEXT_TICK:
+                self.NEXT_TICK = max(self.NEXT_TICK + frame_time, now)
+                if not self.TICK():
+                    return self.QUIT
+
+        return self.LIMIT
+
+    def TICK(self):
+        """
+        Keep the timers, keypad and display alive while running. Returns
+        False once the window has been closed.
+        """
+        self.CPU.DECREMENT_TIMERS()
+        self.CPU.screen.PRESENT()
+
+        keypad = self.CPU.keypad
+        keypad.NEXT_FRAME()
+
+        # Only a Screen window imports pygame and opens the display
+        pygame = sys.modules.get('pygame')
+        if pygame is None or not pygame.display.get_init():
+            return True
+
+        running = True
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type in (pygame.KEYDOWN, pygame.KEYUP):
+                keypad.HOST_KEY(event.key, event.type == pygame.KEYDOWN)
+        return running
+
+    def STEP(self):
+        """
+        Execute exactly one instruction
+        """
+        try:
+            operand = self.CPU.EXECUTE()
+        except WatchpointException as exception:
+            self.LAST_WATCHPOINT = exception
+            return self.WATCHPOINT
+        finally:
+            self.INSTRUCTION_COUNT += 1
+
+        if operand == 0x00FD:
+            return self.EXIT
+
+        return self.STEPPED
+
+    def STEP_OVER(self):
+        """
+        Execute one instruction, running a whole subroutine if it is a CALL
+        """
+        cpu = self.CPU
+        address = cpu.CpuRegisters['PC']
+
+        if self.OPCODE_AT(address) & 0xF000 != 0x2000:
+            return self.STEP()
+
+        return self.RUN_TO(address + 2, cpu.CpuRegisters['SP'])
+
+    def STEP_OUT(self):
+        """
+        Run until the current subroutine returns
+        """
+        stack = self.STACK()
+
+        if not stack:
+            return self.STEP()
+
+        return self.RUN_TO(stack[-1], self.CPU.CpuRegisters['SP'] - 2)
+
+    def RUN_TO(self, address, sp):
+        """
+        Run until PC reaches address with the stack pointer at sp. Hitting
+        the same address deeper in the stack (recursion) keeps running, and
+        a user breakpoint anywhere else stops the run as usual.
+        """
+        registers = self.CPU.CpuRegisters
+
+        reason = self.STEP()
+        while reason in (self.STEPPED, self.STOPPED, self.BREAKPOINT):
+            if registers['PC'] == address and registers['SP'] == sp:
+                return self.STEPPED
+            if reason == self.BREAKPOINT:
+                return reason
+            reason = self.RUN(stop=address)
+        return reason
+
+    # Inspection
+    def OPCODE_AT(self, address):
+        return (self.CPU.memory[address] << 8) | self.CPU.memory[address + 1]
+
+    def REGISTERS(self):
+        """
+        Returns the registers as a dictionary keyed by REGISTER_NAMES
+        """
+        cpu = self.CPU
+        registers = {'V{:X}'.format(i): cpu.GeneralRegisters[i] for i in range(16)}
+        registers['I'] = cpu.CpuRegisters['I']
+        registers['PC'] = cpu.CpuRegisters['PC']
+        registers['SP'] = cpu.CpuRegisters['SP']
+        registers['DT'] = cpu.Timers['DT']
+        registers['ST'] = cpu.Timers['ST']
+        return registers
+
+    def STACK(self):
+        """
+        Returns the return addresses on the call stack, oldest first
+        """
+        return self.CPU.CALL_STACK()
+
+    def DISASSEMBLE(self, address, count=1):
+        lines = []
+        for _ in range(count):
+            opcode = self.OPCODE_AT(address)
+            next_word = self.OPCODE_AT(address + 2) if address + 3 < len(self.CPU.memory) else None
+            mnemonic, operands, _, _ = Disassembler.DECODE(opcode, next_word, self.CPU.QUIRKS)
+            marker = '*' if self.BREAKPOINTS[address] else ' '
+            lines.append('{}{:03X}: {:04X}  {:<5} {}'.format(marker, address, opcode, mnemonic, operands).rstrip())
+            address += Disassembler.SIZE(opcode, self.CPU.QUIRKS)
+        return lines
+
+
+class DebuggerShell(cmd.Cmd):
+    """
+    Interactive command line front end for the Debugger
+    """
+
+    prompt = '(chip8) '
+    intro = 'CHIP-8 debugger, type help or ? to list commands.'
+
+    def __init__(self, debugger):
+        cmd.Cmd.__init__(self)
+        self.DEBUGGER = debugger
+
+    @staticmethod
+    def PARSE_ADDRESS(text):
+        return int(text, 16)
+
+    def REPORT(self, reason):
+        """
+        Print why the CPU stopped. Returns True, which ends the shell, once
+        the window has been closed.
+        """
+        debugger = self.DEBUGGER
+        if reason == Debugger.QUIT:
+            return True
+        if reason == Debugger.WATCHPOINT:
+            print(debugger.LAST_WATCHPOINT)
+        elif reason == Debugger.EXIT:
+            print('Program exited')
+        elif reason != Debugger.STEPPED:
+            print('Stopped: {}'.format(reason))
+        print('\n'.join(debugger.DISASSEMBLE(debugger.CPU.CpuRegisters['PC'])))
+
+    def emptyline(self):
+        pass
+
+    def do_break(self, arg):
+        """break ADDR [CONDITION] - break at ADDR (hex), optionally only when CONDITION holds"""
+        address, _, condition = arg.partition(' ')
+        self.DEBUGGER.ADD_BREAKPOINT(self.PARSE_ADDRESS(address), condition.strip() or None)
+
+    def do_delete(self, arg):
+        """delete ADDR - remove the breakpoint at ADDR"""
+        self.DEBUGGER.REMOVE_BREAKPOINT(self.PARSE_ADDRESS(arg))
+
+    def do_watch(self, arg):
+        """watch START [END] - break after writes to memory in START-END"""
+        addresses = [self.PARSE_ADDRESS(a) for a in arg.split()]
+        self.DEBUGGER.ADD_WATCHPOINT(*addresses)
+
+    def do_unwatch(self, arg):
+        """unwatch START [END] - remove watchpoints in START-END"""
+        addresses = [self.PARSE_ADDRESS(a) for a in arg.split()]
+        self.DEBUGGER.REMOVE_WATCHPOINT(*addresses)
+
+    def do_info(self, arg):
+        """info - list breakpoints and watchpoints"""
+        debugger = self.DEBUGGER
+        for address in range(len(debugger.BREAKPOINTS)):
+            if debugger.BREAKPOINTS[address]:
+                condition = debugger.CONDITIONS.get(address, ('',))[0]
+                print('break {:03X} {}'.format(address, condition).rstrip())
+            if debugger.WATCHPOINTS[address]:
+                print('watch {:03X}'.format(address))
+
+    def do_step(self, arg):
+        """step [N] - execute N instructions (default 1)"""
+        reason = Debugger.STEPPED
+        for _ in range(int(arg or 1)):
+            reason = self.DEBUGGER.STEP()
+            if reason != Debugger.STEPPED:
+                break
+        return self.REPORT(reason)
+
+    def do_next(self, arg):
+        """next - step over subroutine calls"""
+        return self.REPORT(self.DEBUGGER.STEP_OVER())
+
+    def do_finish(self, arg):
+        """finish - run until the current subroutine returns"""
+        return self.REPORT(self.DEBUGGER.STEP_OUT())
+
+    def do_continue(self, arg):
+        """continue [N] - run until a breakpoint or watchpoint, or for N instructions"""
+        try:
+            reason = self.DEBUGGER.RUN(int(arg) if arg else None)
+        except KeyboardInterrupt:
+            reason = 'interrupted'
+        return self.REPORT(reason)
+
+    def do_regs(self, arg):
+        """regs - show the registers"""
+        registers = self.DEBUGGER.REGISTERS()
+        print(' '.join('{}={:02X}'.format(name, registers[name]) for name in Debugger.REGISTER_NAMES[:16]))
+        print(' '.join('{}={:03X}'.format(name, registers[name]) for name in Debugger.REGISTER_NAMES[16:]))
+
+    def do_stack(self, arg):
+        """stack - show the return addresses on the call stack"""
+        for depth, address in enumerate(reversed(self.DEBUGGER.STACK())):
+            print('#{} {:03X}'.format(depth, address))
+
+    def do_mem(self, arg):
+        """mem ADDR [LEN] - dump LEN bytes of memory from ADDR"""
+        parts = arg.split()
+        address = self.PARSE_ADDRESS(parts[0])
+        length = int(parts[1]) if len(parts) > 1 else 16
+        memory = self.DEBUGGER.CPU.memory
+        for row in range(address, address + length, 16):
+            values = memory[row:min(row + 16, address + length)]
+            print('{:03X}: {}'.format(row, ' '.join('{:02X}'.format(value) for value in values)))
+
+    def do_list(self, arg):
+        """list [ADDR] [N] - disassemble N instructions from ADDR (default PC)"""
+        parts = arg.split()
+        address = self.PARSE_ADDRESS(parts[0]) if parts else self.DEBUGGER.CPU.CpuRegisters['PC']
+        count = int(parts[1]) if len(parts) > 1 else 8
+        print('\n'.join(self.DEBUGGER.DISASSEMBLE(address, count)))
+
+    def do_quit(self, arg):
+        """quit - leave the debugger"""
+        return True
+
+    do_b = do_break
+    do_s = do_step
+    do_n = do_next
+    do_c = do_continue
+    do_q = do_quit
+    do_EOF = do_quit
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from chip8 import DEFAULT_FONT
+
+    parser = argparse.ArgumentParser(description='Debug a CHIP-8 ROM')
+    parser.add_argument('rom', help='ROM file to debug')
+    parser.add_argument('--font', default=DEFAULT_FONT, help='font file loaded at address 0')
+    parser.add_argument('--scale', type=int, default=10, help='display scale')
+    args = parser.parse_args()
+
+    CPU = Architecture(args.scale)
+    CPU.keypad.BIND(keyboard.KEY_MAPPINGS)
+    CPU.LOAD_ROMFILE(args.font, 0)
+    CPU.LOAD_ROMFILE(args.rom)
+
+    DebuggerShell(Debugger(CPU)).cmdloop()
@@ -0,0 +1,528 @@
+from quirks import QUIRK_PROFILES, DEFAULT_PROFILE
+
+import json
+import sys
+
+
+class BasicBlock(object):
+    """
+    A straight line run of instructions with a single entry point (START)
+    and a single exit (the last instruction in ADDRESSES).
+    """
+
+    def __init__(self, start):
+        self.START = start
+        self.ADDRESSES = []
+        self.SUCCESSORS = []      # List of (address, edge kind) tuples
+        self.IDLE = False
+
+    @property
+    def END(self):
+        """
+        Address of the byte just past the last instruction of the block
+        """
+        return self.ADDRESSES[-1] + 2
+
+    def TO_DICT(self):
+        return {
+            'start': self.START,
+            'end': self.END,
+            'instructions': self.ADDRESSES,
+            'successors': [{'address': address, 'kind': kind} for address, kind in self.SUCCESSORS],
+            'idle': self.IDLE,
+        }
+
+
+class ControlFlowGraph(object):
+    """
+    The basic blocks reachable from the entry point of a ROM.
+
+    BLOCKS maps the leader address of every block to its BasicBlock, and
+    CODE_MAP has one byte per address in memory set to 1 where an
+    instruction starts. Both are meant to be used as precomputed indexes
+    by anything that needs to know where code lives without rediscovering
+    it at runtime.
+    """
+
+    def __init__(self, entry, blocks, code_map, unresolved):
+        self.ENTRY = entry
+        self.BLOCKS = blocks
+        self.CODE_MAP = code_map
+        self.UNRESOLVED = unresolved
+
+    def BLOCK_AT(self, address):
+        """
+        Returns the block starting at address, or None if address is not a leader
+        """
+        return self.BLOCKS.get(address)
+
+    def IS_CODE(self, address):
+        """
+        Returns True if an instruction was traced at address
+        """
+        return 0 <= address < len(self.CODE_MAP) and self.CODE_MAP[address] == 1
+
+    def IDLE_LOOPS(self):
+        """
+        Returns the leader addresses of every block that is part of an idle loop
+        """
+        return sorted(start for start, block in self.BLOCKS.items() if block.IDLE)
+
+    def TO_JSON(self, indent=None):
+        return json.dumps({
+            'entry': self.ENTRY,
+            'blocks': [self.BLOCKS[start].TO_DICT() for start in sorted(self.BLOCKS)],
+            'unresolved': sorted(self.UNRESOLVED),
+            'idle_loops': self.IDLE_LOOPS(),
+        }, indent=indent)
+
+    def TO_DOT(self, disassembler=None):
+        """
+        Render the graph in graphviz DOT format. If a disassembler is given
+        the instructions of each block are included in the node labels.
+        """
+        lines = ['digraph cfg {', '    node [shape=box, fontname="monospace"];']
+
+        for start in sorted(self.BLOCKS):
+            block = self.BLOCKS[start]
+
+            if disassembler is not None:
+                label = '\\l'.join(disassembler.FORMAT(address) for address in block.ADDRESSES) + '\\l'
+            else:
+                label = '{:03X}-{:03X}'.format(block.START, block.END - 1)
+
+            style = ', style=filled, fillcolor=lightgrey' if block.IDLE else ''
+            lines.append('    b{:03X} [label="{}"{}];'.format(start, label, style))
+
+        for start in sorted(self.BLOCKS):
+            for address, kind in self.BLOCKS[start].SUCCESSORS:
+                lines.append('    b{:03X} -> b{:03X} [label="{}"];'.format(start, address, kind))
+
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+
+class Disassembler(object):
+    """
+    Static disassembler for CHIP-8 / SCHIP / XO-CHIP ROMs.
+
+    The mnemonics follow the ones documented next to the lookup tables in
+    Architecture.__init__. Code is separated from data by recursively
+    tracing every reachable instruction from PROGRAM_COUNTER_START, so
+    sprites and other tables embedded in the ROM are listed as bytes.
+
+    Instructions are decoded for a quirk profile like Architecture runs
+    them: the XO-CHIP extensions, including the 4 byte F000 NNNN, only
+    exist under a profile with xochip set, and BNNN is shown with the
+    register the jump quirk adds.
+    """
+
+    # Constants (mirror the ones in Architecture, memory is XO-CHIP sized)
+    MAX_MEMORY = 0x10000
+    PROGRAM_COUNTER_START = 0x200
+
+    # Instruction kinds, used for tracing
+    NORMAL = 'normal'
+    LONG = 'long'               # F000 NNNN, a normal instruction 4 bytes long
+    JUMP = 'jump'
+    CALL = 'call'
+    RETURN = 'return'
+    SKIP = 'skip'
+    INDIRECT = 'indirect'
+    EXIT = 'exit'
+    UNKNOWN = 'unknown'
+
+    def __init__(self, rom, offset=PROGRAM_COUNTER_START, quirks=DEFAULT_PROFILE):
+        self.OFFSET = offset
+        self.QUIRKS = QUIRK_PROFILES[quirks]
+        self.memory = bytearray(self.MAX_MEMORY)
+        self.memory[offset:offset + len(rom)] = rom
+        self.ROM_END = offset + len(rom)
+
+        # Address -> (mnemonic, operands, kind, target), filled in by TRACE
+        self.INSTRUCTIONS = {}
+        self.CFG = None
+
+    @classmethod
+    def FROM_FILE(cls, filename, offset=PROGRAM_COUNTER_START, quirks=DEFAULT_PROFILE):
+        with open(filename, 'rb') as rom_file:
+            return cls(rom_file.read(), offset, quirks)
+
+    def OPCODE_AT(self, address):
+        return (self.memory[address] << 8) | self.memory[address + 1]
+
+    def DECODE_AT(self, address):
+        """
+        Decode the instruction at address, including the second word of F000 NNNN
+        """
+        if address + 3 < self.MAX_MEMORY:
+            return self.DECODE(self.OPCODE_AT(address), self.OPCODE_AT(address + 2), self.QUIRKS)
+        return self.DECODE(self.OPCODE_AT(address), quirks=self.QUIRKS)
+
+    def SIZE_AT(self, address):
+        """
+        Length in bytes of the instruction at address
+        """
+        return self.SIZE(self.OPCODE_AT(address), self.QUIRKS)
+
+    @staticmethod
+    def SIZE(opcode, quirks=QUIRK_PROFILES[DEFAULT_PROFILE]):
+        return 4 if opcode == 0xF000 and quirks['xochip'] else 2
+
+    @classmethod
+    def DECODE(cls, opcode, next_word=None, quirks=QUIRK_PROFILES[DEFAULT_PROFILE]):
+        """
+        Decode a single opcode under the quirk profile (a dict from
+        QUIRK_PROFILES). next_word is the word after it, only used by the
+        4 byte XO-CHIP F000 NNNN.
+
+        Returns a tuple of (mnemonic, operands, kind, target) where target is
+        the static branch target for jumps and calls, or None.
+        """
+
+        OPERATION = (opcode & 0xF000) >> 12
+        s = (opcode & 0x0F00) >> 8
+        t = (opcode & 0x00F0) >> 4
+        n = opcode & 0x000F
+        nn = opcode & 0x00FF
+        nnn = opcode & 0x0FFF
+        xochip = quirks['xochip']
+
+        if OPERATION == 0x0:
+            if nn & 0xF0 == 0xC0 and s == 0:
+                return 'SCRD', '{:X}'.format(n), cls.NORMAL, None
+            if nn & 0xF0 == 0xD0 and s == 0 and xochip:
+                return 'SCRU', '{:X}'.format(n), cls.NORMAL, None
+            if opcode == 0x00E0:
+                return 'CLS', '', cls.NORMAL, None
+            if opcode == 0x00EE:
+                return 'RTS', '', cls.RETURN, None
+            if opcode == 0x00FB:
+                return 'SCRR', '', cls.NORMAL, None
+            if opcode == 0x00FC:
+                return 'SCRL', '', cls.NORMAL, None
+            if opcode == 0x00FD:
+                return 'EXIT', '', cls.EXIT, None
+            if opcode == 0x00FE:
+                return 'LOW', '', cls.NORMAL, None
+            if opcode == 0x00FF:
+                return 'HIGH', '', cls.NORMAL, None
+            return 'SYS', '{:03X}'.format(nnn), cls.NORMAL, None
+
+        if OPERATION == 0x1:
+            return 'JUMP', '{:03X}'.format(nnn), cls.JUMP, nnn
+        if OPERATION == 0x2:
+            return 'CALL', '{:03X}'.format(nnn), cls.CALL, nnn
+        if OPERATION == 0x3:
+            return 'SKE', 'V{:X}, {:02X}'.format(s, nn), cls.SKIP, None
+        if OPERATION == 0x4:
+            return 'SKNE', 'V{:X}, {:02X}'.format(s, nn), cls.SKIP, None
+        if OPERATION == 0x5 and n == 0x0:
+            return 'SKE', 'V{:X}, V{:X}'.format(s, t), cls.SKIP, None
+        if OPERATION == 0x5 and n == 0x2 and xochip:
+            return 'SAVE', 'V{:X} - V{:X}'.format(s, t), cls.NORMAL, None
+        if OPERATION == 0x5 and n == 0x3 and xochip:
+            return 'LOAD', 'V{:X} - V{:X}'.format(s, t), cls.NORMAL, None
+        if OPERATION == 0x6:
+            return 'LOAD', 'V{:X}, {:02X}'.format(s, nn), cls.NORMAL, None
+        if OPERATION == 0x7:
+            return 'ADD', 'V{:X}, {:02X}'.format(s, nn), cls.NORMAL, None
+        if OPERATION == 0x8:
+            ELI = {
+                0x0: 'LOAD', 0x1: 'OR', 0x2: 'AND', 0x3: 'XOR', 0x4: 'ADD',
+                0x5: 'SUB', 0x6: 'SHR', 0x7: 'SUBN', 0xE: 'SHL',
+            }
+            if n in ELI:
+                if n in (0x6, 0xE):
+                    return ELI[n], 'V{:X}'.format(s), cls.NORMAL, None
+                return ELI[n], 'V{:X}, V{:X}'.format(s, t), cls.NORMAL, None
+        if OPERATION == 0x9 and n == 0x0:
+            return 'SKNE', 'V{:X}, V{:X}'.format(s, t), cls.SKIP, None
+        if OPERATION == 0xA:
+            return 'LOAD', 'I, {:03X}'.format(nnn), cls.NORMAL, None
+        if OPERATION == 0xB:
+            if quirks['jump'] == 'V0':
+                return 'JUMP', '[V0] + {:03X}'.format(nnn), cls.INDIRECT, None
+            if quirks['jump'] == 'VX':
+                return 'JUMP', '[V{:X}] + {:03X}'.format(s, nnn), cls.INDIRECT, None
+            return 'JUMP', '[I] + {:03X}'.format(nnn), cls.INDIRECT, None
+        if OPERATION == 0xC:
+            return 'RAND', 'V{:X}, {:02X}'.format(s, nn), cls.NORMAL, None
+        if OPERATION == 0xD:
+            return 'DRAW', 'V{:X}, V{:X}, {:X}'.format(s, t, n), cls.NORMAL, None
+        if OPERATION == 0xE:
+            if nn == 0x9E:
+                return 'SKPR', 'V{:X}'.format(s), cls.SKIP, None
+            if nn == 0xA1:
+                return 'SKUP', 'V{:X}'.format(s), cls.SKIP, None
+        if OPERATION == 0xF and xochip:
+            if opcode == 0xF000:
+                if next_word is None:
+                    return 'LOAD', 'I, ????', cls.LONG, None
+                return 'LOAD', 'I, {:04X}'.format(next_word), cls.LONG, None
+            if nn == 0x01:
+                return 'PLANE', '{:X}'.format(s), cls.NORMAL, None
+            if opcode == 0xF002:
+                return 'AUDIO', '', cls.NORMAL, None
+            if nn == 0x3A:
+                return 'PITCH', 'V{:X}'.format(s), cls.NORMAL, None
+        if OPERATION == 0xF:
+
+            MSC = {
+                0x07: ('LOAD', 'V{:X}, DT'),
+                0x0A: ('KEYD', 'V{:X}'),
+                0x15: ('LOAD', 'DT, V{:X}'),
+                0x18: ('LOAD', 'ST, V{:X}'),
+                0x1E: ('ADD', 'I, V{:X}'),
+                0x29: ('LOAD', 'F, V{:X}'),
+                0x30: ('LOAD', 'HF, V{:X}'),
+                0x33: ('BCD', 'V{:X}'),
+                0x55: ('STOR', '[I], V{:X}'),
+                0x65: ('LOAD', 'V{:X}, [I]'),
+                0x75: ('SRPL', 'V{:X}'),
+                0x85: ('LRPL', 'V{:X}'),
+            }
+            if nn in MSC:
+                mnemonic, operands = MSC[nn]
+                return mnemonic, operands.format(s), cls.NORMAL, None
+
+        return 'DB', '{:04X}'.format(opcode), cls.UNKNOWN, None
+
+    def TRACE(self, entry=None):
+        """
+        Recursively trace every instruction reachable from entry
+        (PROGRAM_COUNTER_START by default) and build the control flow graph.
+        """
+
+        entry = self.OFFSET if entry is None else entry
+
+        self.INSTRUCTIONS = {}
+        code_map = bytearray(self.MAX_MEMORY)
+        leaders = {entry}
+        unresolved = set()
+        edges = {}
+
+        worklist = [entry]
+        while worklist:
+            address = worklist.pop()
+            if address in self.INSTRUCTIONS or address + 1 >= self.MAX_MEMORY:
+                continue
+
+            decoded = self.DECODE_AT(address)
+            mnemonic, operands, kind, target = decoded
+
+            # Unknown opcodes are data that the trace ran into, stop here
+            if kind == self.UNKNOWN:
+                continue
+
+            self.INSTRUCTIONS[address] = decoded
+            code_map[address] = 1
+
+            if kind == self.NORMAL:
+                successors = [(address + 2, 'fallthrough')]
+            elif kind == self.LONG:
+                successors = [(address + 4, 'fallthrough')]
+            elif kind == self.JUMP:
+                successors = [(target, 'jump')]
+            elif kind == self.CALL:
+                successors = [(target, 'call'), (address + 2, 'return-site')]
+            elif kind == self.SKIP:
+                successors = [(address + 2, 'fallthrough'), (address + 2 + self.SIZE_AT(address + 2), 'skip')]
+            else:
+                # RETURN, EXIT and INDIRECT end the trace along this path
+                successors = []
+                if kind == self.INDIRECT:
+                    unresolved.add(address)
+
+            edges[address] = successors
+            for successor, _ in successors:
+                # Everything after a branch starts a new block
+                if kind not in (self.NORMAL, self.LONG):
+                    leaders.add(successor)
+                worklist.append(successor)
+
+        self.CFG = self.BUILD_CFG(entry, leaders, edges, code_map, unresolved)
+        return self.CFG
+
+    def BUILD_CFG(self, entry, leaders, edges, code_map, unresolved):
+        """
+        Split the traced instructions into basic blocks at every leader and
+        after every instruction that does not simply fall through.
+        """
+
+        leaders = {leader for leader in leaders if leader in self.INSTRUCTIONS}
+        blocks = {}
+
+        for leader in sorted(leaders):
+            block = BasicBlock(leader)
+            address = leader
+
+            while True:
+                block.ADDRESSES.append(address)
+                successors = edges[address]
+
+                # Any control flow other than a fall through ends the block
+                if len(successors) != 1 or successors[0][1] != 'fallthrough':
+                    break
+
+                address = successors[0][0]
+                if address in leaders or address not in self.INSTRUCTIONS:
+                    break
+
+            block.SUCCESSORS = [
+                (successor, kind) for successor, kind in edges[block.ADDRESSES[-1]]
+                if successor in self.INSTRUCTIONS
+            ]
+            blocks[leader] = block
+
+        self.MARK_IDLE_LOOPS(blocks)
+
+        return ControlFlowGraph(entry, blocks, code_map, unresolved)
+
+    def MARK_IDLE_LOOPS(self, blocks):
+        """
+        Flag every block on a cycle made only of IDLE_SAFE instructions that
+        reads the delay timer or the keypad somewhere (IDLE_SOURCE).
+
+        Such a loop writes nothing outside itself and only ends when a timer
+        or a key changes, so an interpreter can fast forward to the next
+        60 Hz tick once it enters one. A loop that only compares registers
+        is busy, not idle.
+        """
+
+        idle_safe = set(
+            start for start, block in blocks.items()
+            if all(self.IS_IDLE_SAFE(address) for address in block.ADDRESSES)
+        )
+
+        # Iterative Tarjan over the idle safe subgraph
+        index = {}
+        lowlink = {}
+        on_stack = set()
+        stack = []
+        counter = 0
+
+        for root in sorted(idle_safe):
+            if root in index:
+                continue
+
+            work = [(root, 0)]
+            while work:
+                node, child = work.pop()
+                if child == 0:
+                    index[node] = lowlink[node] = counter
+                    counter += 1
+                    stack.append(node)
+                    on_stack.add(node)
+
+                successors = [s for s, _ in blocks[node].SUCCESSORS if s in idle_safe]
+                if child < len(successors):
+                    work.append((node, child + 1))
+                    successor = successors[child]
+                    if successor not in index:
+                        work.append((successor, 0))
+                    elif successor in on_stack:
+                        lowlink[node] = min(lowlink[node], index[successor])
+                    continue
+
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+
+                    looping = len(component) > 1 or any(
+                        s == node for s, _ in blocks[node].SUCCESSORS
+                    )
+                    waiting = any(
+                        self.IS_IDLE_SOURCE(address)
+                        for member in component for address in blocks[member].ADDRESSES
+                    )
+                    if looping and waiting:
+                        for member in component:
+                            blocks[member].IDLE = True
+
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+
+    def IS_IDLE_SAFE(self, address):
+        """
+        Returns True if the instruction at address writes nothing but the
+        register it reads the delay timer or a key into: jumps, skips, FT07
+        and FT0A. A loop built only from these can not make progress on its own.
+        """
+        kind = self.INSTRUCTIONS[address][2]
+        if kind in (self.JUMP, self.SKIP):
+            return True
+
+        # FT07 - LOAD VT, DT and FT0A - KEYD VT
+        return self.OPCODE_AT(address) & 0xF0FF in (0xF007, 0xF00A)
+
+    def IS_IDLE_SOURCE(self, address):
+        """
+        Returns True if the instruction at address reads the delay timer or
+        the keypad: FT07, ES9E, ESA1 and FT0A
+        """
+        return self.OPCODE_AT(address) & 0xF0FF in (0xF007, 0xE09E, 0xE0A1, 0xF00A)
+
+    def FORMAT(self, address):
+        mnemonic, operands, _, _ = self.INSTRUCTIONS[address]
+        return '{:03X}: {:04X}  {:<5} {}'.format(address, self.OPCODE_AT(address), mnemonic, operands).rstrip()
+
+    def LISTING(self):
+        """
+        Returns the full listing of the ROM as a list of lines, with labels
+        at block leaders and untraced bytes listed as data.
+        """
+
+        if self.CFG is None:
+            self.TRACE()
+
+        lines = []
+        address = self.OFFSET
+        while address < self.ROM_END:
+            if address in self.INSTRUCTIONS:
+                if address in self.CFG.BLOCKS:
+                    idle = '    ; idle loop' if self.CFG.BLOCKS[address].IDLE else ''
+                    lines.append('L{:03X}:{}'.format(address, idle))
+                lines.append('    ' + self.FORMAT(address))
+                address += self.SIZE_AT(address)
+            else:
+                lines.append('    {:03X}: {:02X}    DB    {:08b}'.format(address, self.memory[address], self.memory[address]))
+                address += 1
+
+        return lines
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Disassemble a CHIP-8 ROM')
+    parser.add_argument('rom', help='ROM file to disassemble')
+    parser.add_argument('--quirks', help='quirk profile, default from the ROM database')
+    parser.add_argument('--json', metavar='FILE', help='write the control flow graph as JSON')
+    parser.add_argument('--dot', metavar='FILE', help='write the control flow graph in DOT format')
+    parser.add_argument('--quiet', action='store_true', help='do not print the listing')
+    args = parser.parse_args()
+
+    if not args.quirks:
+        from romdb import RomDatabase
+        args.quirks = RomDatabase().LOOKUP_FILE(args.rom)['quirks']
+
+    disassembler = Disassembler.FROM_FILE(args.rom, quirks=args.quirks)
+    cfg = disassembler.TRACE()
+
+    if not args.quiet:
+        sys.stdout.write('\n'.join(disassembler.LISTING()) + '\n')
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json_file.write(cfg.TO_JSON(indent=2))
+
+    if args.dot:
+        with open(args.dot, 'w') as dot_file:
+            dot_file.write(cfg.TO_DOT(disassembler))
@@ -3,4 +3,47 @@ class UnknownOpCodeException(Exception):
     A class to raise unknown op code exceptions.
     """
     def __init__(self, op_code):
-        Exception.__init__(self, "Unknown op-code: {:X}".format(op_code))
\ No newline at end of file
+        Exception.__init__(self, "Unknown op-code: {:X}".format(op_code))
+
+class WatchpointException(Exception):
+    """
+    A class to raise when a watched memory address is written to.
+    """
+    def __init__(self, address, value):
+        self.address = address
+        self.value = value
+        Exception.__init__(self, "Watchpoint hit: {:03X} = {:02X}".format(address, value))
+
+
+class TraceFormatException(Exception):
+    """
+    A class to raise when a trace file can not be read.
+    """
+    def __init__(self, filename, reason):
+        Exception.__init__(self, "Invalid trace file {}: {}".format(filename, reason))
+
+
+class SaveStoreException(Exception):
+    """
+    A class to raise when the save store can not be used.
+    """
+    def __init__(self, filename, reason):
+        Exception.__init__(self, "Invalid save store file {}: {}".format(filename, reason))
+
+
+class StackException(Exception):
+    """
+    A class to raise when the stack pointer leaves the stack.
+    """
+    def __init__(self, reason, stack_pointer):
+        self.reason = reason
+        Exception.__init__(self, "Stack {}: SP = {:03X}".format(reason, stack_pointer))
+
+
+class MemoryAccessException(IndexError):
+    """
+    A class to raise when an instruction accesses memory past its end.
+    """
+    def __init__(self, access, address, size):
+        self.address = address
+        IndexError.__init__(self, "{} of {} bytes at {:04X} is past the end of memory".format(access, size, address))
@@ -0,0 +1,565 @@
+from architecture import Architecture
+from chip8 import DEFAULT_FONT
+from exceptions import MemoryAccessException, StackException, UnknownOpCodeException
+from romdb import RomDatabase
+from screen import FrameBuffer
+
+from collections import OrderedDict
+from random import Random
+
+import hashlib
+import json
+import os
+import time
+
+
+# Byte values tried first when patching the ROM
+INTERESTING_BYTES = (0x00, 0x01, 0x0F, 0x10, 0x7F, 0x80, 0xEE, 0xF0, 0xFF)
+
+
+class Case(object):
+    """
+    One fuzzing input: the keypad mask for every frame, two bytes per frame
+    little endian, and byte patches over the ROM as (offset, value) pairs.
+
+    CHECKPOINTS holds the machine state at the start of some frames, taken
+    while the case ran. A child that only differs from frame N on starts
+    from the last checkpoint at or before N instead of from the beginning.
+    """
+
+    def __init__(self, keys, patches=()):
+        self.KEYS = bytes(keys)
+        self.PATCHES = tuple(sorted(patches))
+        self.CHECKPOINTS = {}
+
+    def FRAMES(self):
+        return len(self.KEYS) // 2
+
+    def KEY(self):
+        return self.KEYS, self.PATCHES
+
+
+class Fuzzer(object):
+    """
+    Coverage guided fuzzing of a ROM through its keypad input, and
+    optionally through its bytes.
+
+    Every case is run headless with the CPU random numbers from a fixed
+    seed, so a case always replays the same way. The (previous PC, PC)
+    pairs seen are the coverage, and a mutated case that reaches a new pair
+    joins the corpus. Mutations fork: the CPU is restored from a checkpoint
+    of the parent at the first mutated frame, rather than run again from
+    power on.
+
+    Crashes are unknown opcodes, the stack pointer leaving the
+    STACK_DEPTH return addresses above STACK_POINTER_START, and memory
+    accesses past the end of memory. Any other exception is a bug in the
+    emulator and is kept as an internal error. One case is kept per kind
+    and PC.
+
+    Checkpoints are full snapshots, so their number is bounded: a case
+    keeps at most MAX_CASE_CHECKPOINTS, further apart for long cases, and
+    the corpus as a whole about CHECKPOINT_BUDGET bytes of them. Over the
+    budget the cases used least recently as a parent lose theirs, and their
+    children run from power on.
+    """
+
+    # Frames between the checkpoints taken while a case runs, at least
+    CHECKPOINT_INTERVAL = 30
+
+    # Checkpoints taken per case
+    MAX_CASE_CHECKPOINTS = 16
+
+    # Bytes of checkpoints kept over the whole corpus
+    CHECKPOINT_BUDGET = 64 * 1024 * 1024
+
+    # Return addresses the stack holds before it overflows
+    STACK_DEPTH = 16
+
+    # Runs spent minimizing one crash
+    MAX_MINIMIZE_RUNS = 2000
+
+    def __init__(self, rom, font=DEFAULT_FONT, quirks=None, cycles_per_frame=None, frames=300,
+                 mutate_rom=False, seed=0):
+        settings = RomDatabase().LOOKUP_FILE(rom)
+
+        self.ROM_FILE = rom
+        self.FONT_FILE = font
+        self.QUIRKS = quirks or settings['quirks']
+        self.CYCLES_PER_FRAME = cycles_per_frame or settings['cycles_per_frame']
+        self.FRAMES = frames
+        self.MUTATE_ROM = mutate_rom
+        self.RANDOM = Random(seed)
+
+        with open(rom, 'rb') as rom_file:
+            self.ROM = rom_file.read()
+
+        self.CPU = Architecture(quirks=self.QUIRKS, seed=0)
+        self.CPU.LOAD_ROMFILE(font, 0)
+        self.CPU.LOAD_ROMFILE(rom)
+        self.BASE = self.CHECKPOINT(0)
+
+        # A checkpoint is about the size of memory and the largest screen
+        checkpoint_size = len(self.CPU.memory) + FrameBuffer.SCREEN_WIDTH_EXTENDED * FrameBuffer.SCREEN_HEIGHT_EXTENDED
+        self.INTERVAL = max(self.CHECKPOINT_INTERVAL, -(-frames // self.MAX_CASE_CHECKPOINTS))
+        self.MAX_CHECKPOINTS = max(1, self.CHECKPOINT_BUDGET // checkpoint_size)
+        self.CHECKPOINTED = OrderedDict()   # corpus case -> its checkpoints, least recently used first
+        self.CHECKPOINT_COUNT = 0
+
+        self.CORPUS = []
+        self.SEEN = set()               # KEY() of every case in the corpus
+        self.EDGES = set()
+        self.CRASHES = {}               # (kind, PC) -> (case KEY(), message, frame)
+        self.EXECS = 0
+
+    # Running cases
+    def CHECKPOINT(self, previous_pc):
+        cpu = self.CPU
+        return cpu.SNAPSHOT(), cpu.RANDOM.getstate(), cpu.keypad.MASK, previous_pc
+
+    def RESUME(self, checkpoint):
+        """
+        Restore a checkpoint, returns the PC before it for the coverage
+        """
+        snapshot, random_state, mask, previous_pc = checkpoint
+        cpu = self.CPU
+
+        cpu.RESTORE(snapshot)
+        cpu.RANDOM.setstate(random_state)
+        cpu.keypad.MASK = mask
+        cpu.keypad.EDGES = 0
+        return previous_pc
+
+    def RUN(self, case, start=0, checkpoint=None, parent=None, end=0):
+        """
+        Run case from checkpoint, the state at the start of frame start, or
+        from power on. Returns the coverage seen and the crash, if any, as
+        (kind, PC, message, frame).
+
+        With the parent case it was mutated from, whose input is the same
+        from frame end on, the run stops at the first checkpoint after end
+        where the state is the same as the parent's: from there on it can
+        only repeat the parent.
+        """
+        cpu = self.CPU
+
+        if checkpoint is None:
+            start = 0
+            previous_pc = self.RESUME(self.BASE)
+            for offset, value in case.PATCHES:
+                cpu.memory[cpu.PROGRAM_COUNTER_START + offset] = value
+        else:
+            previous_pc = self.RESUME(checkpoint)
+
+        registers = cpu.CpuRegisters
+        execute = cpu.EXECUTE
+        keypad = cpu.keypad
+        keys = case.KEYS
+        checkpoints = case.CHECKPOINTS
+        interval = self.INTERVAL
+        cycles = self.CYCLES_PER_FRAME
+        stack_low = cpu.STACK_POINTER_START
+        stack_high = stack_low + 2 * self.STACK_DEPTH
+
+        edges = set()
+        add = edges.add
+        pc = registers['PC']
+        frame = start
+
+        self.EXECS += 1
+        try:
+            for frame in range(start, case.FRAMES()):
+                if frame % interval == 0:
+                    if frame not in checkpoints:
+                        checkpoints[frame] = self.CHECKPOINT(previous_pc)
+
+                    if parent is not None and frame >= end and parent.CHECKPOINTS.get(frame) == checkpoints[frame]:
+                        checkpoints.update((later, state) for later, state in parent.CHECKPOINTS.items() if later > frame)
+                        return edges, None
+
+                keypad.SET_MASK(keys[2 * frame] | (keys[2 * frame + 1] << 8))
+
+                for _ in range(cycles):
+                    pc = registers['PC']
+                    add((previous_pc << 16) | pc)
+                    previous_pc = pc
+
+                    operand = execute()
+                    if operand == 0x00EE or operand & 0xF000 == 0x2000:
+                        stack_pointer = registers['SP']
+                        if stack_pointer < stack_low:
+                            raise StackException('underflow', stack_pointer)
+                        if stack_pointer > stack_high:
+                            raise StackException('overflow', stack_pointer)
+                    elif operand == 0x00FD:
+                        return edges, None
+
+                cpu.DECREMENT_TIMERS()
+                keypad.NEXT_FRAME()
+        except Exception as exception:
+            kind = self.CLASSIFY(exception)
+            message = repr(exception) if kind == 'internal-error' else str(exception)
+            return edges, (kind, pc, message, frame)
+
+        return edges, None
+
+    @staticmethod
+    def CLASSIFY(exception):
+        if isinstance(exception, UnknownOpCodeException):
+            return 'unknown-opcode'
+        if isinstance(exception, StackException):
+            return 'stack-' + exception.reason
+        if isinstance(exception, MemoryAccessException):
+            return 'memory'
+        return 'internal-error'
+
+    # Corpus
+    def ADD(self, case):
+        self.CORPUS.append(case)
+        self.SEEN.add(case.KEY())
+        self.KEEP_CHECKPOINTS(case)
+
+    def KEEP_CHECKPOINTS(self, case):
+        """
+        Count the checkpoints of a new corpus case against the budget, and
+        drop those of the least recently used cases while over it
+        """
+        self.CHECKPOINTED[case] = len(case.CHECKPOINTS)
+        self.CHECKPOINT_COUNT += len(case.CHECKPOINTS)
+
+        while self.CHECKPOINT_COUNT > self.MAX_CHECKPOINTS and len(self.CHECKPOINTED) > 1:
+            oldest, count = self.CHECKPOINTED.popitem(last=False)
+            oldest.CHECKPOINTS = {}
+            self.CHECKPOINT_COUNT -= count
+
+    def SEED(self):
+        """
+        Start the corpus with a case that never presses a key
+        """
+        case = Case(bytes(2 * self.FRAMES))
+        edges, crash = self.RUN(case)
+        self.EDGES |= edges
+        self.ADD(case)
+        if crash is not None:
+            self.RECORD_CRASH(case, crash)
+
+    def SYNC(self, keys, edges):
+        """
+        Take in corpus entries and coverage found by other workers. New
+        entries are run once, which also takes their checkpoints.
+        """
+        for key in keys:
+            if key not in self.SEEN:
+                case = Case(*key)
+                self.EDGES |= self.RUN(case)[0]
+                self.ADD(case)
+        self.EDGES |= edges
+
+    def RECORD_CRASH(self, case, crash):
+        kind, pc, message, frame = crash
+        if (kind, pc) not in self.CRASHES:
+            self.CRASHES[(kind, pc)] = (case.KEY(), message, frame)
+
+    # Mutation
+    def MUTATE(self, parent):
+        """
+        Returns a mutated copy of parent, the first frame that differs and
+        the frame after the last one that does
+        """
+        rng = self.RANDOM
+        keys = bytearray(parent.KEYS)
+        frames = parent.FRAMES()
+
+        strategy = rng.randrange(6 if self.MUTATE_ROM else 5)
+
+        if strategy == 5:
+            patches = dict(parent.PATCHES)
+            offset = rng.randrange(len(self.ROM))
+            patches[offset] = rng.choice(INTERESTING_BYTES) if rng.random() < 0.5 else rng.randrange(256)
+            return Case(keys, patches.items()), 0, frames
+
+        frame = rng.randrange(frames)
+        length = min(frames - frame, rng.choice((1, 2, 4, 8, 16, 32, 64)))
+        key = 1 << rng.randrange(16)
+        other = rng.choice(self.CORPUS).KEYS
+
+        for index in range(frame, frame + length):
+            if strategy == 0:
+                # Toggle one key
+                mask = (keys[2 * index] | (keys[2 * index + 1] << 8)) ^ key
+            elif strategy == 1:
+                # Hold one key
+                mask = key
+            elif strategy == 2:
+                # Release every key
+                mask = 0
+            elif strategy == 3:
+                mask = rng.randrange(0x10000)
+            else:
+                # Splice in the input of another case
+                mask = other[2 * index] | (other[2 * index + 1] << 8) if 2 * index + 1 < len(other) else 0
+            keys[2 * index] = mask & 0xFF
+            keys[2 * index + 1] = mask >> 8
+
+        child = Case(keys, parent.PATCHES)
+        child.CHECKPOINTS = {start: state for start, state in parent.CHECKPOINTS.items() if start <= frame}
+        return child, frame, frame + length
+
+    def STEP(self):
+        """
+        Mutate a corpus entry and run the child from the closest checkpoint
+        """
+        parent = self.RANDOM.choice(self.CORPUS)
+        if parent in self.CHECKPOINTED:
+            self.CHECKPOINTED.move_to_end(parent)
+
+        child, frame, end = self.MUTATE(parent)
+        if child.KEY() in self.SEEN:
+            return
+
+        if child.CHECKPOINTS:
+            start = max(child.CHECKPOINTS)
+            edges, crash = self.RUN(child, start, child.CHECKPOINTS[start], parent, end)
+        else:
+            edges, crash = self.RUN(child)
+
+        new = edges - self.EDGES
+        if new:
+            self.EDGES |= new
+
+        # Crashing cases are kept as crashes, their children would crash too
+        if crash is not None:
+            self.RECORD_CRASH(child, crash)
+        elif new:
+            self.ADD(child)
+
+    def FUZZ(self, seconds):
+        """
+        Fuzz for a number of seconds, returns the number of runs
+        """
+        execs = self.EXECS
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            for _ in range(16):
+                self.STEP()
+        return self.EXECS - execs
+
+    # Crashes
+    def MINIMIZE(self, case, signature):
+        """
+        Shrink a crashing case while it still crashes the same way: cut the
+        frames after the crash, release keys in ever smaller runs of frames
+        and drop ROM patches. Returns the case and its crash.
+        """
+        runs = 0
+
+        def CRASHES(candidate):
+            nonlocal runs
+            runs += 1
+            crash = self.RUN(candidate)[1]
+            return crash if crash is not None and crash[:2] == signature else None
+
+        crash = CRASHES(case)
+        if crash is None:
+            return case, None
+
+        case = Case(case.KEYS[:2 * (crash[3] + 1)], case.PATCHES)
+
+        size = max(1, case.FRAMES() // 2)
+        while size and runs < self.MAX_MINIMIZE_RUNS:
+            for start in range(0, case.FRAMES(), size):
+                held = case.KEYS[2 * start:2 * (start + size)]
+                if not any(held) or runs >= self.MAX_MINIMIZE_RUNS:
+                    continue
+
+                candidate = Case(case.KEYS[:2 * start] + bytes(len(held)) + case.KEYS[2 * (start + size):], case.PATCHES)
+                if CRASHES(candidate):
+                    case = candidate
+            size //= 2
+
+        for patch in case.PATCHES:
+            if runs >= self.MAX_MINIMIZE_RUNS:
+                break
+            candidate = Case(case.KEYS, [other for other in case.PATCHES if other != patch])
+            if CRASHES(candidate):
+                case = candidate
+
+        return case, CRASHES(case)
+
+    def SAVE_CRASH(self, directory, case, crash):
+        """
+        Write a crash and the input that reproduces it as JSON, returns the filename
+        """
+        kind, pc, message, frame = crash
+        os.makedirs(directory, exist_ok=True)
+
+        filename = os.path.join(directory, '{}-{:04X}.json'.format(kind, pc))
+        with open(filename, 'w') as crash_file:
+            json.dump({
+                'rom': self.ROM_FILE,
+                'rom_sha1': hashlib.sha1(self.ROM).hexdigest(),
+                'font': self.FONT_FILE,
+                'quirks': self.QUIRKS,
+                'cycles_per_frame': self.CYCLES_PER_FRAME,
+                'kind': kind,
+                'pc': pc,
+                'message': message,
+                'frame': frame,
+                'keys': [case.KEYS[2 * index] | (case.KEYS[2 * index + 1] << 8) for index in range(case.FRAMES())],
+                'patches': [list(patch) for patch in case.PATCHES],
+            }, crash_file, indent=2)
+        return filename
+
+
+def REPLAY(filename):
+    """
+    Run the input saved with a crash, returns the crash it causes now
+    """
+    with open(filename) as crash_file:
+        saved = json.load(crash_file)
+
+    keys = b''.join(mask.to_bytes(2, 'little') for mask in saved['keys'])
+    fuzzer = Fuzzer(saved['rom'], saved['font'], saved['quirks'], saved['cycles_per_frame'], len(saved['keys']))
+    return fuzzer.RUN(Case(keys, [tuple(patch) for patch in saved['patches']]))[1]
+
+
+# Process pool workers, each with a Fuzzer of its own
+WORKER = None
+
+
+def INIT_WORKER(options):
+    global WORKER
+    WORKER = Fuzzer(**options)
+
+
+def WORKER_ROUND(job):
+    """
+    Fuzz for one round starting from the shared corpus and coverage.
+    Returns the entries added, the coverage, the crashes and the runs.
+    """
+    seed, seconds, keys, edges = job
+
+    WORKER.RANDOM.seed(seed)
+    WORKER.SYNC(keys, edges)
+
+    first = len(WORKER.CORPUS)
+    execs = WORKER.FUZZ(seconds)
+    return [case.KEY() for case in WORKER.CORPUS[first:]], WORKER.EDGES, WORKER.CRASHES, execs
+
+
+def FUZZ(options, seconds, jobs=1, round_seconds=5.0, output='crashes', log=print):
+    """
+    Fuzz the ROM for a number of seconds on jobs processes. Workers fuzz in
+    rounds of round_seconds and exchange new corpus entries and coverage
+    between rounds. Crashes are minimized and saved into output at the end.
+    Returns a summary.
+    """
+    fuzzer = Fuzzer(**options)
+    fuzzer.SEED()
+
+    rng = Random(options.get('seed', 0))
+    pool = None
+    if jobs > 1:
+        from multiprocessing import Pool
+
+        pool = Pool(jobs, INIT_WORKER, (options,))
+
+    start = time.perf_counter()
+    execs = 0
+
+    try:
+        while time.perf_counter() - start < seconds:
+            length = min(round_seconds, seconds - (time.perf_counter() - start))
+
+            if pool is None:
+                execs += fuzzer.FUZZ(length)
+            else:
+                keys = [case.KEY() for case in fuzzer.CORPUS]
+                work = [(rng.getrandbits(32), length, keys, fuzzer.EDGES) for _ in range(jobs)]
+
+                for added, edges, crashes, worker_execs in pool.map(WORKER_ROUND, work):
+                    for key in added:
+                        if key not in fuzzer.SEEN:
+                            fuzzer.ADD(Case(*key))
+                    fuzzer.EDGES |= edges
+                    for signature, crash in crashes.items():
+                        fuzzer.CRASHES.setdefault(signature, crash)
+                    execs += worker_execs
+
+            elapsed = time.perf_counter() - start
+            log('{:>6.1f} s  {:>9} execs  {:>8,.0f} execs/s  corpus {:>5}  edges {:>6}  crashes {}'.format(
+                elapsed, execs, execs / elapsed, len(fuzzer.CORPUS), len(fuzzer.EDGES), len(fuzzer.CRASHES)))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    elapsed = time.perf_counter() - start
+    saved = []
+    for signature, (key, message, frame) in sorted(fuzzer.CRASHES.items()):
+        case, crash = fuzzer.MINIMIZE(Case(*key), signature)
+        if crash is None:
+            log('{} at {:04X} did not reproduce: {}'.format(signature[0], signature[1], message))
+            continue
+        filename = fuzzer.SAVE_CRASH(output, case, crash)
+        saved.append(filename)
+        log('{} at {:04X}: {} -> {}'.format(crash[0], crash[1], crash[2], filename))
+
+    return {
+        'execs': execs,
+        'seconds': elapsed,
+        'execs_per_second': execs / elapsed if elapsed else 0,
+        'corpus': len(fuzzer.CORPUS),
+        'edges': len(fuzzer.EDGES),
+        'crashes': saved,
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Coverage guided fuzzing of CHIP-8 ROMs')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    fuzz = commands.add_parser('fuzz', help='fuzz a ROM through its keypad input')
+    fuzz.add_argument('rom')
+    fuzz.add_argument('--font', default=DEFAULT_FONT)
+    fuzz.add_argument('--quirks', help='quirk profile, default from the ROM database')
+    fuzz.add_argument('--cycles', type=int, help='instructions per frame, default from the ROM database')
+    fuzz.add_argument('--frames', type=int, default=300, help='frames of input per case')
+    fuzz.add_argument('--mutate-rom', action='store_true', help='also patch bytes of the ROM')
+    fuzz.add_argument('--seconds', type=float, default=60)
+    fuzz.add_argument('--jobs', type=int, default=1)
+    fuzz.add_argument('--seed', type=int, default=0)
+    fuzz.add_argument('--output', default='crashes', metavar='DIR', help='directory for minimized crashes')
+
+    replay = commands.add_parser('replay', help='run saved crashes again')
+    replay.add_argument('crashes', nargs='+')
+
+    args = parser.parse_args()
+
+    if args.command == 'fuzz':
+        options = {
+            'rom': args.rom,
+            'font': args.font,
+            'quirks': args.quirks,
+            'cycles_per_frame': args.cycles,
+            'frames': args.frames,
+            'mutate_rom': args.mutate_rom,
+            'seed': args.seed,
+        }
+        summary = FUZZ(options, args.seconds, args.jobs, output=args.output)
+        print('{execs} execs in {seconds:.1f} s, {execs_per_second:,.0f} execs/s, '
+              '{corpus} corpus entries, {edges} edges, {0} crashes saved'.format(len(summary['crashes']), **summary))
+
+    if args.command == 'replay':
+        failed = 0
+        for filename in args.crashes:
+            crash = REPLAY(filename)
+            if crash is None:
+                print('{}: no crash'.format(filename))
+            else:
+                failed += 1
+                print('{}: {} at {:04X} in frame {}: {}'.format(filename, crash[0], crash[1], crash[3], crash[2]))
+        sys.exit(1 if failed else 0)
@@ -0,0 +1,155 @@
+from array import array
+
+import json
+import time
+
+
+class FrameGovernor(object):
+    """
+    Paces emulation at exactly FRAME_RATE frames per second.
+
+    Every frame has an absolute deadline, start + n / FRAME_RATE on a
+    monotonic clock, and END_FRAME sleeps until it. Sleeping late only
+    shortens the next wait, so errors never add up to drift the way a fixed
+    17 ms timer does. A frame that overruns its deadline is late and the next
+    one starts at once to catch up; more than MAX_LAG frames behind, the
+    schedule is restarted from now and the frames in between are dropped.
+
+    When the work of a frame (instructions, presenting and events) takes
+    more than BUDGET of the frame time, the instructions per frame are cut
+    in proportion, and grown back towards the requested number once there is
+    headroom again. A slow or busy host then runs the ROM slower instead of
+    losing real time, so the timers and sound stay at 60 Hz.
+    """
+
+    FRAME_RATE = 60
+
+    # Share of the frame time the work of a frame may use
+    BUDGET = 0.8
+
+    # Frames behind schedule before the missed frames are dropped
+    MAX_LAG = 4
+
+    # Instructions per frame never go below this
+    MIN_CYCLES = 1
+
+    # Frame times kept for the percentiles
+    HISTORY = 600
+
+    def __init__(self, cycles_per_frame, clock=time.perf_counter, sleep=time.sleep):
+        self.TARGET_CYCLES = cycles_per_frame
+        self.CYCLES = cycles_per_frame
+        self.FRAME_TIME = 1.0 / self.FRAME_RATE
+
+        self.CLOCK = clock
+        self.SLEEP = sleep
+
+        self.START = None
+        self.DEADLINE = None
+        self.FRAME_START = None
+
+        self.FRAMES = 0
+        self.INSTRUCTIONS = 0
+        self.LATE = 0
+        self.DROPPED = 0
+        self.ADJUSTMENTS = 0
+
+        # Time between the starts of consecutive frames, in a ring
+        self.FRAME_TIMES = array('d', bytes(8 * self.HISTORY))
+        self.RECORDED = 0
+
+    def BEGIN_FRAME(self):
+        """
+        Called at the start of every frame, returns the number of instructions
+        to run in it
+        """
+        now = self.CLOCK()
+
+        if self.START is None:
+            self.START = now
+            self.DEADLINE = now + self.FRAME_TIME
+        else:
+            self.FRAME_TIMES[self.RECORDED % self.HISTORY] = now - self.FRAME_START
+            self.RECORDED += 1
+
+        self.FRAME_START = now
+        return self.CYCLES
+
+    def END_FRAME(self, executed):
+        """
+        Called at the end of every frame with the number of instructions it
+        ran. Adapts the instructions per frame and sleeps until the deadline.
+        """
+        self.FRAMES += 1
+        self.INSTRUCTIONS += executed
+
+        now = self.CLOCK()
+        self.ADAPT(now - self.FRAME_START)
+
+        if now < self.DEADLINE:
+            self.SLEEP(self.DEADLINE - now)
+        else:
+            behind = int((now - self.DEADLINE) / self.FRAME_TIME)
+            self.LATE += 1
+
+            if behind >= self.MAX_LAG:
+                self.DROPPED += behind
+                self.DEADLINE += behind * self.FRAME_TIME
+
+        self.DEADLINE += self.FRAME_TIME
+
+    def ADAPT(self, work):
+        budget = self.BUDGET * self.FRAME_TIME
+
+        if work > budget and self.CYCLES > self.MIN_CYCLES:
+            self.CYCLES = max(self.MIN_CYCLES, int(self.CYCLES * budget / work))
+            self.ADJUSTMENTS += 1
+        elif work < budget / 2 and self.CYCLES < self.TARGET_CYCLES:
+            self.CYCLES = min(self.TARGET_CYCLES, self.CYCLES + max(1, self.TARGET_CYCLES // 16))
+            self.ADJUSTMENTS += 1
+
+    # Telemetry
+    def PERCENTILE(self, percent):
+        """
+        Frame time in milliseconds at the percentile, over the last HISTORY frames
+        """
+        count = min(self.RECORDED, self.HISTORY)
+        if not count:
+            return 0.0
+
+        times = sorted(self.FRAME_TIMES[:count])
+        index = min(count - 1, int(round(percent / 100 * (count - 1))))
+        return times[index] * 1000
+
+    def STATS(self):
+        elapsed = self.CLOCK() - self.START if self.START is not None else 0
+
+        return {
+            'frames': self.FRAMES,
+            'seconds': elapsed,
+            'fps': self.FRAMES / elapsed if elapsed else 0,
+            'ips': self.INSTRUCTIONS / elapsed if elapsed else 0,
+            'frame_ms': {
+                'p50': self.PERCENTILE(50),
+                'p90': self.PERCENTILE(90),
+                'p99': self.PERCENTILE(99),
+                'max': self.PERCENTILE(100),
+            },
+            'late_frames': self.LATE,
+            'dropped_frames': self.DROPPED,
+            'cycles_per_frame': self.CYCLES,
+            'target_cycles_per_frame': self.TARGET_CYCLES,
+            'adjustments': self.ADJUSTMENTS,
+        }
+
+    def TO_JSON(self, indent=None):
+        return json.dumps(self.STATS(), indent=indent)
+
+    def REPORT(self):
+        stats = self.STATS()
+        return (
+            '{frames} frames at {fps:.2f} fps, {ips:,.0f} instructions/s, '
+            'frame time p50 {p50:.2f} ms p90 {p90:.2f} ms p99 {p99:.2f} ms, '
+            '{late_frames} late, {dropped_frames} dropped, '
+            '{cycles_per_frame}/{target_cycles_per_frame} instructions per frame'
+        ).format(**dict(stats, **stats['frame_ms']))
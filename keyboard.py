@@ -1,21 +1,113 @@
-import pygame
-
-# Sets which keys on the keyboard map to the Chip 8 keys
-KEY_MAPPINGS = {
-    0x0: pygame.K_KP0,
-    0x1: pygame.K_KP1,
-    0x2: pygame.K_KP2,
-    0x3: pygame.K_KP3,
-    0x4: pygame.K_KP4,
-    0x5: pygame.K_KP5,
-    0x6: pygame.K_KP6,
-    0x7: pygame.K_KP7,
-    0x8: pygame.K_KP8,
-    0x9: pygame.K_KP9,
-    0xA: pygame.K_a,
-    0xB: pygame.K_b,
-    0xC: pygame.K_c,
-    0xD: pygame.K_d,
-    0xE: pygame.K_e,
-    0xF: pygame.K_f,
-}
\ No newline at end of file
+# Sets which keys on the keyboard map to the Chip 8 keys, by pygame key name.
+# The names are turned into pygame key codes the first time KEY_MAPPINGS is
+# used, so importing this module does not import pygame.
+KEY_NAMES = {
+    0x0: 'K_KP0',
+    0x1: 'K_KP1',
+    0x2: 'K_KP2',
+    0x3: 'K_KP3',
+    0x4: 'K_KP4',
+    0x5: 'K_KP5',
+    0x6: 'K_KP6',
+    0x7: 'K_KP7',
+    0x8: 'K_KP8',
+    0x9: 'K_KP9',
+    0xA: 'K_a',
+    0xB: 'K_b',
+    0xC: 'K_c',
+    0xD: 'K_d',
+    0xE: 'K_e',
+    0xF: 'K_f',
+}
+
+
+def RESOLVE_KEYS(key_names):
+    """
+    Turn a mapping of CHIP-8 key -> pygame key name into pygame key codes
+    """
+    import pygame
+
+    return {chip8_key: getattr(pygame, key_name) for chip8_key, key_name in key_names.items()}
+
+
+def REMAP_KEYS(keymap):
+    """
+    Returns a copy of KEY_MAPPINGS with the entries in keymap replaced.
+    keymap maps a CHIP-8 key as a hex digit to a pygame key name ('K_LEFT').
+    """
+    key_names = dict(KEY_NAMES)
+    for chip8_key, key_name in keymap.items():
+        key_names[int(chip8_key, 16)] = key_name
+    return RESOLVE_KEYS(key_names)
+
+
+def __getattr__(name):
+    # Resolve KEY_MAPPINGS on first access and keep it as a module global
+    if name == 'KEY_MAPPINGS':
+        global KEY_MAPPINGS
+        KEY_MAPPINGS = RESOLVE_KEYS(KEY_NAMES)
+        return KEY_MAPPINGS
+    raise AttributeError("module 'keyboard' has no attribute '{}'".format(name))
+
+
+class Keypad(object):
+    """
+    State of the 16 CHIP-8 keys as a bit mask, bit n set = key n down.
+
+    The CPU only reads MASK. Whatever provides input updates it: the pygame
+    frontend once per frame from KEYDOWN/KEYUP events through HOST_KEY,
+    scripted input and network clients through SET_MASK. EDGES collects
+    keys that went down since the last NEXT_FRAME, for FX0A.
+    """
+
+    def __init__(self):
+        self.MASK = 0
+        self.EDGES = 0
+        self.HOST_KEYS = {}
+
+    def BIND(self, key_mappings):
+        """
+        Set the host keys used by HOST_KEY, from a CHIP-8 key -> host key mapping
+        """
+        self.HOST_KEYS = {host_key: chip8_key for chip8_key, host_key in key_mappings.items()}
+
+    def HOST_KEY(self, host_key, pressed):
+        """
+        Update the keypad from a host key event, ignoring unbound keys
+        """
+        chip8_key = self.HOST_KEYS.get(host_key)
+        if chip8_key is None:
+            return
+
+        if pressed:
+            self.PRESS(chip8_key)
+        else:
+            self.RELEASE(chip8_key)
+
+    def PRESS(self, chip8_key):
+        bit = 1 << chip8_key
+        self.EDGES |= bit & ~self.MASK
+        self.MASK |= bit
+
+    def RELEASE(self, chip8_key):
+        self.MASK &= ~(1 << chip8_key)
+
+    def SET_MASK(self, mask):
+        """
+        Replace the state of all keys at once
+        """
+        self.EDGES |= mask & ~self.MASK
+        self.MASK = mask
+
+    def IS_PRESSED(self, chip8_key):
+        return (self.MASK >> chip8_key) & 1 == 1
+
+    def NEXT_FRAME(self):
+        """
+        Forget key presses that were not picked up by FX0A during the frame
+        """
+        self.EDGES = 0
+
+    def RESET(self):
+        self.MASK = 0
+        self.EDGES = 0
@@ -1,52 +1,109 @@
 from architecture import Architecture
+from audio import NullAudio, PygameAudio
+from chip8 import ROOT, DEFAULT_FONT
+from exceptions import SaveStoreException
+from governor import FrameGovernor
+from keyboard import REMAP_KEYS
+from presenter import Screen, DEFAULT_PALETTE
+from romdb import RomDatabase
+from savestore import SaveStore
 
+import os
 import pygame
 
 class Emulator:
 
-    TIMER = pygame.USEREVENT + 1
+    # Keys that save and load the quick save state
+    SAVE_STATE_KEY = pygame.K_F5
+    LOAD_STATE_KEY = pygame.K_F9
 
-    # Delay timer decrement interval (in ms)
-    DELAY_INTERVAL = 17
-
-    def __init__(self, rom, scale=5, delay=5, font_file="FONTS.chip8"):
+    def __init__(self, rom, scale=5, font_file=DEFAULT_FONT, quirks=None, cycles_per_frame=None, database=None,
+                 palette=DEFAULT_PALETTE, fade=0, store=None, telemetry=None):
         self.ROM_FILE = rom
+        self.TELEMETRY = telemetry
+        self.STORE = store or SaveStore()
         self.FONT_FILE = font_file
         self.SCALE = scale
-        self.DELAY = delay
+        self.PALETTE = palette
+        self.FADE = fade
+
+        # Anything not passed in explicitly comes from the ROM database
+        self.SETTINGS = (database or RomDatabase()).LOOKUP_FILE(rom)
+        self.QUIRKS = quirks or self.SETTINGS['quirks']
+        self.CYCLES_PER_FRAME = cycles_per_frame or self.SETTINGS['cycles_per_frame']
 
         self.main()
 
     def main(self):
-        CPU = Architecture(self.SCALE)
+        # Run silently when there is no audio device
+        try:
+            audio = PygameAudio()
+        except pygame.error:
+            audio = NullAudio()
+
+        # The window stays the same size in extended mode, the frame is scaled to fit
+        screen = Screen(SCALE=self.SCALE, PALETTE=self.PALETTE, FADE=self.FADE)
+
+        CPU = Architecture(screen=screen, quirks=self.QUIRKS, audio=audio)
+        CPU.keypad.BIND(REMAP_KEYS(self.SETTINGS['keymap']))
 
         CPU.LOAD_ROMFILE(self.FONT_FILE, 0)
         CPU.LOAD_ROMFILE(self.ROM_FILE)
 
-        pygame.time.set_timer(self.TIMER, self.DELAY_INTERVAL)
+        # Keep the RPL flags of the ROM between runs
+        with open(self.ROM_FILE, 'rb') as rom_file:
+            rom = rom_file.read()
+        self.STORE.ATTACH_RPL(CPU, rom)
+
+        # Frames are paced by the governor, which also lowers the instructions
+        # per frame if the host can not keep up
+        governor = FrameGovernor(self.CYCLES_PER_FRAME)
 
         running = True
 
-        while running:
-            pygame.time.wait(self.DELAY)
-            CurrentOperand = CPU.EXECUTE()
-
-            # Check for various events
-            for event in pygame.event.get():
-                if event.type == self.TIMER:
-                    CPU.DECREMENT_TIMERS()
-
-                if event.type == pygame.QUIT:
-                    running = False
-                
-                if event.type == pygame.KEYDOWN:
-                    all_keys_down = pygame.key.get_pressed()
-                    if all_keys_down[pygame.K_q]:
+        # The store is closed however the loop ends, so the RPL flags are written out
+        try:
+            while running:
+                executed = 0
+                for _ in range(governor.BEGIN_FRAME()):
+                    executed += 1
+                    if CPU.EXECUTE() == 0x00FD:
+                        running = False
+                        break
+
+                CPU.DECREMENT_TIMERS()
+                CPU.keypad.NEXT_FRAME()
+                CPU.screen.PRESENT()
+                self.STORE.TICK()
+
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
                         running = False
 
-            if CurrentOperand == 0x00FD:
-                running = False
+                    # Key events update the keypad, the CPU never polls pygame
+                    if event.type == pygame.KEYDOWN:
+                        if event.key == pygame.K_q:
+                            running = False
+                        if event.key == self.SAVE_STATE_KEY:
+                            self.STORE.SAVE_STATE(CPU, rom)
+                        if event.key == self.LOAD_STATE_KEY:
+                            try:
+                                self.STORE.LOAD_STATE(CPU, rom)
+                            except SaveStoreException as exception:
+                                print(exception)
+                        CPU.keypad.HOST_KEY(event.key, True)
+
+                    if event.type == pygame.KEYUP:
+                        CPU.keypad.HOST_KEY(event.key, False)
+
+                governor.END_FRAME(executed)
+
+            if self.TELEMETRY:
+                with open(self.TELEMETRY, 'w') as telemetry_file:
+                    telemetry_file.write(governor.TO_JSON(indent=2))
+        finally:
+            self.STORE.CLOSE()
+
 
-    
 if __name__ == '__main__':
-    emulator = Emulator(rom='c8games\BRIX', font_file='c8games\\FONTS.chip8', scale=15)
\ No newline at end of file
+    emulator = Emulator(rom=os.path.join(ROOT, 'c8games', 'BRIX'), scale=15)
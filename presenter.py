@@ -0,0 +1,168 @@
+from screen import FrameBuffer
+
+from pygame import display, image, transform, HWSURFACE, DOUBLEBUF
+
+
+# Colours for pixel values 0 - 3: off, plane 1, plane 2, both planes
+PALETTES = {
+    'mono': [(0, 0, 0), (255, 255, 255), (170, 170, 170), (85, 85, 85)],
+    'green': [(0, 20, 0), (60, 255, 60), (30, 150, 30), (120, 255, 120)],
+    'amber': [(25, 12, 0), (255, 176, 0), (170, 100, 0), (255, 220, 120)],
+    'octo': [(153, 102, 0), (255, 204, 0), (255, 102, 0), (102, 34, 0)],
+}
+
+DEFAULT_PALETTE = 'mono'
+
+# First palette index of the phosphor fade colours. Pixels that are on use
+# their value (1 - 3) as index, pixels fading out use FADE_BASE and up.
+FADE_BASE = 4
+
+# Longest fade, in frames, whose colours for the three on values fit in the
+# 256 entry palette
+MAX_FADE = (256 - FADE_BASE) // 3
+
+# Translation table that turns pixels that are off into 0xFF and the rest into 0
+OFF_MASK = bytes([0xFF] + [0x00] * 255)
+
+
+class Screen(FrameBuffer):
+    """
+    Shows the FrameBuffer in a pygame window.
+
+    Drawing only changes PIXELS. Once per frame PRESENT turns them into
+    palette indices, uploads them into a WIDTH x HEIGHT 8-bit surface and
+    scales that up to the window with a single transform.scale and blit,
+    so presenting costs the same at any scale and any number of lit pixels.
+
+    The window keeps the size of the normal resolution times SCALE, the
+    extended resolution is shown at half the scale. The scaled surface for
+    each resolution is created once and reused.
+
+    With FADE set, pixels that turn off fade out over FADE frames like a
+    phosphor screen, which hides the flicker of XOR drawing.
+    """
+
+    def __init__(self, SCALE=1, HEIGHT=FrameBuffer.SCREEN_HEIGHT_NORMAL, WIDTH=FrameBuffer.SCREEN_WIDTH_NORMAL,
+                 PALETTE=DEFAULT_PALETTE, FADE=0):
+
+        # Setting the screen class height, width, and scale
+        FrameBuffer.__init__(self, HEIGHT, WIDTH)
+        self.SCALE = SCALE
+        self.FADE = FADE
+        self.SET_PALETTE(PALETTE)
+
+        # Palette indices shown in the previous frame, for the fade
+        self.INDICES = bytes(len(self.PIXELS))
+
+        # Scaled surfaces by (WIDTH, HEIGHT)
+        self.SCALED = {}
+
+        #  Initialize a variable to hold the surface but don't use it
+        self.SURFACE = None
+
+        # Initialize the screen
+        self.INITIALIZE()
+
+    def INITIALIZE(self):
+
+        # Initialize the display from pygame
+        display.init()
+
+        # Set the surface, always sized for the normal resolution
+        size = (self.SCREEN_WIDTH_NORMAL * self.SCALE, self.SCREEN_HEIGHT_NORMAL * self.SCALE)
+        self.SURFACE = display.set_mode(size, HWSURFACE | DOUBLEBUF)
+
+        # Setting the title of the display
+        display.set_caption('CHIP-8 Emulator')
+
+        self.PRESENT()
+
+    def SET_PALETTE(self, name):
+        """
+        Select one of PALETTES and build the fade colours and tables for it
+        """
+        if not 0 <= self.FADE <= MAX_FADE:
+            raise ValueError('FADE must be between 0 and {} frames, not {}'.format(MAX_FADE, self.FADE))
+
+        colours = PALETTES[name]
+        off = colours[0]
+        steps = self.FADE
+
+        # Fade colours: FADE steps from each on colour towards the off colour
+        palette = list(colours)
+        for colour in colours[1:]:
+            for step in range(1, steps + 1):
+                palette.append(tuple(c + (o - c) * step // (steps + 1) for c, o in zip(colour, off)))
+        self.PALETTE = palette + [off] * (256 - len(palette))
+
+        # FADE_STEP maps the index shown last frame to the one shown this
+        # frame for a pixel that is off: on colours start fading, fading
+        # colours move one step on, the last step goes to 0 (off)
+        step_table = bytearray(256)
+        if steps:
+            for value in range(1, 4):
+                first = FADE_BASE + (value - 1) * steps
+                step_table[value] = first
+                for step in range(steps - 1):
+                    step_table[first + step] = first + step + 1
+        self.FADE_STEP = bytes(step_table)
+
+    def INDEX_BUFFER(self):
+        """
+        Palette indices for the current frame
+        """
+        if not self.FADE:
+            return bytes(self.PIXELS)
+
+        size = len(self.PIXELS)
+        on = int.from_bytes(self.PIXELS, 'big')
+        off = int.from_bytes(self.PIXELS.translate(OFF_MASK), 'big')
+        fading = int.from_bytes(self.INDICES.translate(self.FADE_STEP), 'big')
+        return (on | (fading & off)).to_bytes(size, 'big')
+
+    def SCALED_SURFACE(self, small):
+        """
+        The cached surface that the frame is scaled into for this resolution
+        """
+        key = (self.WIDTH, self.HEIGHT)
+        scaled = self.SCALED.get(key)
+        if scaled is None:
+            window_width, window_height = self.SURFACE.get_size()
+            factor = max(1, min(window_width // self.WIDTH, window_height // self.HEIGHT))
+            scaled = self.SCALED[key] = transform.scale(small, (self.WIDTH * factor, self.HEIGHT * factor))
+        return scaled
+
+    def PRESENT(self):
+        """
+        Show the frame buffer in the window, called once per frame
+        """
+        indices = self.INDEX_BUFFER()
+        self.INDICES = indices
+
+        small = image.frombuffer(indices, (self.WIDTH, self.HEIGHT), 'P')
+        small.set_palette(self.PALETTE)
+
+        scaled = self.SCALED_SURFACE(small)
+        transform.scale(small, scaled.get_size(), scaled)
+        scaled.set_palette(self.PALETTE)
+
+        # Centre the frame, the window may not be an exact multiple of it
+        window_width, window_height = self.SURFACE.get_size()
+        scaled_width, scaled_height = scaled.get_size()
+        self.SURFACE.blit(scaled, ((window_width - scaled_width) // 2, (window_height - scaled_height) // 2))
+        display.flip()
+
+    def RESIZE(self, HEIGHT, WIDTH):
+        FrameBuffer.RESIZE(self, HEIGHT, WIDTH)
+        self.INDICES = bytes(len(self.PIXELS))
+
+        # Blank the border the new resolution may leave uncovered
+        if self.SURFACE is not None:
+            self.SURFACE.fill(self.PALETTE[0])
+
+    @staticmethod
+    def DECONSTRUCTOR():
+        """
+        Destroys the current screen object.
+        """
+        display.quit()
@@ -0,0 +1,319 @@
+from array import array
+
+import json
+import math
+
+
+class MemoryProfiler(object):
+    """
+    Counts reads, writes and instruction fetches for every address of
+    Architecture.memory.
+
+    Like the tracer and the debugger watchpoints it works by swapping things
+    on the CPU instance: ATTACH replaces EXECUTE (fetches) and READ_MEMORY
+    (sprite and audio pattern reads), and the memory handlers in the lookup
+    tables, so a CPU without a profiler attached runs exactly as before.
+    Attach after APPLY_QUIRKS, which rebinds the lookup tables.
+
+    A write to an address that was fetched as part of an instruction before
+    is self-modifying code. Those writes are counted and the first
+    MAX_EVENTS of them are kept, which is where a cache of decoded blocks
+    would have to be invalidated.
+    """
+
+    # Self-modifying writes kept with their details
+    MAX_EVENTS = 1024
+
+    # Columns of the heatmap image, one pixel per address
+    IMAGE_WIDTH = 64
+
+    def __init__(self, cpu):
+        self.CPU = cpu
+        self.SIZE = len(cpu.memory)
+
+        self.READS = array('I', bytes(4 * self.SIZE))
+        self.WRITES = array('I', bytes(4 * self.SIZE))
+        self.EXECUTES = array('I', bytes(4 * self.SIZE))
+
+        # Bytes fetched as part of an instruction, padded so the marks for
+        # an instruction at the last address never resize it
+        self.EXECUTED = bytearray(self.SIZE + 4)
+
+        self.INSTRUCTIONS = 0
+        self.SELF_MODIFYING_WRITES = 0
+        self.EVENTS = []                # (instruction, writer PC, address, value)
+
+        self.ORIGINAL_HANDLERS = None
+        self.PREVIOUS_METHODS = None    # EXECUTE and READ_MEMORY set on the CPU instance before ATTACH
+
+    def ATTACH(self):
+        """
+        Install the counting versions of EXECUTE, READ_MEMORY and the
+        handlers that access memory. Other tools wrapping them must be
+        detached in the reverse order.
+        """
+        cpu = self.CPU
+        registers = cpu.CpuRegisters
+        execute = cpu.EXECUTE
+        read_memory = cpu.READ_MEMORY
+        executes = self.EXECUTES
+        executed = self.EXECUTED
+        profiler = self
+
+        call = cpu.OperationLookupTable[0x2]
+        bcd = cpu.MSCLookup[0x33]
+        store = cpu.MSCLookup[0x55]
+        load = cpu.MSCLookup[0x65]
+        save = cpu.RANGELookup[0x2]
+        restore = cpu.RANGELookup[0x3]
+        self.ORIGINAL_HANDLERS = (call, bcd, store, load, save, restore)
+        self.PREVIOUS_METHODS = {name: vars(cpu).get(name) for name in ('EXECUTE', 'READ_MEMORY')}
+
+        def PROFILED_EXECUTE(OPERAND=None):
+            if OPERAND:
+                return execute(OPERAND)
+
+            pc = registers['PC']
+            executes[pc] += 1
+            executed[pc] = executed[pc + 1] = 1
+            profiler.INSTRUCTIONS += 1
+
+            operand = execute()
+
+            # XO-CHIP F000 NNNN, the address word is part of the instruction
+            if operand == 0xF000 and cpu.QUIRKS['xochip']:
+                executed[pc + 2] = executed[pc + 3] = 1
+            return operand
+
+        def PROFILED_READ_MEMORY(address, size):
+            data = read_memory(address, size)
+            profiler.COUNT_READ(address, size)
+            return data
+
+        def PROFILED_JMP_SBR():
+            address = registers['SP']
+            call()
+            profiler.COUNT_WRITE(address, 2)
+
+        def PROFILED_STR_BCD_MEM():
+            address = registers['I']
+            bcd()
+            profiler.COUNT_WRITE(address, 3)
+
+        def PROFILED_STR_REG_MEM():
+            address = registers['I']
+            store()
+            profiler.COUNT_WRITE(address, ((cpu.CurrentOperand & 0x0F00) >> 8) + 1)
+
+        def PROFILED_LD_REG_MEM():
+            address = registers['I']
+            load()
+            profiler.COUNT_READ(address, ((cpu.CurrentOperand & 0x0F00) >> 8) + 1)
+
+        def PROFILED_STR_RANGE_MEM():
+            address = registers['I']
+            save()
+            profiler.COUNT_WRITE(address, profiler.RANGE_SIZE(cpu.CurrentOperand))
+
+        def PROFILED_LD_RANGE_MEM():
+            address = registers['I']
+            restore()
+            profiler.COUNT_READ(address, profiler.RANGE_SIZE(cpu.CurrentOperand))
+
+        cpu.EXECUTE = PROFILED_EXECUTE
+        cpu.READ_MEMORY = PROFILED_READ_MEMORY
+
+        # With the internal stack quirk calls do not write to memory
+        if cpu.QUIRKS['stack'] == 'memory':
+            cpu.OperationLookupTable[0x2] = PROFILED_JMP_SBR
+        cpu.MSCLookup[0x33] = PROFILED_STR_BCD_MEM
+        cpu.MSCLookup[0x55] = PROFILED_STR_REG_MEM
+        cpu.MSCLookup[0x65] = PROFILED_LD_REG_MEM
+        cpu.RANGELookup[0x2] = PROFILED_STR_RANGE_MEM
+        cpu.RANGELookup[0x3] = PROFILED_LD_RANGE_MEM
+
+    def DETACH(self):
+        if self.ORIGINAL_HANDLERS is None:
+            return
+
+        cpu = self.CPU
+        for name, method in self.PREVIOUS_METHODS.items():
+            if method is None:
+                delattr(cpu, name)
+            else:
+                setattr(cpu, name, method)
+        self.PREVIOUS_METHODS = None
+
+        call, bcd, store, load, save, restore = self.ORIGINAL_HANDLERS
+        cpu.OperationLookupTable[0x2] = call
+        cpu.MSCLookup[0x33] = bcd
+        cpu.MSCLookup[0x55] = store
+        cpu.MSCLookup[0x65] = load
+        cpu.RANGELookup[0x2] = save
+        cpu.RANGELookup[0x3] = restore
+        self.ORIGINAL_HANDLERS = None
+
+    @staticmethod
+    def RANGE_SIZE(operand):
+        return abs(((operand & 0x0F00) >> 8) - ((operand & 0x00F0) >> 4)) + 1
+
+    def COUNT_READ(self, start, count):
+        reads = self.READS
+        for address in range(start, start + count):
+            reads[address] += 1
+
+    def COUNT_WRITE(self, start, count):
+        """
+        Count a write that has already happened, noting writes to code
+        """
+        writes = self.WRITES
+        executed = self.EXECUTED
+        memory = self.CPU.memory
+
+        for address in range(start, start + count):
+            writes[address] += 1
+
+            if executed[address]:
+                self.SELF_MODIFYING_WRITES += 1
+                if len(self.EVENTS) < self.MAX_EVENTS:
+                    pc = self.CPU.CpuRegisters['PC'] - 2
+                    self.EVENTS.append((self.INSTRUCTIONS, pc, address, memory[address]))
+
+    # Results
+    def HOT_REGIONS(self):
+        """
+        Returns the runs of consecutive executed bytes as (start, end, fetches),
+        end inclusive, the most fetched first
+        """
+        regions = []
+        executed = self.EXECUTED
+        address = 0
+
+        while address < self.SIZE:
+            if not executed[address]:
+                address += 1
+                continue
+
+            start = address
+            while address < self.SIZE and executed[address]:
+                address += 1
+            regions.append((start, address - 1, sum(self.EXECUTES[start:address])))
+
+        regions.sort(key=lambda region: (-region[2], region[0]))
+        return regions
+
+    def TO_DICT(self):
+        return {
+            'memory_size': self.SIZE,
+            'instructions': self.INSTRUCTIONS,
+            'self_modifying': self.SELF_MODIFYING_WRITES > 0,
+            'self_modifying_writes': self.SELF_MODIFYING_WRITES,
+            'events': [
+                {'instruction': instruction, 'pc': pc, 'address': address, 'value': value}
+                for instruction, pc, address, value in self.EVENTS
+            ],
+            'hot_regions': [
+                {'start': start, 'end': end, 'fetches': fetches}
+                for start, end, fetches in self.HOT_REGIONS()
+            ],
+            'reads': self.SPARSE(self.READS),
+            'writes': self.SPARSE(self.WRITES),
+            'executes': self.SPARSE(self.EXECUTES),
+        }
+
+    @staticmethod
+    def SPARSE(counters):
+        return {'{:04X}'.format(address): count for address, count in enumerate(counters) if count}
+
+    def TO_JSON(self, indent=None):
+        return json.dumps(self.TO_DICT(), indent=indent)
+
+    def TO_PPM(self, scale=4):
+        """
+        Render the counters as a binary PPM image, IMAGE_WIDTH addresses per
+        row: red is writes, green is reads and blue is fetches, each on a
+        log scale of its own maximum
+        """
+        width = self.IMAGE_WIDTH
+        height = -(-self.SIZE // width)
+
+        channels = []
+        for counters in (self.WRITES, self.READS, self.EXECUTES):
+            peak = math.log1p(max(counters) or 1)
+            channels.append(bytes(int(255 * math.log1p(count) / peak) for count in counters))
+
+        pixels = bytearray(3 * width * height)
+        for channel, values in enumerate(channels):
+            pixels[channel:3 * self.SIZE:3] = values
+
+        rows = []
+        for row in range(height):
+            line = pixels[row * width * 3:(row + 1) * width * 3]
+            line = b''.join(line[x * 3:x * 3 + 3] * scale for x in range(width))
+            rows.append(line * scale)
+
+        header = 'P6\n{} {}\n255\n'.format(width * scale, height * scale).encode('ascii')
+        return header + b''.join(rows)
+
+    def REPORT(self):
+        """
+        Returns a short text summary
+        """
+        lines = ['{} instructions, {} bytes executed'.format(self.INSTRUCTIONS, sum(self.EXECUTED))]
+
+        for start, end, fetches in self.HOT_REGIONS()[:8]:
+            lines.append('  {:03X}-{:03X} {:>10} fetches'.format(start, end, fetches))
+
+        if self.SELF_MODIFYING_WRITES:
+            lines.append('self-modifying: {} writes to executed addresses'.format(self.SELF_MODIFYING_WRITES))
+            for instruction, pc, address, value in self.EVENTS[:8]:
+                lines.append('  {:>10} {:03X}: wrote {:02X} to {:03X}'.format(instruction, pc, value, address))
+        else:
+            lines.append('no self-modifying code, safe to cache decoded blocks')
+
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from architecture import Architecture
+    from chip8 import DEFAULT_FONT
+    from romdb import RomDatabase
+
+    parser = argparse.ArgumentParser(description='Profile the memory accesses of a CHIP-8 ROM')
+    parser.add_argument('rom')
+    parser.add_argument('--font', default=DEFAULT_FONT)
+    parser.add_argument('--instructions', type=int, default=100000)
+    parser.add_argument('--quirks', help='quirk profile, default from the ROM database')
+    parser.add_argument('--json', metavar='FILE', help='write the counters as JSON')
+    parser.add_argument('--image', metavar='FILE', help='write the heatmap as a PPM image')
+    parser.add_argument('--scale', type=int, default=4, help='pixels per address in the image')
+    args = parser.parse_args()
+
+    settings = RomDatabase().LOOKUP_FILE(args.rom)
+
+    CPU = Architecture(quirks=args.quirks or settings['quirks'])
+    CPU.LOAD_ROMFILE(args.font, 0)
+    CPU.LOAD_ROMFILE(args.rom)
+
+    profiler = MemoryProfiler(CPU)
+    profiler.ATTACH()
+
+    for count in range(args.instructions):
+        if CPU.EXECUTE() == 0x00FD:
+            break
+        if count % settings['cycles_per_frame'] == settings['cycles_per_frame'] - 1:
+            CPU.DECREMENT_TIMERS()
+            CPU.keypad.NEXT_FRAME()
+
+    profiler.DETACH()
+    print(profiler.REPORT())
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json_file.write(profiler.TO_JSON(indent=2))
+
+    if args.image:
+        with open(args.image, 'wb') as image_file:
+            image_file.write(profiler.TO_PPM(args.scale))
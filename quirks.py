@@ -0,0 +1,69 @@
+# Interpreters for the CHIP-8 family disagree on a handful of instructions.
+# A quirk profile picks one behaviour for each of them, and Architecture
+# swaps the matching handler variants into its lookup tables when it is
+# built (see Architecture.APPLY_QUIRKS), so the choice costs nothing per
+# instruction.
+#
+#   shift         - 'VS': 8XY6/8XYE shift VX in place
+#                   'VT': VX = VY shifted (original COSMAC VIP)
+#   load_store_i  - 'unchanged': FX55/FX65 leave I alone
+#                   'increment': I is left pointing past the last register
+#   jump          - 'I':  BNNN jumps to I + NNN
+#                   'V0': BNNN jumps to V0 + NNN
+#                   'VX': BXNN jumps to VX + XNN (SCHIP)
+#   draw          - 'wrap': sprites wrap around the screen edges
+#                   'clip': sprites are cut off at the screen edges
+#   stack         - 'memory':   return addresses are pushed into memory
+#                               starting at STACK_POINTER_START
+#                   'internal': return addresses live in a separate list,
+#                               SP still moves by 2 per call
+#   vf_reset      - True: 8XY1/8XY2/8XY3 set VF to 0 (COSMAC VIP)
+#   xochip        - True: XO-CHIP extensions, 64 KB of memory, F000 NNNN,
+#                   00DN, 5XY2/5XY3, FN01 with two bitplanes, F002/FX3A audio,
+#                   16x16 sprites in either resolution, and skips that step
+#                   over the 4 byte F000 NNNN
+
+QUIRK_PROFILES = {
+    # The behaviour this emulator has always had
+    'default': {
+        'shift': 'VS',
+        'load_store_i': 'unchanged',
+        'jump': 'I',
+        'draw': 'wrap',
+        'stack': 'memory',
+        'vf_reset': False,
+        'xochip': False,
+    },
+    # The original COSMAC VIP interpreter
+    'chip8': {
+        'shift': 'VT',
+        'load_store_i': 'increment',
+        'jump': 'V0',
+        'draw': 'clip',
+        'stack': 'memory',
+        'vf_reset': True,
+        'xochip': False,
+    },
+    # SUPER-CHIP 1.1 on the HP48
+    'schip': {
+        'shift': 'VS',
+        'load_store_i': 'unchanged',
+        'jump': 'VX',
+        'draw': 'clip',
+        'stack': 'internal',
+        'vf_reset': False,
+        'xochip': False,
+    },
+    # XO-CHIP as implemented by Octo
+    'xochip': {
+        'shift': 'VT',
+        'load_store_i': 'increment',
+        'jump': 'V0',
+        'draw': 'wrap',
+        'stack': 'internal',
+        'vf_reset': False,
+        'xochip': True,
+    },
+}
+
+DEFAULT_PROFILE = 'default'
@@ -0,0 +1,71 @@
+from quirks import DEFAULT_PROFILE
+
+import hashlib
+import json
+import os
+
+
+# Settings used for ROMs that are not in the database, and for any field
+# an entry leaves out
+DEFAULT_ENTRY = {
+    'name': None,
+    'cycles_per_frame': 10,         # Instructions executed per 60 Hz frame
+    'quirks': DEFAULT_PROFILE,      # Name of a profile in quirks.py
+    'keymap': {},                   # CHIP-8 key (hex digit) -> pygame key name
+}
+
+DEFAULT_DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'romdb.json')
+
+
+class RomDatabase(object):
+    """
+    Per ROM settings keyed by the SHA-1 of the ROM bytes.
+
+    The JSON file is only read the first time a ROM is looked up, after that
+    lookups are a dictionary access on the in-memory index.
+    """
+
+    def __init__(self, filename=DEFAULT_DATABASE):
+        self.FILENAME = filename
+        self.INDEX = None
+
+    @staticmethod
+    def HASH(rom):
+        return hashlib.sha1(rom).hexdigest()
+
+    def LOAD(self):
+        """
+        Read the database file into the index. A missing file is an empty database.
+        """
+        self.INDEX = {}
+        if os.path.exists(self.FILENAME):
+            with open(self.FILENAME) as database_file:
+                self.INDEX = json.load(database_file)
+
+    def LOOKUP(self, rom):
+        """
+        Returns the settings for the ROM bytes, with defaults filled in
+        """
+        if self.INDEX is None:
+            self.LOAD()
+
+        entry = dict(DEFAULT_ENTRY)
+        entry.update(self.INDEX.get(self.HASH(rom), {}))
+        return entry
+
+    def LOOKUP_FILE(self, filename):
+        with open(filename, 'rb') as rom_file:
+            return self.LOOKUP(rom_file.read())
+
+    def SET(self, rom, **settings):
+        """
+        Add or update the entry for the ROM bytes and write the database
+        """
+        if self.INDEX is None:
+            self.LOAD()
+
+        self.INDEX.setdefault(self.HASH(rom), {}).update(settings)
+
+        with open(self.FILENAME, 'w') as database_file:
+            json.dump(self.INDEX, database_file, indent=4)
+            database_file.write('\n')
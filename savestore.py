@@ -0,0 +1,339 @@
+from exceptions import SaveStoreException
+from romdb import RomDatabase
+
+import json
+import mmap
+import os
+import struct
+import time
+
+
+# RPL file header: magic, format version, number of slots
+HEADER = struct.Struct('<4sHH')
+MAGIC = b'C8RP'
+VERSION = 1
+
+# One slot per ROM: SHA-1 digest of the ROM, the 16 RPL flags, and when the
+# slot was last attached (seconds since the epoch) for LRU reuse
+SLOT = struct.Struct('<20s16sI')
+RPL_OFFSET = 20
+RPL_SIZE = 16
+LAST_USED = struct.Struct('<I')
+LAST_USED_OFFSET = 36
+
+# Save state file: magic, format version, size of the JSON part. The JSON
+# part holds the quirk profile, memory size and the scalar registers, and is
+# followed by the raw memory, audio pattern and screen pixels
+STATE_HEADER = struct.Struct('<4sHI')
+STATE_MAGIC = b'C8ST'
+STATE_VERSION = 2
+
+DEFAULT_STORE = os.path.join(os.path.expanduser('~'), '.chip8')
+
+
+class SaveStore(object):
+    """
+    Per ROM persistent data, kept in a directory:
+
+        rpl.bin        the SCHIP RPL flags of every ROM, memory mapped
+        states/        save states, one file per ROM hash and slot name
+
+    ATTACH_RPL points CpuRegisters['RPL'] straight into the mapped file, so
+    FX75 costs nothing extra. The mapping is only flushed to disk by TICK
+    once the flags have not changed for IDLE_FLUSH seconds, and by CLOSE.
+    Nothing is written until there is something to keep: without an RPL
+    file the flags stay in the CPU until they first change, and only then
+    are the directory and the file created.
+
+    Save states hold Architecture.SNAPSHOT as plain data, JSON for the
+    registers and raw bytes for memory and the screen, together with the
+    quirk profile and memory size it was taken with, and are only loaded
+    into a CPU that matches them. They leave out the RPL flags, which
+    belong to the ROM and not to one point in a game. Only the MAX_STATES
+    most recently used are kept; loading a state counts as a use. Nothing
+    in a state file is executed, so a store from elsewhere is safe to load.
+    """
+
+    # Slots in a new RPL file, the least recently used slot is reused once full
+    RPL_SLOTS = 1024
+
+    # Seconds the RPL flags must stay unchanged before they are written out
+    IDLE_FLUSH = 2.0
+
+    # Save states kept over all ROMs
+    MAX_STATES = 64
+
+    def __init__(self, directory=DEFAULT_STORE):
+        self.DIRECTORY = directory
+        self.RPL_FILE = os.path.join(directory, 'rpl.bin')
+        self.STATE_DIRECTORY = os.path.join(directory, 'states')
+
+        self.FILE = None
+        self.MAP = None
+        self.INDEX = None           # ROM digest -> slot number, read on first use
+
+        self.ATTACHED = []          # [cpu, ROM digest, view or None until mapped]
+        self.SEEN = []              # RPL contents at the last TICK, per attached cpu
+        self.CHANGED_AT = None      # time of the last change not flushed yet
+
+    # RPL flags
+    def OPEN_RPL(self):
+        """
+        Map the RPL file, creating it if it does not exist
+        """
+        os.makedirs(self.DIRECTORY, exist_ok=True)
+
+        if not os.path.exists(self.RPL_FILE):
+            with open(self.RPL_FILE, 'wb') as rpl_file:
+                rpl_file.write(HEADER.pack(MAGIC, VERSION, self.RPL_SLOTS))
+                rpl_file.write(bytes(SLOT.size * self.RPL_SLOTS))
+
+        self.FILE = open(self.RPL_FILE, 'r+b')
+        self.MAP = mmap.mmap(self.FILE.fileno(), 0)
+
+        if len(self.MAP) < HEADER.size:
+            raise SaveStoreException(self.RPL_FILE, 'file too short')
+
+        magic, version, slots = HEADER.unpack_from(self.MAP)
+        if magic != MAGIC or version != VERSION or len(self.MAP) != HEADER.size + slots * SLOT.size:
+            raise SaveStoreException(self.RPL_FILE, 'unsupported header')
+
+        self.INDEX = {}
+        for slot in range(slots):
+            digest = SLOT.unpack_from(self.MAP, self.SLOT_OFFSET(slot))[0]
+            if any(digest):
+                self.INDEX[digest] = slot
+
+    @staticmethod
+    def SLOT_OFFSET(slot):
+        return HEADER.size + slot * SLOT.size
+
+    def FIND_SLOT(self, digest):
+        """
+        Returns the slot for the ROM digest, taking an empty slot or the least
+        recently used one for a new ROM
+        """
+        slot = self.INDEX.get(digest)
+        if slot is not None:
+            return slot
+
+        slots = HEADER.unpack_from(self.MAP)[2]
+        used = set(self.INDEX.values())
+        free = [slot for slot in range(slots) if slot not in used]
+
+        if free:
+            slot = free[0]
+        else:
+            slot = min(used, key=lambda slot: LAST_USED.unpack_from(self.MAP, self.SLOT_OFFSET(slot) + LAST_USED_OFFSET))
+            del self.INDEX[SLOT.unpack_from(self.MAP, self.SLOT_OFFSET(slot))[0]]
+
+        SLOT.pack_into(self.MAP, self.SLOT_OFFSET(slot), digest, bytes(RPL_SIZE), 0)
+        self.INDEX[digest] = slot
+        return slot
+
+    def ATTACH_RPL(self, cpu, rom):
+        """
+        Make the RPL flags of cpu persistent for the ROM bytes. The flags
+        stored for the ROM are loaded right away if there is an RPL file.
+        """
+        attached = [cpu, bytes.fromhex(RomDatabase.HASH(rom)), None]
+        self.ATTACHED.append(attached)
+
+        if self.MAP is not None or os.path.exists(self.RPL_FILE):
+            self.MAP_RPL(attached)
+        self.SEEN.append(bytes(cpu.CpuRegisters['RPL']))
+
+    def MAP_RPL(self, attached):
+        """
+        Point the RPL flags of an attached cpu into the slot of its ROM,
+        opening or creating the RPL file first if needed
+        """
+        if self.MAP is None:
+            self.OPEN_RPL()
+
+        cpu, digest, _ = attached
+        offset = self.SLOT_OFFSET(self.FIND_SLOT(digest))
+        LAST_USED.pack_into(self.MAP, offset + LAST_USED_OFFSET, int(time.time()))
+
+        view = memoryview(self.MAP)[offset + RPL_OFFSET:offset + RPL_OFFSET + RPL_SIZE]
+        cpu.CpuRegisters['RPL'] = attached[2] = view
+        return view
+
+    def UPDATE_RPL(self, now):
+        """
+        Note flags that changed since the last call, and map the ones that
+        changed for the first time into the RPL file
+        """
+        for index, attached in enumerate(self.ATTACHED):
+            flags = attached[0].CpuRegisters['RPL']
+            if flags != self.SEEN[index]:
+                self.SEEN[index] = bytes(flags)
+                if attached[2] is None:
+                    self.MAP_RPL(attached)[:] = self.SEEN[index]
+                self.CHANGED_AT = now
+
+    def TICK(self, now=None):
+        """
+        Called once per frame, flushes the RPL flags once they have been
+        left alone for IDLE_FLUSH seconds
+        """
+        now = time.monotonic() if now is None else now
+        self.UPDATE_RPL(now)
+
+        if self.CHANGED_AT is not None and now - self.CHANGED_AT >= self.IDLE_FLUSH:
+            self.MAP.flush()
+            self.CHANGED_AT = None
+
+    def CLOSE(self):
+        """
+        Flush everything and unmap the RPL file. Attached cores keep a copy
+        of their flags in a plain bytearray.
+        """
+        self.UPDATE_RPL(time.monotonic())
+
+        for cpu, _, view in self.ATTACHED:
+            if view is not None:
+                cpu.CpuRegisters['RPL'] = bytearray(view)
+                view.release()
+        self.ATTACHED = []
+        self.SEEN = []
+        self.CHANGED_AT = None
+
+        if self.MAP is not None:
+            self.MAP.flush()
+            self.MAP.close()
+            self.FILE.close()
+            self.MAP = None
+            self.FILE = None
+
+    # Save states
+    def STATE_FILE(self, rom, slot):
+        return os.path.join(self.STATE_DIRECTORY, '{}-{}.state'.format(RomDatabase.HASH(rom), slot))
+
+    def SAVE_STATE(self, cpu, rom, slot='0'):
+        """
+        Save the state of cpu, except the RPL flags, under the ROM hash and
+        slot name
+        """
+        os.makedirs(self.STATE_DIRECTORY, exist_ok=True)
+
+        filename = self.STATE_FILE(rom, slot)
+        with open(filename + '.tmp', 'wb') as state_file:
+            state_file.write(self.PACK_STATE(cpu))
+        os.replace(filename + '.tmp', filename)
+
+        self.EVICT_STATES()
+
+    def LOAD_STATE(self, cpu, rom, slot='0'):
+        """
+        Restore the state saved for the ROM hash and slot name. Returns False
+        if there is none. A state saved with another quirk profile or memory
+        size is refused with a SaveStoreException and cpu is left alone.
+        """
+        filename = self.STATE_FILE(rom, slot)
+        if not os.path.exists(filename):
+            return False
+
+        with open(filename, 'rb') as state_file:
+            data = state_file.read()
+
+        state, snapshot = self.UNPACK_STATE(filename, data)
+        if state['quirks'] != cpu.QUIRKS:
+            raise SaveStoreException(filename, 'saved with a different quirk profile')
+        if state['memory_size'] != len(cpu.memory):
+            raise SaveStoreException(filename, 'saved with {} bytes of memory, not {}'.format(
+                state['memory_size'], len(cpu.memory)))
+
+        cpu.RESTORE(snapshot)
+
+        # Mark the state as recently used
+        os.utime(filename)
+        return True
+
+    @staticmethod
+    def PACK_STATE(cpu):
+        """
+        Returns the contents of a state file for cpu
+        """
+        snapshot = cpu.SNAPSHOT()
+        HEIGHT, WIDTH, PIXELS = snapshot['screen']
+        state = {
+            'quirks': cpu.QUIRKS,
+            'memory_size': len(snapshot['memory']),
+            'pattern_size': len(snapshot['PATTERN']),
+            'screen': [HEIGHT, WIDTH],
+        }
+        for name in ('V', 'I', 'SP', 'STACK', 'PC', 'DT', 'ST', 'MODE', 'PLANES', 'PITCH'):
+            state[name] = snapshot[name]
+
+        text = json.dumps(state, sort_keys=True).encode('utf-8')
+        return b''.join([
+            STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION, len(text)),
+            text,
+            snapshot['memory'],
+            snapshot['PATTERN'],
+            PIXELS,
+        ])
+
+    @staticmethod
+    def UNPACK_STATE(filename, data):
+        """
+        Returns the JSON part of a state file and the snapshot it holds,
+        without the RPL flags. Raises a SaveStoreException if data is not a
+        well formed state.
+        """
+        if len(data) < STATE_HEADER.size:
+            raise SaveStoreException(filename, 'unsupported state format')
+        magic, version, length = STATE_HEADER.unpack_from(data)
+        if magic != STATE_MAGIC or version != STATE_VERSION:
+            raise SaveStoreException(filename, 'unsupported state format')
+
+        offset = STATE_HEADER.size + length
+        try:
+            state = json.loads(data[STATE_HEADER.size:offset].decode('utf-8'))
+            HEIGHT, WIDTH = state['screen']
+            sizes = [state['memory_size'], state['pattern_size'], HEIGHT * WIDTH]
+            if not all(isinstance(size, int) and size >= 0 for size in sizes):
+                raise ValueError('bad sizes')
+            if len(state['V']) != 16 or not isinstance(state['quirks'], dict):
+                raise ValueError('bad registers')
+            snapshot = {name: state[name] for name in
+                        ('V', 'I', 'SP', 'STACK', 'PC', 'DT', 'ST', 'MODE', 'PLANES', 'PITCH')}
+        except (ValueError, KeyError, TypeError):
+            raise SaveStoreException(filename, 'corrupt state')
+
+        if len(data) != offset + sum(sizes):
+            raise SaveStoreException(filename, 'corrupt state')
+        blobs = []
+        for size in sizes:
+            blobs.append(data[offset:offset + size])
+            offset += size
+        snapshot['memory'], snapshot['PATTERN'], PIXELS = blobs
+        snapshot['screen'] = (HEIGHT, WIDTH, PIXELS)
+        return state, snapshot
+
+    def STATES(self, rom):
+        """
+        Returns the slot names saved for the ROM bytes
+        """
+        if not os.path.isdir(self.STATE_DIRECTORY):
+            return []
+
+        prefix = RomDatabase.HASH(rom) + '-'
+        return sorted(
+            name[len(prefix):-len('.state')] for name in os.listdir(self.STATE_DIRECTORY)
+            if name.startswith(prefix) and name.endswith('.state')
+        )
+
+    def EVICT_STATES(self):
+        """
+        Delete the least recently used states over MAX_STATES
+        """
+        files = [
+            os.path.join(self.STATE_DIRECTORY, name) for name in os.listdir(self.STATE_DIRECTORY)
+            if name.endswith('.state')
+        ]
+        files.sort(key=os.path.getmtime)
+
+        for filename in files[:max(0, len(files) - self.MAX_STATES)]:
+            os.remove(filename)
@@ -1,9 +1,33 @@
+# Bitplanes. A pixel is the OR of the planes it is set in, so plain CHIP-8
+# only ever uses 0 and 1, and XO-CHIP with both planes uses 0 - 3.
+PLANE_1 = 1
+PLANE_2 = 2
+ALL_PLANES = PLANE_1 | PLANE_2
 
-from pygame import display, HWSURFACE, DOUBLEBUF, Color, draw
+# EXPAND[plane][byte] is the 8 pixel values of a sprite byte drawn in plane
+EXPAND = {
+    plane: [bytes(((byte >> (7 - bit)) & 1) * plane for bit in range(8)) for byte in range(256)]
+    for plane in (PLANE_1, PLANE_2)
+}
 
+# Translation tables that keep only, or remove, the given planes of each pixel
+ONLY_PLANES = {planes: bytes(value & planes for value in range(256)) for planes in range(4)}
+WITHOUT_PLANES = {planes: bytes(value & ~planes & 0xFF for value in range(256)) for planes in range(4)}
+
+
+class FrameBuffer(object):
+    """
+    The logical display, one byte per pixel in PIXELS (row major).
+
+    This is the state the CPU draws into. It does not need a window, so it
+    can be used on its own for headless cores, and Screen (presenter.py)
+    builds on it to show the pixels with pygame.
+
+    Sprites are drawn a row at a time: the row is expanded into pixel values
+    and XORed into the buffer as one integer, so no per pixel Python code
+    runs. Clearing and scrolling only touch the planes they are given.
+    """
 
-class Screen(object):
-    
     # Possible screen sizes
     SCREEN_HEIGHT_NORMAL = 32
     SCREEN_HEIGHT_EXTENDED = 64
@@ -11,74 +35,85 @@ class Screen(object):
     SCREEN_WIDTH_NORMAL = 64
     SCREEN_WIDTH_EXTENDED = 128
 
-    COLOR_DEPTH = 8
-
-    PIXEL_OFF = Color(0, 0, 0, 255)
-    PIXEL_ON = Color(255, 255, 255, 255)
-
-    def __init__(self, SCALE=1, HEIGHT=SCREEN_HEIGHT_NORMAL, WIDTH=SCREEN_WIDTH_NORMAL):
-        
-        # Setting the screen class height, width, and scale
+    def __init__(self, HEIGHT=SCREEN_HEIGHT_NORMAL, WIDTH=SCREEN_WIDTH_NORMAL):
         self.HEIGHT = HEIGHT
         self.WIDTH = WIDTH
-        self.SCALE = SCALE
-
-        #  Initialize a variable to hold the surface but don't use it
-        self.SURFACE = None
-
-        # Initialize the screen
-        self.INITIALIZE()
-
-    def INITIALIZE(self):
-        
-        # Initialize the display from pygame
-        display.init()
-
-        # Set the surface
-        self.SURFACE = display.set_mode(((self.WIDTH * self.SCALE), (self.HEIGHT * self.SCALE)), HWSURFACE | DOUBLEBUF, self.COLOR_DEPTH)
-        
-        # Setting the title of the display
-        display.set_caption('CHIP-8 Emulator')
-
-        # Clear the display, run update on it
-        self.CLEAR()
-        self.UPDATE()
-        self.CLEAR()    
+        self.PIXELS = bytearray(self.WIDTH * self.HEIGHT)
 
     def DRAW(self, x, y, state):
-        
-        # Setting pixel coordinates
-        x_origin = x * self.SCALE
-        y_origin = y * self.SCALE
-
-        # Whether to turn pixel on or off
-        if state == 0:
-            draw.rect(self.SURFACE, self.PIXEL_OFF, (x_origin, y_origin, self.SCALE, self.SCALE))
-        elif state == 1:
-            draw.rect(self.SURFACE, self.PIXEL_ON, (x_origin, y_origin, self.SCALE, self.SCALE))
+        self.PIXELS[y * self.WIDTH + x] = state
 
     def GET_STATE(self, x, y):
-        
-        # Checking if pixel is on or off
-        # Getting scaled coordinates
-        x_scaled = x * self.SCALE
-        y_scaled = y * self.SCALE
-
-        # Checking state
-        STATE = self.SURFACE.get_at((x_scaled, y_scaled))
-        if STATE == self.PIXEL_OFF:
-            return 0
+        return self.PIXELS[y * self.WIDTH + x]
+
+    def CLEAR(self, planes=ALL_PLANES):
+        """
+        Sets every pixel to off in the given planes
+        """
+        if planes == ALL_PLANES:
+            self.PIXELS[:] = bytes(len(self.PIXELS))
         else:
-            return 1
+            self.PIXELS[:] = self.PIXELS.translate(WITHOUT_PLANES[planes])
 
-    def CLEAR(self):
+    def XOR_SPAN(self, offset, values):
         """
-        Sets the entire screen to black (PIXEL_OFF)
+        XOR pixel values into PIXELS starting at offset. Returns True if any
+        pixel that was set in values was already set (a collision).
         """
-        self.SURFACE.fill(self.PIXEL_OFF)
+        end = offset + len(values)
+        new = int.from_bytes(values, 'big')
+        if not new:
+            return False
+
+        old = int.from_bytes(self.PIXELS[offset:end], 'big')
+        self.PIXELS[offset:end] = (old ^ new).to_bytes(len(values), 'big')
+        return old & new != 0
+
+    def DRAW_SPRITE(self, x, y, data, row_bytes=1, plane=PLANE_1, clip=False):
+        """
+        XOR a sprite into one plane at (x, y), row_bytes bytes per row of
+        data. The start position always wraps around the screen; the rest
+        of the sprite wraps as well unless clip is set, then it is cut off
+        at the edges. Returns True if any pixel was turned off.
+        """
+        width = self.WIDTH
+        height = self.HEIGHT
+        x %= width
+        y %= height
+
+        expand = EXPAND[plane]
+        span = row_bytes * 8
+        first = min(span, width - x)
+        collided = False
+
+        for row in range(len(data) // row_bytes):
+            line = y + row
+            if line >= height:
+                if clip:
+                    break
+                line -= height
+
+            if row_bytes == 1:
+                values = expand[data[row]]
+            else:
+                values = b''.join(expand[byte] for byte in data[row * row_bytes:(row + 1) * row_bytes])
+
+            start = line * width
+            collided |= self.XOR_SPAN(start + x, values[:first])
+            if first < span and not clip:
+                collided |= self.XOR_SPAN(start, values[first:])
+
+        return collided
 
     def UPDATE(self):
-        display.flip()
+        pass
+
+    def PRESENT(self):
+        """
+        Show the frame, called by the frontend once per frame. Nothing to
+        show without a window.
+        """
+        pass
 
     def GET_WIDTH(self):
         return self.WIDTH
@@ -86,73 +121,70 @@ class Screen(object):
     def GET_HEIGHT(self):
         return self.HEIGHT
 
-    @staticmethod
-    def DECONSTRUCTOR():
-        """
-        Destroys the current screen object.
-        """
-        display.quit()
+    def RESIZE(self, HEIGHT, WIDTH):
+        self.HEIGHT = HEIGHT
+        self.WIDTH = WIDTH
+        self.PIXELS = bytearray(self.WIDTH * self.HEIGHT)
 
     def SET_EXT(self):
         """
         Sets the screen mode to extended.
         """
-        self.DECONSTRUCTOR()
-        self.HEIGHT = self.SCREEN_HEIGHT_EXTENDED
-        self.WIDTH = self.SCREEN_WIDTH_EXTENDED
-        self.INITIALIZE()
+        self.RESIZE(self.SCREEN_HEIGHT_EXTENDED, self.SCREEN_WIDTH_EXTENDED)
 
     def SET_NORM(self):
         """
         Sets the screen mode to normal.
         """
-        self.DECONSTRUCTOR()
-        self.HEIGHT = self.SCREEN_HEIGHT_NORMAL
-        self.WIDTH = self.SCREEN_WIDTH_NORMAL
-        self.INITIALIZE()
+        self.RESIZE(self.SCREEN_HEIGHT_NORMAL, self.SCREEN_WIDTH_NORMAL)
 
-    def SCROLL_DOWN(self, num_lines):
+    def SNAPSHOT(self):
+        return self.HEIGHT, self.WIDTH, bytes(self.PIXELS)
 
-        # Scrolling lines down by grabbing previous row and copying it
-        range_flip = self.HEIGHT - num_lines
-        for y in reversed(range(range_flip)):
-            for x in range(self.WIDTH):
-                STATE = self.GET_STATE(x, y)
-                self.DRAW(x, y + num_lines, STATE)
+    def RESTORE(self, snapshot):
+        HEIGHT, WIDTH, PIXELS = snapshot
+        if (HEIGHT, WIDTH) != (self.HEIGHT, self.WIDTH):
+            self.RESIZE(HEIGHT, WIDTH)
+        self.PIXELS[:] = PIXELS
 
-        # Blank out the lines above the ones we scrolled
-        for y in range(num_lines):
-            for x in range(self.WIDTH):
-                self.DRAW(x, y, 0)
+    def SCROLL(self, scrolled, planes):
+        """
+        Replace the given planes with the ones in scrolled, keeping the rest
+        """
+        if planes == ALL_PLANES:
+            self.PIXELS[:] = scrolled
+            return
 
-        self.UPDATE()
+        kept = int.from_bytes(self.PIXELS.translate(WITHOUT_PLANES[planes]), 'big')
+        moved = int.from_bytes(scrolled.translate(ONLY_PLANES[planes]), 'big')
+        self.PIXELS[:] = (kept | moved).to_bytes(len(self.PIXELS), 'big')
 
-    def SCROLL_LEFT(self):
+    def SCROLL_DOWN(self, num_lines, planes=ALL_PLANES):
 
-        #  Scroll lines left by 4 pixels (hard coded)
-        for y in range(self.HEIGHT):
-            for x in range(4, self.WIDTH):
-                STATE = self.GET_STATE(x, y)
-                self.DRAW(x - 4, y, STATE)
+        # Move every row down by num_lines and blank out the rows above
+        shift = min(num_lines * self.WIDTH, len(self.PIXELS))
+        self.SCROLL(bytes(shift) + self.PIXELS[:len(self.PIXELS) - shift], planes)
 
-        # Blank out the lines to the right of the ones we just scrolled
-        for y in range(self.HEIGHT):
-            for x in range(self.WIDTH - 4, self.WIDTH):
-                self.DRAW(x, y, 0)
+    def SCROLL_UP(self, num_lines, planes=ALL_PLANES):
 
-        self.UPDATE()
+        # Move every row up by num_lines and blank out the rows below
+        shift = min(num_lines * self.WIDTH, len(self.PIXELS))
+        self.SCROLL(self.PIXELS[shift:] + bytes(shift), planes)
 
-    def SCROLL_RIGHT(self):
+    def SCROLL_LEFT(self, planes=ALL_PLANES):
 
-        # Scroll lines right by 4 pixels (hard coded)
-        for y in range(self.HEIGHT):
-            for x in range(self.WIDTH - 4, -1, -1):
-                STATE = self.GET_STATE(x, y)
-                self.DRAW(x + 4, y, STATE)
+        # Scroll lines left by 4 pixels (hard coded): shift the whole buffer,
+        # then blank the right 4 columns, which came from the next row
+        scrolled = self.PIXELS[4:] + bytes(4)
+        for column in range(self.WIDTH - 4, self.WIDTH):
+            scrolled[column::self.WIDTH] = bytes(self.HEIGHT)
+        self.SCROLL(scrolled, planes)
 
-        # Blank out the lines to the left of the ones we just scrolled
-        for y in range(self.HEIGHT):
-            for x in range(4):
-                self.DRAW(x, y, 0)
+    def SCROLL_RIGHT(self, planes=ALL_PLANES):
 
-        self.UPDATE()
\ No newline at end of file
+        # Scroll lines right by 4 pixels (hard coded): shift the whole buffer,
+        # then blank the left 4 columns, which came from the previous row
+        scrolled = bytearray(4) + self.PIXELS[:-4]
+        for column in range(4):
+            scrolled[column::self.WIDTH] = bytes(self.HEIGHT)
+        self.SCROLL(scrolled, planes)
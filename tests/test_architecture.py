@@ -0,0 +1,57 @@
+import pytest
+
+from architecture import Architecture
+
+
+def CPU(quirks='default'):
+    return Architecture(seed=1, quirks=quirks)
+
+
+def RUN(cpu, opcode, **registers):
+    for register, value in registers.items():
+        cpu.GeneralRegisters[int(register[1:], 16)] = value
+    cpu.EXECUTE(opcode)
+    return cpu.GeneralRegisters
+
+
+@pytest.mark.parametrize('x, y, result, flag', [(5, 3, 2, 1), (3, 3, 0, 1), (3, 5, 254, 0)])
+def test_sub_sets_vf_when_there_is_no_borrow(x, y, result, flag):
+    registers = RUN(CPU(), 0x8015, V0=x, V1=y)
+    assert (registers[0x0], registers[0xF]) == (result, flag)
+
+
+@pytest.mark.parametrize('x, y, result, flag', [(3, 5, 2, 1), (3, 3, 0, 1), (5, 3, 254, 0)])
+def test_subn_sets_vf_when_there_is_no_borrow(x, y, result, flag):
+    registers = RUN(CPU(), 0x8017, V0=x, V1=y)
+    assert (registers[0x0], registers[0xF]) == (result, flag)
+
+
+@pytest.mark.parametrize('x, result, flag', [(0x81, 0x02, 1), (0x41, 0x82, 0)])
+def test_shl_keeps_a_byte_and_flags_bit_7(x, result, flag):
+    registers = RUN(CPU(), 0x800E, V0=x)
+    assert (registers[0x0], registers[0xF]) == (result, flag)
+
+
+def test_index_register_wraps_at_16_bits():
+    cpu = CPU('xochip')
+    cpu.CpuRegisters['I'] = 0xFFF0
+    RUN(cpu, 0xF01E, V0=0x20)
+    assert cpu.CpuRegisters['I'] == 0x0010
+
+
+@pytest.mark.parametrize('quirks, scrolled', [('chip8', False), ('schip', False), ('xochip', True)])
+def test_scroll_up_only_under_xochip(quirks, scrolled):
+    cpu = CPU(quirks)
+    cpu.screen.PIXELS[cpu.screen.WIDTH] = 1
+    cpu.EXECUTE(0x00D1)
+    assert cpu.screen.PIXELS[0] == scrolled
+    assert cpu.screen.PIXELS[cpu.screen.WIDTH] == (not scrolled)
+
+
+def test_snapshot_with_another_memory_size_is_refused():
+    snapshot = CPU('xochip').SNAPSHOT()
+    cpu = CPU()
+    cpu.GeneralRegisters[0x1] = 7
+    with pytest.raises(ValueError):
+        cpu.RESTORE(snapshot)
+    assert cpu.GeneralRegisters[0x1] == 7
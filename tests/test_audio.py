@@ -0,0 +1,102 @@
+from architecture import Architecture
+from audio import NullAudio, RENDER_PATTERN, DEFAULT_PATTERN, DEFAULT_PITCH, SAMPLE_RATE, MIXER_BUFFER
+
+
+class CountingAudio(NullAudio):
+
+    def __init__(self):
+        NullAudio.__init__(self)
+        self.EVENTS = []
+
+    def START(self):
+        NullAudio.START(self)
+        self.EVENTS.append('start')
+
+    def STOP(self):
+        NullAudio.STOP(self)
+        self.EVENTS.append('stop')
+
+
+def CPU():
+    audio = CountingAudio()
+    cpu = Architecture(audio=audio)
+    audio.EVENTS.clear()
+    return cpu, audio
+
+
+def test_tone_starts_on_fx18_and_stops_on_the_tick():
+    cpu, audio = CPU()
+    cpu.GeneralRegisters[0x3] = 2
+    cpu.EXECUTE(0xF318)
+    assert audio.EVENTS == ['start']
+
+    cpu.DECREMENT_TIMERS()
+    assert audio.PLAYING
+    cpu.DECREMENT_TIMERS()
+    assert audio.EVENTS == ['start', 'stop']
+
+    cpu.DECREMENT_TIMERS()
+    assert audio.EVENTS == ['start', 'stop']
+
+
+def test_sound_timer_of_one_sounds_for_a_frame():
+    cpu, audio = CPU()
+    cpu.GeneralRegisters[0x0] = 1
+    cpu.EXECUTE(0xF018)
+    assert audio.PLAYING
+
+    cpu.DECREMENT_TIMERS()
+    assert not audio.PLAYING
+
+
+def test_only_changes_reach_the_backend():
+    cpu, audio = CPU()
+    cpu.GeneralRegisters[0x0] = 5
+    cpu.EXECUTE(0xF018)
+    cpu.EXECUTE(0xF018)
+
+    cpu.GeneralRegisters[0x0] = 0
+    cpu.EXECUTE(0xF018)
+    cpu.EXECUTE(0xF018)
+    assert audio.EVENTS == ['start', 'stop']
+
+
+def test_restore_resumes_the_tone():
+    cpu, audio = CPU()
+    cpu.Timers['ST'] = 10
+    snapshot = cpu.SNAPSHOT()
+
+    cpu.RESTORE(snapshot)
+    assert audio.PLAYING
+
+
+def test_default_pattern_is_a_250_hz_square_wave():
+    samples = RENDER_PATTERN(DEFAULT_PATTERN, DEFAULT_PITCH)
+    # The buffer loops, so count the change from the last sample to the first
+    changes = sum(1 for a, b in zip(samples, samples[1:] + samples[:1]) if a != b)
+    assert abs(changes / 2 / (len(samples) / SAMPLE_RATE) - 250) < 1
+
+
+def test_mixer_buffer_is_under_one_frame():
+    assert MIXER_BUFFER / SAMPLE_RATE < 1 / 60
+
+
+class PatternAudio(CountingAudio):
+
+    def START(self):
+        CountingAudio.START(self)
+        self.EVENTS.append((self.PATTERN, self.PITCH))
+
+
+def test_restored_tone_starts_with_the_restored_pattern_and_pitch():
+    cpu, audio = CPU()
+    cpu.audio.SET_PATTERN(bytes(range(16)))
+    cpu.audio.SET_PITCH(80)
+    cpu.Timers['ST'] = 5
+    snapshot = cpu.SNAPSHOT()
+
+    audio = PatternAudio()
+    cpu = Architecture(audio=audio)
+    audio.EVENTS.clear()
+    cpu.RESTORE(snapshot)
+    assert audio.EVENTS == ['start', (bytes(range(16)), 80)]
@@ -0,0 +1,98 @@
+import json
+import os
+import subprocess
+import sys
+
+import chip8
+from architecture import Architecture
+from savestore import SaveStore
+
+LOOP = bytes([0x12, 0x00])
+COUNT = bytes([0x70, 0x01, 0x12, 0x00])
+
+
+def WRITE_ROMS(tmp_path):
+    roms = []
+    for name, program in (('loop.ch8', LOOP), ('count.ch8', COUNT)):
+        path = tmp_path / name
+        path.write_bytes(program)
+        roms.append(str(path))
+    return roms
+
+
+def test_batch_reports_a_mismatched_state_and_runs_the_other_roms(tmp_path, capsys):
+    loop, count = WRITE_ROMS(tmp_path)
+    store = SaveStore(str(tmp_path / 'store'))
+    store.SAVE_STATE(Architecture(quirks='schip'), LOOP)
+    with open(store.STATE_FILE(LOOP, '0'), 'rb') as state_file:
+        saved = state_file.read()
+
+    status = chip8.MAIN(['batch', loop, count, '--instructions', '100',
+                         '--store', store.DIRECTORY, '--resume', '0', '--save', '0'])
+
+    assert status == 1
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].startswith('loop.ch8') and 'SaveStoreException' in lines[0]
+    assert lines[1].startswith('count.ch8') and lines[1].endswith('ok')
+    # The refused state is left as it was, the other ROM's state is saved
+    with open(store.STATE_FILE(LOOP, '0'), 'rb') as state_file:
+        assert state_file.read() == saved
+    assert os.path.exists(store.STATE_FILE(COUNT, '0'))
+
+
+def test_batch_reports_a_corrupt_state_in_a_pool(tmp_path, capsys):
+    loop, count = WRITE_ROMS(tmp_path)
+    store = SaveStore(str(tmp_path / 'store'))
+    os.makedirs(store.STATE_DIRECTORY)
+    with open(store.STATE_FILE(COUNT, '0'), 'wb') as state_file:
+        state_file.write(b'not a state')
+
+    status = chip8.MAIN(['batch', loop, count, '--instructions', '100', '--jobs', '2',
+                         '--store', store.DIRECTORY, '--resume', '0'])
+
+    assert status == 1
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].endswith('ok')
+    assert 'SaveStoreException' in lines[1]
+
+
+def test_headless_run_never_imports_pygame(tmp_path):
+    loop = WRITE_ROMS(tmp_path)[0]
+    code = (
+        'import sys; sys.path.insert(0, {root!r}); import chip8; '
+        'assert chip8.RUN_HEADLESS({rom!r}, instructions=1000)["result"] == "ok"; '
+        'assert "pygame" not in sys.modules'
+    ).format(root=chip8.ROOT, rom=loop)
+    process = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    assert process.returncode == 0, process.stderr
+
+
+def test_disasm_command_writes_the_listing_and_graph(tmp_path, capsys):
+    count = WRITE_ROMS(tmp_path)[1]
+    graph = str(tmp_path / 'graph.json')
+    dot = str(tmp_path / 'graph.dot')
+
+    assert chip8.MAIN(['disasm', count, '--json', graph, '--dot', dot]) == 0
+    listing = capsys.readouterr().out
+    assert 'ADD' in listing and 'JUMP' in listing
+    with open(graph) as graph_file:
+        assert json.load(graph_file)
+    assert os.path.getsize(dot)
+
+
+def test_batch_command_summarizes_every_rom(tmp_path, capsys):
+    roms = WRITE_ROMS(tmp_path)
+
+    assert chip8.MAIN(['batch'] + roms + ['--instructions', '1000']) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert [line.split()[0] for line in lines] == ['loop.ch8', 'count.ch8']
+    assert all(line.endswith('ok') for line in lines)
+
+
+def test_bench_startup_fails_over_the_limit(tmp_path, capsys):
+    loop = WRITE_ROMS(tmp_path)[0]
+
+    assert chip8.MAIN(['bench', loop, '--startup', '--runs', '1', '--max-ms', '60000']) == 0
+    assert 'cold start' in capsys.readouterr().out
+    assert chip8.MAIN(['bench', loop, '--startup', '--runs', '1', '--max-ms', '0']) == 1
+    assert 'over the 0.0 ms limit' in capsys.readouterr().out
@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from conformance import LOCKSTEP, TEST_OPCODES
+from chip8 import DEFAULT_FONT, ROOT
+
+
+@pytest.mark.parametrize('core', ['reference', 'schip', 'xochip'])
+def test_every_handler_agrees_with_itself(core):
+    report = TEST_OPCODES(core, core, trials=20, cache=None)
+    assert report and all(result == 'pass' for _, result, _, _ in report)
+
+
+def test_different_profiles_disagree_on_the_quirks():
+    report = {name: result for name, result, _, _ in TEST_OPCODES('default', 'chip8', trials=50, cache=None)}
+    assert report['ELILookup[6]'] == 'fail'
+    assert report['ELILookup[4]'] == 'pass'
+
+
+def test_results_are_cached(tmp_path):
+    cache = str(tmp_path / 'cache.json')
+    TEST_OPCODES(trials=5, cache=cache)
+    assert all(cached for _, _, _, cached in TEST_OPCODES(trials=5, cache=cache))
+
+
+def test_lockstep_on_a_rom():
+    rom = os.path.join(ROOT, 'c8games', 'PONG')
+    assert LOCKSTEP(rom, DEFAULT_FONT, instructions=2000, every=50) is None
+    assert LOCKSTEP(rom, DEFAULT_FONT, 'default', 'chip8', instructions=20000) is not None
+
+
+def test_handler_hash_follows_tables_and_quirks(monkeypatch):
+    import screen
+    from architecture import Architecture
+    from conformance import HANDLER_HASH
+
+    cpu = Architecture()
+    draw = cpu.OperationLookupTable[0xD]
+    before = HANDLER_HASH(cpu, draw)
+    assert HANDLER_HASH(Architecture(), Architecture().OperationLookupTable[0xD]) == before
+
+    # A module level table the drawing code reads
+    monkeypatch.setitem(screen.EXPAND, screen.PLANE_1, list(reversed(screen.EXPAND[screen.PLANE_1])))
+    assert HANDLER_HASH(cpu, draw) != before
+    monkeypatch.undo()
+
+    # The quirk profile of the core
+    cpu.QUIRKS = dict(cpu.QUIRKS, draw='clip')
+    assert HANDLER_HASH(cpu, draw) != before
@@ -0,0 +1,95 @@
+import subprocess
+import sys
+
+import debugger as debugger_module
+from architecture import Architecture
+from debugger import Debugger
+
+
+def DEBUGGER(program):
+    cpu = Architecture(seed=1)
+    cpu.memory[0x200:0x200 + len(program)] = bytes(program)
+    return Debugger(cpu)
+
+
+# 200: CALL 206 / 202: LOAD V1, 01 / 204: JUMP 204 / 206: LOAD V0, 05 / 208: RTS
+CALL_PROGRAM = [0x22, 0x06, 0x61, 0x01, 0x12, 0x04, 0x60, 0x05, 0x00, 0xEE]
+
+
+def test_step_over_runs_the_subroutine():
+    debugger = DEBUGGER(CALL_PROGRAM)
+
+    assert debugger.STEP_OVER() == Debugger.STEPPED
+    assert debugger.CPU.CpuRegisters['PC'] == 0x202
+    assert debugger.CPU.GeneralRegisters[0x0] == 5
+
+
+def test_step_over_stops_at_false_conditional_breakpoint():
+    debugger = DEBUGGER(CALL_PROGRAM)
+    debugger.ADD_BREAKPOINT(0x202, 'V0 == 9')
+
+    assert debugger.STEP_OVER() == Debugger.STEPPED
+    assert debugger.CPU.CpuRegisters['PC'] == 0x202
+
+    # The user breakpoint is left as it was
+    assert debugger.BREAKPOINTS[0x202] and 0x202 in debugger.CONDITIONS
+
+
+def test_conditional_breakpoint():
+    debugger = DEBUGGER(CALL_PROGRAM)
+    debugger.ADD_BREAKPOINT(0x208, 'V0 == 5')
+
+    assert debugger.RUN(limit=100) == Debugger.BREAKPOINT
+    assert debugger.CPU.CpuRegisters['PC'] == 0x208
+
+
+def test_watchpoint_stops_after_write():
+    # 200: LOAD I, 300 / 202: STOR [I], V0 / 204: JUMP 204
+    debugger = DEBUGGER([0xA3, 0x00, 0xF0, 0x55, 0x12, 0x04])
+    debugger.ADD_WATCHPOINT(0x300)
+
+    assert debugger.RUN(limit=100) == Debugger.WATCHPOINT
+    assert debugger.LAST_WATCHPOINT.address == 0x300
+
+
+def test_timers_follow_the_wall_clock(monkeypatch):
+    clock = [0.0]
+
+    def PERF_COUNTER():
+        return clock[0]
+
+    monkeypatch.setattr(debugger_module.time, 'perf_counter', PERF_COUNTER)
+
+    # 200: JUMP 200
+    debugger = DEBUGGER([0x12, 0x00])
+    debugger.CPU.Timers['DT'] = 30
+
+    # However many instructions run, no time passing means no ticks
+    debugger.RUN(limit=Debugger.INSTRUCTIONS_PER_CHECK * 20)
+    assert debugger.CPU.Timers['DT'] == 30
+
+    # Each look at the clock now finds one frame gone by
+    def ADVANCING():
+        clock[0] += 1.0 / Debugger.TICK_RATE
+        return clock[0]
+
+    monkeypatch.setattr(debugger_module.time, 'perf_counter', ADVANCING)
+    debugger.RUN(limit=Debugger.INSTRUCTIONS_PER_CHECK * 10)
+    assert 20 <= debugger.CPU.Timers['DT'] < 30
+
+
+def test_import_does_not_load_pygame():
+    code = 'import debugger, sys; sys.exit(1 if "pygame" in sys.modules else 0)'
+    assert subprocess.run([sys.executable, '-c', code], cwd=debugger_module.__file__.rsplit('/', 1)[0]).returncode == 0
+
+
+def test_disassemble_uses_the_cpu_quirks():
+    # 200: LOAD I, 1234 / 204: EXIT
+    program = bytes([0xF0, 0x00, 0x12, 0x34, 0x00, 0xFD])
+
+    cpu = Architecture(quirks='xochip')
+    cpu.memory[0x200:0x206] = program
+    assert [line.split()[2] for line in Debugger(cpu).DISASSEMBLE(0x200, 2)] == ['LOAD', 'EXIT']
+
+    assert Debugger(cpu).DISASSEMBLE(0x200, 2)[1].startswith(' 204')
+    assert DEBUGGER(program).DISASSEMBLE(0x200, 2)[1].startswith(' 202')
@@ -0,0 +1,73 @@
+from disassembler import Disassembler
+from quirks import QUIRK_PROFILES
+
+
+def IDLE_LOOPS(program):
+    disassembler = Disassembler(bytes(program))
+    return disassembler.TRACE().IDLE_LOOPS()
+
+
+def test_delay_timer_wait_is_idle():
+    # 200: LOAD V0, DT / 202: SKE V0, 00 / 204: JUMP 200 / 206: EXIT
+    assert IDLE_LOOPS([0xF0, 0x07, 0x30, 0x00, 0x12, 0x00, 0x00, 0xFD]) == [0x200, 0x204]
+
+
+def test_key_wait_is_idle():
+    # 200: SKPR V0 / 202: JUMP 200 / 204: EXIT
+    assert IDLE_LOOPS([0xE0, 0x9E, 0x12, 0x00, 0x00, 0xFD]) == [0x200, 0x202]
+
+
+def test_register_compare_loop_is_not_idle():
+    # 200: SKE V0, V1 / 202: JUMP 200 / 204: EXIT
+    assert IDLE_LOOPS([0x50, 0x10, 0x12, 0x00, 0x00, 0xFD]) == []
+
+
+def test_loop_that_writes_is_not_idle():
+    # 200: LOAD V0, DT / 202: ADD V1, 01 / 204: SKE V0, 00 / 206: JUMP 200 / 208: EXIT
+    assert IDLE_LOOPS([0xF0, 0x07, 0x71, 0x01, 0x30, 0x00, 0x12, 0x00, 0x00, 0xFD]) == []
+
+
+def test_trace_separates_code_from_data():
+    # 200: JUMP 204 / 202: data / 204: EXIT
+    disassembler = Disassembler(bytes([0x12, 0x04, 0xFF, 0xFF, 0x00, 0xFD]))
+    cfg = disassembler.TRACE()
+
+    assert cfg.IS_CODE(0x200) and cfg.IS_CODE(0x204)
+    assert not cfg.IS_CODE(0x202)
+
+
+def test_xochip_instructions_only_under_the_xochip_profile():
+    # 200: SAVE V1 - V3 / 202: LOAD I, 1234 / 206: EXIT
+    program = bytes([0x51, 0x32, 0xF0, 0x00, 0x12, 0x34, 0x00, 0xFD])
+
+    xochip = Disassembler(program, quirks='xochip')
+    xochip.TRACE()
+    assert xochip.INSTRUCTIONS[0x200][:2] == ('SAVE', 'V1 - V3')
+    assert xochip.INSTRUCTIONS[0x202][:2] == ('LOAD', 'I, 1234')
+    assert xochip.SIZE_AT(0x202) == 4
+    assert 0x206 in xochip.INSTRUCTIONS
+
+    chip8 = Disassembler(program)
+    chip8.TRACE()
+    assert chip8.INSTRUCTIONS == {}
+    assert chip8.SIZE_AT(0x202) == 2
+    assert Disassembler.DECODE(0xF000, 0x1234)[0] == 'DB'
+
+
+def test_scroll_up_only_under_xochip():
+    assert Disassembler.DECODE(0x00D3, quirks=QUIRK_PROFILES['xochip'])[:2] == ('SCRU', '3')
+    for quirks in ('chip8', 'schip'):
+        assert Disassembler.DECODE(0x00D3, quirks=QUIRK_PROFILES[quirks])[:2] == ('SYS', '0D3')
+
+
+def test_skip_steps_over_long_load_under_xochip():
+    # 200: SKE V0, 00 / 202: LOAD I, 1234 / 206: EXIT
+    disassembler = Disassembler(bytes([0x30, 0x00, 0xF0, 0x00, 0x12, 0x34, 0x00, 0xFD]), quirks='xochip')
+    disassembler.TRACE()
+    assert sorted(disassembler.INSTRUCTIONS) == [0x200, 0x202, 0x206]
+
+
+def test_jump_with_offset_follows_the_jump_quirk():
+    assert Disassembler(bytes([0xB3, 0x10])).DECODE_AT(0x200)[1] == '[I] + 310'
+    assert Disassembler(bytes([0xB3, 0x10]), quirks='chip8').DECODE_AT(0x200)[1] == '[V0] + 310'
+    assert Disassembler(bytes([0xB3, 0x10]), quirks='schip').DECODE_AT(0x200)[1] == '[V3] + 310'
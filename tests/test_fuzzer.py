@@ -0,0 +1,175 @@
+import pytest
+
+from architecture import Architecture
+from exceptions import MemoryAccessException
+from fuzzer import REPLAY, Case, Fuzzer
+
+
+def FUZZER(tmp_path, program, **options):
+    rom = tmp_path / 'test.ch8'
+    rom.write_bytes(bytes(program))
+    return Fuzzer(str(rom), **options)
+
+
+def test_memory_access_past_the_end_is_reported_before_writing():
+    cpu = Architecture()
+    cpu.CpuRegisters['I'] = 0xFFE
+    cpu.GeneralRegisters[0x0] = 0xAA
+    with pytest.raises(MemoryAccessException):
+        cpu.EXECUTE(0xF255)
+    assert cpu.memory[0xFFE:] == bytes(2)
+
+    cpu.CpuRegisters['PC'] = 0xFFF
+    with pytest.raises(MemoryAccessException):
+        cpu.EXECUTE()
+
+
+@pytest.mark.parametrize('program, kind', [
+    # 200: RTS
+    ([0x00, 0xEE], 'stack-underflow'),
+    # 200: CALL 200
+    ([0x22, 0x00], 'stack-overflow'),
+    # 200: LOAD I, FFF / 202: STOR [I], V1
+    ([0xAF, 0xFF, 0xF1, 0x55], 'memory'),
+    # 200: DB 8008
+    ([0x80, 0x08], 'unknown-opcode'),
+])
+def test_crashes_are_classified(tmp_path, program, kind):
+    fuzzer = FUZZER(tmp_path, program, frames=4)
+    crash = fuzzer.RUN(Case(bytes(8)))[1]
+    assert crash[:2] == (kind, 0x200 if kind != 'memory' else 0x202)
+
+
+def test_other_exceptions_are_internal_errors():
+    assert Fuzzer.CLASSIFY(ZeroDivisionError()) == 'internal-error'
+    assert Fuzzer.CLASSIFY(IndexError()) == 'internal-error'
+
+
+def test_checkpoints_stay_within_the_budget(tmp_path):
+    # 200: ADD V0, 01 / 202: JUMP 200
+    fuzzer = FUZZER(tmp_path, [0x70, 0x01, 0x12, 0x00], frames=600)
+    assert fuzzer.INTERVAL == 38
+
+    fuzzer.MAX_CHECKPOINTS = 40
+    for mask in range(6):
+        case = Case(bytes([mask, 0]) * 600)
+        fuzzer.RUN(case)
+        assert len(case.CHECKPOINTS) == fuzzer.MAX_CASE_CHECKPOINTS
+        fuzzer.ADD(case)
+
+    # Only the two most recently used cases fit
+    assert [len(case.CHECKPOINTS) for case in fuzzer.CORPUS] == [0, 0, 0, 0, 16, 16]
+    assert fuzzer.CHECKPOINT_COUNT == 32
+
+
+def test_skip_at_the_end_of_memory_is_a_memory_crash():
+    cpu = Architecture(quirks='xochip')
+    cpu.CpuRegisters['PC'] = len(cpu.memory) - 2
+    cpu.memory[-2:] = bytes([0x30, 0x00])
+    with pytest.raises(MemoryAccessException):
+        cpu.EXECUTE()
+
+
+# 200: LOAD V0, 05 / 202: SKP V0 / 204: JUMP 202 / 206: JUMP 206
+WAIT_FOR_KEY = [0x60, 0x05, 0xE0, 0x9E, 0x12, 0x02, 0x12, 0x06]
+
+# 200: LOAD V0, 05 / 202: ADD V2, 01 / 204: SKNP V0 / 206: LOAD V1, 01
+# 208: SKP V0 / 20A: LOAD V1, 00 / 20C: JUMP 202
+# Five instructions per loop whichever way the key is, V2 counts them
+FOLLOW_KEY = [0x60, 0x05, 0x72, 0x01, 0xE0, 0xA1, 0x61, 0x01, 0xE0, 0x9E, 0x61, 0x00, 0x12, 0x02]
+
+# 200: LOAD V0, 05 / 202: SKNP V0 / 204: RTS / 206: JUMP 202
+CRASH_ON_KEY = [0x60, 0x05, 0xE0, 0xA1, 0x00, 0xEE, 0x12, 0x02]
+
+
+def HOLD(frames, key, first, last):
+    keys = bytearray(2 * frames)
+    for frame in range(first, last):
+        keys[2 * frame:2 * frame + 2] = (1 << key).to_bytes(2, 'little')
+    return bytes(keys)
+
+
+def test_case_reaching_a_new_edge_joins_the_corpus(tmp_path):
+    fuzzer = FUZZER(tmp_path, WAIT_FOR_KEY, frames=60)
+    fuzzer.SEED()
+    assert (0x202 << 16 | 0x206) not in fuzzer.EDGES
+
+    for _ in range(500):
+        fuzzer.STEP()
+        if len(fuzzer.CORPUS) > 1:
+            break
+
+    # Only pressing key 5 leads anywhere new, and only once
+    for _ in range(100):
+        fuzzer.STEP()
+    assert len(fuzzer.CORPUS) == 2
+    assert (0x202 << 16 | 0x206) in fuzzer.EDGES
+    keys = fuzzer.CORPUS[1].KEYS
+    assert any(keys[2 * frame] & 0x20 for frame in range(60))
+
+
+@pytest.mark.parametrize('last, stop', [(46, 60), (120, None)])
+def test_forked_run_matches_a_run_from_power_on(tmp_path, last, stop):
+    fuzzer = FUZZER(tmp_path, FOLLOW_KEY, cycles_per_frame=10, frames=120)
+    parent = Case(bytes(240))
+    fuzzer.RUN(parent)
+
+    child = Case(HOLD(120, 5, 40, last))
+    child.CHECKPOINTS = {frame: state for frame, state in parent.CHECKPOINTS.items() if frame <= 40}
+    assert fuzzer.RUN(child, 30, child.CHECKPOINTS[30], parent, last)[1] is None
+    forked = fuzzer.CPU.SNAPSHOT()
+
+    full = Case(child.KEYS)
+    fuzzer.RUN(full)
+    assert child.CHECKPOINTS == full.CHECKPOINTS
+    if stop is None:
+        assert forked == fuzzer.CPU.SNAPSHOT()
+    else:
+        # Back in step with the parent, the run stopped at that checkpoint
+        assert forked == full.CHECKPOINTS[stop][0]
+        assert forked != fuzzer.CPU.SNAPSHOT()
+
+
+def test_minimized_crash_still_crashes_and_replays(tmp_path):
+    fuzzer = FUZZER(tmp_path, CRASH_ON_KEY, frames=60, mutate_rom=True)
+    keys = bytearray(HOLD(60, 5, 20, 30))
+    for frame in range(60):
+        keys[2 * frame + 1] |= 0x81
+    case = Case(keys, [(0, 0x60), (8, 0xFF)])
+    kind, pc, message, frame = fuzzer.RUN(case)[1]
+    assert (kind, pc, frame) == ('stack-underflow', 0x204, 20)
+
+    minimized, crash = fuzzer.MINIMIZE(case, (kind, pc))
+    assert crash[:2] == (kind, pc)
+    assert minimized.FRAMES() == 21
+    assert sum(map(bool, minimized.KEYS)) < sum(map(bool, case.KEYS))
+    assert minimized.PATCHES == ()
+
+    filename = fuzzer.SAVE_CRASH(str(tmp_path / 'crashes'), minimized, crash)
+    assert REPLAY(filename)[:2] == (kind, pc)
+
+
+def test_checkpoints_stay_within_the_budget_while_fuzzing(tmp_path):
+    # For every key K: LOAD V0, K / SKNP V0 / JUMP to a JUMP 200 of its own
+    program = []
+    for key in range(16):
+        landing = 0x200 + 16 * 6 + 2 + 2 * key
+        program += [0x60, key, 0xE0, 0xA1, 0x10 | landing >> 8, landing & 0xFF]
+    program += [0x12, 0x00] + [0x12, 0x00] * 16
+
+    class SmallFuzzer(Fuzzer):
+        CHECKPOINT_BUDGET = 3 * 16 * (4096 + 128 * 64)
+
+    rom = tmp_path / 'test.ch8'
+    rom.write_bytes(bytes(program))
+    fuzzer = SmallFuzzer(str(rom), cycles_per_frame=4, frames=480)
+    assert fuzzer.MAX_CHECKPOINTS == 48
+
+    fuzzer.SEED()
+    for _ in range(300):
+        fuzzer.STEP()
+
+    assert len(fuzzer.CORPUS) > 3
+    counts = [len(case.CHECKPOINTS) for case in fuzzer.CORPUS]
+    assert max(counts) == fuzzer.MAX_CASE_CHECKPOINTS
+    assert sum(counts) == fuzzer.CHECKPOINT_COUNT <= fuzzer.MAX_CHECKPOINTS
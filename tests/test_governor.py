@@ -0,0 +1,94 @@
+import pytest
+
+from governor import FrameGovernor
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.NOW = 100.0
+        self.SLEPT = []
+
+    def __call__(self):
+        return self.NOW
+
+    def SLEEP(self, seconds):
+        self.SLEPT.append(seconds)
+        self.NOW += seconds
+
+
+def GOVERNOR(cycles=10):
+    clock = FakeClock()
+    return FrameGovernor(cycles, clock=clock, sleep=clock.SLEEP), clock
+
+
+def RUN_FRAME(governor, clock, work):
+    cycles = governor.BEGIN_FRAME()
+    clock.NOW += work
+    governor.END_FRAME(cycles)
+    return cycles
+
+
+def test_frames_are_paced_on_absolute_deadlines():
+    governor, clock = GOVERNOR()
+    frame = governor.FRAME_TIME
+
+    for _ in range(60):
+        RUN_FRAME(governor, clock, 0.004)
+
+    # Each sleep makes up for the work, so there is no drift after a second
+    assert clock.NOW == pytest.approx(101.0)
+    assert clock.SLEPT[0] == pytest.approx(frame - 0.004)
+    assert governor.LATE == 0 and governor.DROPPED == 0
+
+
+def test_late_frame_is_caught_up_by_the_next_ones():
+    governor, clock = GOVERNOR()
+    frame = governor.FRAME_TIME
+
+    RUN_FRAME(governor, clock, 0.001)
+    RUN_FRAME(governor, clock, 1.5 * frame)
+    assert governor.LATE == 1
+
+    # The next frame starts at once and only sleeps until its own deadline
+    RUN_FRAME(governor, clock, 0.001)
+    assert clock.NOW == pytest.approx(100.0 + 3 * frame)
+    assert governor.DROPPED == 0
+
+
+def test_frames_far_behind_are_dropped():
+    governor, clock = GOVERNOR()
+    frame = governor.FRAME_TIME
+
+    RUN_FRAME(governor, clock, 10 * frame)
+    assert governor.DROPPED == 9
+
+    # The schedule starts over instead of racing through the missed frames
+    RUN_FRAME(governor, clock, 0.001)
+    assert clock.SLEPT[-1] > 0
+    assert clock.NOW == pytest.approx(100.0 + 11 * frame)
+
+
+def test_cycles_drop_under_load_and_recover():
+    governor, clock = GOVERNOR(cycles=160)
+    frame = governor.FRAME_TIME
+
+    # Twice the budget halves the instructions per frame
+    RUN_FRAME(governor, clock, 2 * governor.BUDGET * frame)
+    assert 79 <= governor.CYCLES <= 80
+
+    for _ in range(16):
+        RUN_FRAME(governor, clock, 0.001)
+    assert governor.CYCLES == 160
+    assert governor.STATS()['adjustments'] > 1
+
+
+def test_stats_report_percentiles():
+    governor, clock = GOVERNOR()
+    for _ in range(11):
+        RUN_FRAME(governor, clock, 0.001)
+
+    stats = governor.STATS()
+    assert stats['frames'] == 11
+    assert stats['frame_ms']['p50'] == pytest.approx(1000 / 60)
+    assert '11 frames' in governor.REPORT()
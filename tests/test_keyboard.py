@@ -0,0 +1,79 @@
+from architecture import Architecture
+from keyboard import Keypad
+
+
+def test_press_and_release_update_the_mask():
+    keypad = Keypad()
+    keypad.PRESS(0x3)
+    keypad.PRESS(0xF)
+    assert keypad.MASK == (1 << 0x3) | (1 << 0xF)
+    assert keypad.IS_PRESSED(0xF)
+
+    keypad.RELEASE(0x3)
+    assert keypad.MASK == 1 << 0xF
+    assert not keypad.IS_PRESSED(0x3)
+
+
+def test_edges_only_for_keys_that_go_down():
+    keypad = Keypad()
+    keypad.SET_MASK(0b0011)
+    assert keypad.EDGES == 0b0011
+
+    keypad.NEXT_FRAME()
+    keypad.SET_MASK(0b0110)
+    assert keypad.EDGES == 0b0100
+
+    # Holding a key down is not a new press
+    keypad.PRESS(0x1)
+    assert keypad.EDGES == 0b0100
+
+
+def test_host_keys_ignore_unbound_keys():
+    keypad = Keypad()
+    keypad.BIND({0x5: 'w'})
+    keypad.HOST_KEY('w', True)
+    keypad.HOST_KEY('x', True)
+    assert keypad.MASK == 1 << 0x5
+
+    keypad.HOST_KEY('w', False)
+    assert keypad.MASK == 0
+
+
+def test_skip_if_pressed_and_not_pressed():
+    cpu = Architecture()
+    cpu.GeneralRegisters[0x2] = 0x7
+    cpu.keypad.PRESS(0x7)
+
+    pc = cpu.CpuRegisters['PC']
+    cpu.EXECUTE(0xE29E)
+    assert cpu.CpuRegisters['PC'] == pc + 2
+    cpu.EXECUTE(0xE2A1)
+    assert cpu.CpuRegisters['PC'] == pc + 2
+
+
+def test_wait_for_key_repeats_until_a_key_goes_down():
+    cpu = Architecture()
+    # 200: LOAD V4, KEY
+    cpu.memory[0x200:0x202] = bytes([0xF4, 0x0A])
+
+    # A key held since before the wait does not count
+    cpu.keypad.PRESS(0x2)
+    cpu.keypad.NEXT_FRAME()
+    cpu.EXECUTE()
+    assert cpu.CpuRegisters['PC'] == 0x200
+
+    cpu.keypad.PRESS(0x9)
+    cpu.keypad.PRESS(0x6)
+    cpu.EXECUTE()
+    assert cpu.CpuRegisters['PC'] == 0x202
+    assert cpu.GeneralRegisters[0x4] == 0x6
+
+    # The other press is still there for the next FX0A in the same frame
+    cpu.CpuRegisters['PC'] = 0x200
+    cpu.EXECUTE()
+    assert cpu.GeneralRegisters[0x4] == 0x9
+
+    cpu.keypad.NEXT_FRAME()
+    cpu.CpuRegisters['PC'] = 0x200
+    cpu.EXECUTE()
+    assert cpu.CpuRegisters['PC'] == 0x200
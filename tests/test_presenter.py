@@ -0,0 +1,29 @@
+import pytest
+
+from presenter import Screen, FADE_BASE, MAX_FADE
+
+
+def test_longest_fade_fills_the_palette():
+    screen = Screen(FADE=MAX_FADE)
+    assert len(screen.PALETTE) == 256
+    assert max(screen.FADE_STEP) < 256
+    assert FADE_BASE + 3 * MAX_FADE <= 256
+
+
+@pytest.mark.parametrize('fade', [-1, MAX_FADE + 1])
+def test_fade_outside_the_palette_is_rejected(fade):
+    with pytest.raises(ValueError):
+        Screen(FADE=fade)
+
+
+def test_off_pixels_fade_out_then_turn_off():
+    screen = Screen(FADE=2)
+    screen.DRAW(0, 0, 1)
+    screen.PRESENT()
+
+    screen.DRAW(0, 0, 0)
+    shown = []
+    for _ in range(3):
+        screen.PRESENT()
+        shown.append(screen.INDICES[0])
+    assert shown == [FADE_BASE, FADE_BASE + 1, 0]
@@ -0,0 +1,72 @@
+from architecture import Architecture
+from profiler import MemoryProfiler
+
+
+def PROFILE(program, count, quirks='default'):
+    cpu = Architecture(seed=1, quirks=quirks)
+    cpu.memory[0x200:0x200 + len(program)] = bytes(program)
+
+    profiler = MemoryProfiler(cpu)
+    profiler.ATTACH()
+    for _ in range(count):
+        cpu.EXECUTE()
+    profiler.DETACH()
+    return profiler
+
+
+def test_counts_fetches_reads_and_writes():
+    # 200: LOAD I, 300 / 202: STOR [I], V1 / 204: LOAD V1, [I] / 206: JUMP 206
+    profiler = PROFILE([0xA3, 0x00, 0xF1, 0x55, 0xF1, 0x65, 0x12, 0x06], 6)
+
+    assert profiler.EXECUTES[0x206] == 3
+    assert (profiler.WRITES[0x300], profiler.WRITES[0x301], profiler.WRITES[0x302]) == (1, 1, 0)
+    assert (profiler.READS[0x300], profiler.READS[0x301]) == (1, 1)
+    assert profiler.HOT_REGIONS()[0] == (0x200, 0x207, 6)
+    assert not profiler.TO_DICT()['self_modifying']
+
+
+def test_detects_writes_to_executed_code():
+    # 200: LOAD I, 206 / 202: LOAD V0, 00 / 204: STOR [I], V0 / 206: LOAD V1, 01 / 208: JUMP 200
+    profiler = PROFILE([0xA2, 0x06, 0x60, 0x00, 0xF0, 0x55, 0x61, 0x01, 0x12, 0x00], 10)
+
+    assert profiler.SELF_MODIFYING_WRITES == 1
+    assert profiler.EVENTS[0][1:] == (0x204, 0x206, 0x00)
+
+
+def test_long_load_marks_its_address_word_as_code():
+    # 200: LOAD I, 0206 / 204: JUMP 204
+    profiler = PROFILE([0xF0, 0x00, 0x02, 0x06, 0x12, 0x04], 2, quirks='xochip')
+    assert list(profiler.EXECUTED[0x200:0x206]) == [1] * 6
+
+
+def test_detach_restores_the_cpu():
+    cpu = Architecture()
+    handlers = dict(cpu.MSCLookup)
+    profiler = MemoryProfiler(cpu)
+    profiler.ATTACH()
+    profiler.DETACH()
+
+    assert 'EXECUTE' not in vars(cpu) and 'READ_MEMORY' not in vars(cpu)
+    assert cpu.MSCLookup == handlers
+
+
+def test_detach_keeps_a_tracer_attached_before_it(tmp_path):
+    from tracer import Tracer
+
+    cpu = Architecture()
+    cpu.memory[0x200:0x202] = bytes([0x12, 0x00])
+    tracer = Tracer(cpu, ring_size=8)
+    tracer.ATTACH()
+    traced = cpu.EXECUTE
+
+    profiler = MemoryProfiler(cpu)
+    profiler.ATTACH()
+    cpu.EXECUTE()
+    profiler.DETACH()
+
+    assert cpu.EXECUTE is traced
+    cpu.EXECUTE()
+    assert tracer.CYCLE == 2 and profiler.INSTRUCTIONS == 1
+
+    tracer.DETACH()
+    assert 'EXECUTE' not in vars(cpu)
@@ -0,0 +1,69 @@
+import pytest
+
+from architecture import Architecture
+from exceptions import StackException
+
+
+def RUN(quirks, *opcodes, **registers):
+    cpu = Architecture(seed=1, quirks=quirks)
+    for register, value in registers.items():
+        if register in cpu.CpuRegisters:
+            cpu.CpuRegisters[register] = value
+        else:
+            cpu.GeneralRegisters[int(register[1:], 16)] = value
+
+    for opcode in opcodes:
+        cpu.EXECUTE(opcode)
+    return cpu
+
+
+@pytest.mark.parametrize('quirks, result, flag', [('default', 0x02, 0), ('chip8', 0x40, 1)])
+def test_shift_right_uses_vx_or_vy(quirks, result, flag):
+    cpu = RUN(quirks, 0x8016, V0=0x04, V1=0x81)
+    assert (cpu.GeneralRegisters[0x0], cpu.GeneralRegisters[0xF]) == (result, flag)
+
+
+@pytest.mark.parametrize('quirks, result, flag', [('default', 0x08, 0), ('chip8', 0x02, 1)])
+def test_shift_left_uses_vx_or_vy(quirks, result, flag):
+    cpu = RUN(quirks, 0x801E, V0=0x04, V1=0x81)
+    assert (cpu.GeneralRegisters[0x0], cpu.GeneralRegisters[0xF]) == (result, flag)
+
+
+@pytest.mark.parametrize('quirks, index', [('default', 0x300), ('chip8', 0x303)])
+def test_load_store_leaves_or_increments_i(quirks, index):
+    cpu = RUN(quirks, 0xF255, I=0x300, V0=1, V1=2, V2=3)
+    assert cpu.memory[0x300:0x303] == bytes([1, 2, 3])
+    assert cpu.CpuRegisters['I'] == index
+
+    cpu = RUN(quirks, 0xF265, I=0x300)
+    assert cpu.CpuRegisters['I'] == index
+
+
+@pytest.mark.parametrize('quirks, target', [('default', 0x410), ('chip8', 0x322), ('schip', 0x330)])
+def test_jump_with_offset(quirks, target):
+    cpu = RUN(quirks, 0xB310, I=0x100, V0=0x12, V3=0x20)
+    assert cpu.CpuRegisters['PC'] == target
+
+
+@pytest.mark.parametrize('opcode', [0x8011, 0x8012, 0x8013])
+@pytest.mark.parametrize('quirks, flag', [('default', 7), ('chip8', 0)])
+def test_logic_ops_reset_vf(opcode, quirks, flag):
+    cpu = RUN(quirks, opcode, V0=0x0C, V1=0x0A, VF=7)
+    assert cpu.GeneralRegisters[0xF] == flag
+
+
+def test_internal_stack_calls_and_returns():
+    cpu = RUN('schip', 0x2400, PC=0x202)
+    assert cpu.CALL_STACK() == [0x202]
+    assert cpu.memory[cpu.STACK_POINTER_START] == 0
+
+    cpu.EXECUTE(0x00EE)
+    assert cpu.CpuRegisters['PC'] == 0x202
+    assert cpu.CALL_STACK() == []
+
+
+def test_internal_stack_underflow_raises_stack_exception():
+    cpu = Architecture(quirks='schip')
+    with pytest.raises(StackException) as raised:
+        cpu.EXECUTE(0x00EE)
+    assert raised.value.reason == 'underflow'
@@ -0,0 +1,48 @@
+import json
+
+from romdb import RomDatabase, DEFAULT_ENTRY
+
+ROM = bytes([0x12, 0x00])
+
+
+def test_unknown_rom_gets_the_defaults(tmp_path):
+    database = RomDatabase(str(tmp_path / 'missing.json'))
+    assert database.LOOKUP(ROM) == DEFAULT_ENTRY
+
+
+def test_entry_overrides_only_the_fields_it_has(tmp_path):
+    filename = tmp_path / 'romdb.json'
+    filename.write_text(json.dumps({RomDatabase.HASH(ROM): {'quirks': 'schip', 'cycles_per_frame': 30}}))
+
+    settings = RomDatabase(str(filename)).LOOKUP(ROM)
+    assert (settings['quirks'], settings['cycles_per_frame']) == ('schip', 30)
+    assert settings['keymap'] == {}
+
+
+def test_set_writes_the_database(tmp_path):
+    filename = str(tmp_path / 'romdb.json')
+    RomDatabase(filename).SET(ROM, name='Loop', quirks='chip8')
+
+    settings = RomDatabase(filename).LOOKUP(ROM)
+    assert (settings['name'], settings['quirks']) == ('Loop', 'chip8')
+
+
+def test_lookup_does_not_share_the_defaults(tmp_path):
+    database = RomDatabase(str(tmp_path / 'missing.json'))
+    database.LOOKUP(ROM)['quirks'] = 'xochip'
+    assert database.LOOKUP(ROM)['quirks'] == DEFAULT_ENTRY['quirks']
+
+
+def test_shipped_entries_name_known_profiles():
+    from quirks import QUIRK_PROFILES
+
+    database = RomDatabase()
+    database.LOAD()
+    assert database.INDEX
+    assert all(entry.get('quirks', DEFAULT_ENTRY['quirks']) in QUIRK_PROFILES for entry in database.INDEX.values())
+
+
+def test_shipped_entries_only_use_known_fields():
+    database = RomDatabase()
+    database.LOAD()
+    assert all(set(entry) <= set(DEFAULT_ENTRY) for entry in database.INDEX.values())
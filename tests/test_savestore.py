@@ -0,0 +1,159 @@
+import os
+import pickle
+
+import pytest
+
+from architecture import Architecture
+from exceptions import SaveStoreException
+from savestore import STATE_HEADER, SaveStore
+
+ROM = bytes([0x12, 0x00])
+
+
+def test_run_that_never_saves_creates_nothing(tmp_path):
+    directory = tmp_path / 'store'
+    store = SaveStore(str(directory))
+    store.ATTACH_RPL(Architecture(), ROM)
+    store.TICK()
+    store.CLOSE()
+
+    assert not directory.exists()
+
+
+def test_rpl_flags_persist_once_they_change(tmp_path):
+    directory = str(tmp_path / 'store')
+    cpu = Architecture()
+    store = SaveStore(directory)
+    store.ATTACH_RPL(cpu, ROM)
+
+    cpu.GeneralRegisters[0x0] = 0x42
+    cpu.EXECUTE(0xF075)
+    store.TICK(now=0)
+    assert os.path.exists(store.RPL_FILE)
+
+    # Changes after the file is mapped go straight into it
+    cpu.GeneralRegisters[0x1] = 0x43
+    cpu.EXECUTE(0xF175)
+    store.CLOSE()
+    assert cpu.CpuRegisters['RPL'][:2] == bytearray([0x42, 0x43])
+
+    cpu = Architecture()
+    store = SaveStore(directory)
+    store.ATTACH_RPL(cpu, ROM)
+    assert cpu.CpuRegisters['RPL'][:2] == bytes([0x42, 0x43])
+    store.CLOSE()
+
+
+def test_change_just_before_close_is_kept(tmp_path):
+    directory = str(tmp_path / 'store')
+    cpu = Architecture()
+    store = SaveStore(directory)
+    store.ATTACH_RPL(cpu, ROM)
+
+    cpu.CpuRegisters['RPL'][5] = 7
+    store.CLOSE()
+
+    cpu = Architecture()
+    SaveStore(directory).ATTACH_RPL(cpu, ROM)
+    assert cpu.CpuRegisters['RPL'][5] == 7
+
+
+def test_state_round_trip_keeps_rpl_flags(tmp_path):
+    store = SaveStore(str(tmp_path))
+    cpu = Architecture()
+    cpu.GeneralRegisters[0x3] = 9
+    store.SAVE_STATE(cpu, ROM)
+
+    cpu.GeneralRegisters[0x3] = 0
+    cpu.CpuRegisters['RPL'][0] = 1
+    assert store.LOAD_STATE(cpu, ROM)
+    assert cpu.GeneralRegisters[0x3] == 9
+    assert cpu.CpuRegisters['RPL'][0] == 1
+
+    assert not store.LOAD_STATE(cpu, ROM, 'missing')
+
+
+def test_state_from_another_profile_is_refused(tmp_path):
+    store = SaveStore(str(tmp_path))
+    store.SAVE_STATE(Architecture(), ROM)
+
+    for quirks in ('schip', 'xochip'):
+        cpu = Architecture(quirks=quirks)
+        with pytest.raises(SaveStoreException):
+            store.LOAD_STATE(cpu, ROM)
+        assert cpu.CpuRegisters['PC'] == 0x200
+
+
+class Payload(object):
+    """
+    Creates a file when unpickled
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return open, (self.path, 'w')
+
+
+def test_pickled_state_is_refused_without_running_it(tmp_path):
+    store = SaveStore(str(tmp_path))
+    cpu = Architecture()
+    os.makedirs(store.STATE_DIRECTORY)
+    with open(store.STATE_FILE(ROM, '0'), 'wb') as state_file:
+        pickle.dump({'snapshot': Payload(str(tmp_path / 'ran'))}, state_file)
+
+    with pytest.raises(SaveStoreException):
+        store.LOAD_STATE(cpu, ROM)
+    assert not (tmp_path / 'ran').exists()
+
+
+def test_corrupt_state_is_refused(tmp_path):
+    store = SaveStore(str(tmp_path))
+    cpu = Architecture()
+    cpu.GeneralRegisters[0x3] = 9
+    store.SAVE_STATE(cpu, ROM)
+    filename = store.STATE_FILE(ROM, '0')
+    with open(filename, 'rb') as state_file:
+        data = state_file.read()
+
+    header = data[:STATE_HEADER.size]
+    for corrupt in (data[:-1], data + b'\0', header + b'[' + data[STATE_HEADER.size + 1:], header):
+        with open(filename, 'wb') as state_file:
+            state_file.write(corrupt)
+        with pytest.raises(SaveStoreException):
+            store.LOAD_STATE(Architecture(), ROM)
+
+
+def test_state_round_trip_keeps_the_whole_machine(tmp_path):
+    store = SaveStore(str(tmp_path))
+    cpu = Architecture(quirks='xochip')
+    cpu.memory[0x1234] = 0x56
+    cpu.STACK = [0x202, 0x204]
+    cpu.CpuRegisters['I'] = 0x300
+    cpu.Timers['DT'] = 30
+    cpu.MODE = 'extended'
+    cpu.screen.RESIZE(64, 128)
+    cpu.screen.PIXELS[5] = 3
+    cpu.audio.SET_PATTERN(bytes(range(16)))
+    cpu.audio.SET_PITCH(80)
+    snapshot = cpu.SNAPSHOT()
+    store.SAVE_STATE(cpu, ROM)
+
+    cpu = Architecture(quirks='xochip')
+    assert store.LOAD_STATE(cpu, ROM)
+    assert cpu.SNAPSHOT() == snapshot
+
+
+def test_least_recently_used_states_are_evicted(tmp_path):
+    store = SaveStore(str(tmp_path))
+    store.MAX_STATES = 3
+    cpu = Architecture()
+
+    for age, slot in enumerate('abc'):
+        store.SAVE_STATE(cpu, ROM, slot)
+        os.utime(store.STATE_FILE(ROM, slot), (1000 + age, 1000 + age))
+
+    # Loading a counts as a use, so b is now the oldest
+    store.LOAD_STATE(cpu, ROM, 'a')
+    store.SAVE_STATE(cpu, ROM, 'd')
+    assert store.STATES(ROM) == ['a', 'c', 'd']
@@ -0,0 +1,82 @@
+from screen import FrameBuffer, PLANE_1, PLANE_2
+
+
+def ROWS(screen):
+    return [bytes(screen.PIXELS[row * screen.WIDTH:(row + 1) * screen.WIDTH]) for row in range(screen.HEIGHT)]
+
+
+def test_draw_sprite_sets_pixels_and_reports_collisions():
+    screen = FrameBuffer()
+    assert not screen.DRAW_SPRITE(2, 1, bytes([0b10100000]))
+    assert [screen.GET_STATE(x, 1) for x in range(2, 5)] == [1, 0, 1]
+
+    # Drawing the same sprite again erases it and collides
+    assert screen.DRAW_SPRITE(2, 1, bytes([0b10100000]))
+    assert not any(screen.PIXELS)
+
+    # Overlapping only on unset pixels is not a collision
+    screen.DRAW_SPRITE(0, 0, bytes([0b10000000]))
+    assert not screen.DRAW_SPRITE(0, 0, bytes([0b01000000]))
+
+
+def test_draw_sprite_wraps_around_both_edges():
+    screen = FrameBuffer()
+    screen.DRAW_SPRITE(60, 31, bytes([0xFF, 0xFF]))
+
+    assert [screen.GET_STATE(x, 31) for x in (59, 60, 63, 0, 3, 4)] == [0, 1, 1, 1, 1, 0]
+    assert [screen.GET_STATE(x, 0) for x in (60, 3)] == [1, 1]
+
+
+def test_draw_sprite_start_wraps_even_when_clipping():
+    screen = FrameBuffer()
+    screen.DRAW_SPRITE(64 + 60, 32 + 31, bytes([0xFF, 0xFF]), clip=True)
+
+    assert [screen.GET_STATE(x, 31) for x in (60, 63, 0)] == [1, 1, 0]
+    assert not any(screen.PIXELS[:31 * 64])
+
+
+def test_draw_sprite_in_one_plane_keeps_the_other():
+    screen = FrameBuffer()
+    screen.DRAW_SPRITE(0, 0, bytes([0x80]), plane=PLANE_2)
+    assert not screen.DRAW_SPRITE(0, 0, bytes([0x80]), plane=PLANE_1)
+    assert screen.GET_STATE(0, 0) == PLANE_1 | PLANE_2
+
+    assert screen.DRAW_SPRITE(0, 0, bytes([0x80]), plane=PLANE_1)
+    assert screen.GET_STATE(0, 0) == PLANE_2
+
+
+def test_sixteen_pixel_wide_sprite():
+    screen = FrameBuffer(64, 128)
+    screen.DRAW_SPRITE(120, 0, bytes([0xFF, 0x01]), row_bytes=2)
+    assert [screen.GET_STATE(x, 0) for x in (119, 120, 127, 0, 6, 7)] == [0, 1, 1, 0, 0, 1]
+
+
+def test_scroll_left_and_right_blank_the_edge_columns():
+    screen = FrameBuffer()
+    for row in range(screen.HEIGHT):
+        screen.DRAW(0, row, 1)
+        screen.DRAW(63, row, 1)
+        screen.DRAW(10, row, 1)
+
+    screen.SCROLL_LEFT()
+    assert all(row[6] == 1 and row[59] == 1 and sum(row) == 2 for row in ROWS(screen))
+
+    screen.SCROLL_RIGHT()
+    assert all(row[10] == 1 and row[63] == 1 and sum(row) == 2 for row in ROWS(screen))
+
+
+def test_scroll_only_moves_the_given_planes():
+    screen = FrameBuffer()
+    screen.DRAW(8, 3, PLANE_1 | PLANE_2)
+
+    screen.SCROLL_RIGHT(PLANE_2)
+    screen.SCROLL_DOWN(2, PLANE_2)
+    assert screen.GET_STATE(8, 3) == PLANE_1
+    assert screen.GET_STATE(12, 5) == PLANE_2
+
+    screen.SCROLL_UP(5, PLANE_2)
+    assert screen.GET_STATE(12, 0) == PLANE_2
+
+    # Rows scrolled off the screen are gone
+    screen.SCROLL_UP(1, PLANE_2)
+    assert sum(screen.PIXELS) == PLANE_1
@@ -0,0 +1,106 @@
+import pytest
+
+from architecture import Architecture
+from tracer import Tracer, TraceReader, DIFF_TRACES
+
+
+def RUN_TRACED(program, filename, count, quirks='default'):
+    cpu = Architecture(seed=1, quirks=quirks)
+    cpu.memory[0x200:0x200 + len(program)] = bytes(program)
+
+    tracer = Tracer(cpu, filename=str(filename))
+    tracer.ATTACH()
+    for _ in range(count):
+        cpu.EXECUTE()
+    tracer.CLOSE()
+    return TraceReader(str(filename))
+
+
+def test_records_pc_opcode_and_changed_registers(tmp_path):
+    # 200: LOAD V3, 07 / 202: LOAD I, 345 / 204: LOAD V3, 07
+    trace = RUN_TRACED([0x63, 0x07, 0xA3, 0x45, 0x63, 0x07], tmp_path / 'a.trace', 3)
+
+    assert len(trace) == 3
+    cycle, pc, opcode, i, changed = trace[0][:5]
+    assert (cycle, pc, opcode, changed) == (0, 0x200, 0x6307, 1 << 3)
+    assert trace[0][5 + 3] == 7
+
+    assert trace[1][3] == 0x345 and trace[1][4] == 0
+
+    # Loading the value a register already holds is not a change
+    assert trace[2][4] == 0
+
+
+def test_index_past_16_bits_wraps_instead_of_breaking_the_trace(tmp_path):
+    # 200: LOAD V0, FF / 202: ADD I, V0 / 204: JUMP 202
+    cpu_program = [0x60, 0xFF, 0xF0, 0x1E, 0x12, 0x02]
+    trace = RUN_TRACED(cpu_program, tmp_path / 'a.trace', 600, quirks='xochip')
+
+    assert len(trace) == 600
+    assert all(0 <= record[3] <= 0xFFFF for record in trace)
+
+
+def test_ring_buffer_keeps_the_last_records(tmp_path):
+    cpu = Architecture(seed=1)
+    # 200: ADD V0, 01 / 202: JUMP 200
+    cpu.memory[0x200:0x204] = bytes([0x70, 0x01, 0x12, 0x00])
+
+    tracer = Tracer(cpu, ring_size=8)
+    tracer.ATTACH()
+    for _ in range(21):
+        cpu.EXECUTE()
+    tracer.DETACH()
+    tracer.SAVE(str(tmp_path / 'ring.trace'))
+
+    trace = TraceReader(str(tmp_path / 'ring.trace'))
+    assert [record[0] for record in trace] == list(range(13, 21))
+
+
+def test_diff_reports_first_divergence(tmp_path):
+    a = RUN_TRACED([0x60, 0x01, 0x61, 0x02], tmp_path / 'a.trace', 2)
+    b = RUN_TRACED([0x60, 0x01, 0x61, 0x03], tmp_path / 'b.trace', 2)
+
+    assert DIFF_TRACES(a, a) is None
+    assert DIFF_TRACES(a, b)[0] == 1
+
+
+def test_detach_puts_back_an_earlier_wrapper(tmp_path):
+    cpu = Architecture(seed=1)
+    cpu.memory[0x200:0x202] = bytes([0x12, 0x00])
+    calls = []
+    execute = cpu.EXECUTE
+
+    def COUNTED_EXECUTE(OPERAND=None):
+        calls.append(OPERAND)
+        return execute(OPERAND)
+
+    cpu.EXECUTE = COUNTED_EXECUTE
+    tracer = Tracer(cpu, ring_size=4)
+    tracer.ATTACH()
+    tracer.DETACH()
+    assert cpu.EXECUTE is COUNTED_EXECUTE
+
+    tracer.ATTACH()
+    cpu.EXECUTE()
+    tracer.DETACH()
+    cpu.EXECUTE()
+    assert len(calls) == 2
+    assert tracer.CYCLE == 1
+
+
+def test_reader_maps_the_file_and_closes(tmp_path):
+    with RUN_TRACED([0x70, 0x01, 0x12, 0x00], tmp_path / 'a.trace', 1000) as trace:
+        assert len(trace) == 1000
+        assert sum(1 for _ in trace) == 1000
+        assert trace[999][0] == 999
+    assert trace.MAP is None
+
+
+def test_reader_rejects_bad_files(tmp_path):
+    from exceptions import TraceFormatException
+
+    (tmp_path / 'short').write_bytes(b'C8')
+    (tmp_path / 'bad').write_bytes(b'XXXX' + bytes(4))
+    for name in ('short', 'bad'):
+        with pytest.raises(TraceFormatException):
+            TraceReader(str(tmp_path / name))
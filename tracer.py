@@ -0,0 +1,343 @@
+from exceptions import TraceFormatException
+
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+
+
+# Every executed instruction is one fixed size record:
+#
+#   cycle (8 bytes), PC, opcode, I, changed register mask (2 bytes each),
+#   V0 - VF after the instruction (1 byte each)
+#
+# Bit n of the changed mask is set when Vn was modified by the instruction.
+RECORD = struct.Struct('<QHHHH16B')
+CHANGED_OFFSET = 14
+REGISTERS_OFFSET = 16
+CHANGED = struct.Struct('<H')
+
+# File header: magic, format version, record size
+HEADER = struct.Struct('<4sHH')
+MAGIC = b'C8TR'
+VERSION = 1
+
+
+class Tracer(object):
+    """
+    Records every instruction run through Architecture.EXECUTE.
+
+    With a filename, records are packed into fixed size chunks and handed to
+    a background thread that writes them out, so the interpreter only ever
+    packs bytes into a preallocated buffer. With ring_size instead, the last
+    ring_size records are kept in memory (flight recorder mode) and only
+    written when SAVE is called.
+
+    The changed mask compares V0 - VF with a reused copy of them as of the
+    previous record, so nothing is allocated for an instruction that
+    leaves them alone.
+    """
+
+    # Records per chunk handed to the writer thread
+    RECORDS_PER_CHUNK = 16384
+
+    # Chunks in flight before the interpreter waits for the writer
+    CHUNKS = 4
+
+    def __init__(self, cpu, filename=None, ring_size=None):
+        if (filename is None) == (ring_size is None):
+            raise ValueError('Tracer needs exactly one of filename or ring_size')
+
+        self.CPU = cpu
+        self.CYCLE = 0
+        self.OFFSET = 0
+        self.WRAPPED = False
+        self.ATTACHED = False
+
+        self.FILE = None
+        self.WRITER = None
+
+        # EXECUTE set on the CPU instance before ATTACH, by another tool
+        self.PREVIOUS_EXECUTE = None
+
+        if filename is not None:
+            self.BUFFER_SIZE = self.RECORDS_PER_CHUNK * RECORD.size
+            self.FREE = queue.Queue()
+            self.PENDING = queue.Queue()
+            for _ in range(self.CHUNKS - 1):
+                self.FREE.put(bytearray(self.BUFFER_SIZE))
+            self.BUFFER = bytearray(self.BUFFER_SIZE)
+
+            self.FILE = open(filename, 'wb')
+            self.FILE.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            self.WRITER = threading.Thread(target=self.WRITE_CHUNKS, daemon=True)
+            self.WRITER.start()
+        else:
+            self.BUFFER_SIZE = ring_size * RECORD.size
+            self.BUFFER = bytearray(self.BUFFER_SIZE)
+
+        self.VIEW = memoryview(self.BUFFER)
+
+    def ATTACH(self):
+        """
+        Replace EXECUTE on the CPU instance with the tracing version. Other
+        tools wrapping EXECUTE must be detached in the reverse order.
+        """
+        cpu = self.CPU
+        execute = cpu.EXECUTE
+        self.PREVIOUS_EXECUTE = vars(cpu).get('EXECUTE')
+        general = cpu.GeneralRegisters
+        registers = cpu.CpuRegisters
+        pack_into = RECORD.pack_into
+        pack_changed = CHANGED.pack_into
+        size = RECORD.size
+        tracer = self
+
+        # V0 - VF as of the previous record
+        last = bytearray(general.values())
+
+        def TRACED_EXECUTE(OPERAND=None):
+            pc = registers['PC']
+            operand = execute(OPERAND)
+
+            offset = tracer.OFFSET
+            pack_into(tracer.BUFFER, offset, tracer.CYCLE, pc, operand, registers['I'], 0, *general.values())
+            tracer.CYCLE += 1
+
+            start = offset + REGISTERS_OFFSET
+            values = tracer.VIEW[start:start + 16]
+            if values != last:
+                changed = 0
+                for i in range(16):
+                    if values[i] != last[i]:
+                        changed |= 1 << i
+                pack_changed(tracer.BUFFER, offset + CHANGED_OFFSET, changed)
+                last[:] = values
+
+            offset += size
+            if offset == tracer.BUFFER_SIZE:
+                tracer.BUFFER_FULL()
+            else:
+                tracer.OFFSET = offset
+
+            return operand
+
+        cpu.EXECUTE = TRACED_EXECUTE
+        self.ATTACHED = True
+
+    def DETACH(self):
+        if self.ATTACHED:
+            if self.PREVIOUS_EXECUTE is None:
+                del self.CPU.EXECUTE
+            else:
+                self.CPU.EXECUTE = self.PREVIOUS_EXECUTE
+            self.PREVIOUS_EXECUTE = None
+            self.ATTACHED = False
+
+    def BUFFER_FULL(self):
+        self.OFFSET = 0
+
+        if self.FILE is None:
+            self.WRAPPED = True
+        else:
+            self.PENDING.put(self.BUFFER)
+            self.BUFFER = self.FREE.get()
+            self.VIEW = memoryview(self.BUFFER)
+
+    def WRITE_CHUNKS(self):
+        """
+        Writer thread, writes chunks until it gets None
+        """
+        while True:
+            chunk = self.PENDING.get()
+            if chunk is None:
+                break
+
+            self.FILE.write(chunk)
+            if len(chunk) == self.BUFFER_SIZE:
+                self.FREE.put(chunk)
+
+    def CLOSE(self):
+        """
+        Detach from the CPU and flush everything to disk
+        """
+        self.DETACH()
+
+        if self.FILE is not None:
+            self.PENDING.put(bytes(self.BUFFER[:self.OFFSET]))
+            self.PENDING.put(None)
+            self.WRITER.join()
+            self.FILE.close()
+            self.FILE = None
+
+    def SAVE(self, filename):
+        """
+        Flight recorder mode only: write the records in memory, oldest first
+        """
+        with open(filename, 'wb') as trace_file:
+            trace_file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            if self.WRAPPED:
+                trace_file.write(self.BUFFER[self.OFFSET:])
+            trace_file.write(self.BUFFER[:self.OFFSET])
+
+
+class TraceReader(object):
+    """
+    Reads a trace written by Tracer. Records are tuples of
+    (cycle, PC, opcode, I, changed mask, V0, ..., VF).
+
+    The file is memory mapped rather than read, so a trace of any length
+    costs no more memory than the pages of it in use. CLOSE unmaps it.
+    """
+
+    def __init__(self, filename):
+        self.FILE = open(filename, 'rb')
+        self.MAP = None
+        self.DATA = memoryview(b'')
+
+        try:
+            if os.fstat(self.FILE.fileno()).st_size < HEADER.size:
+                raise TraceFormatException(filename, 'file too short')
+
+            self.MAP = mmap.mmap(self.FILE.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, record_size = HEADER.unpack_from(self.MAP)
+            if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+                raise TraceFormatException(filename, 'unsupported header')
+
+            self.DATA = memoryview(self.MAP)[HEADER.size:]
+            if len(self.DATA) % RECORD.size:
+                raise TraceFormatException(filename, 'truncated record')
+        except Exception:
+            self.CLOSE()
+            raise
+
+    def CLOSE(self):
+        self.DATA.release()
+        if self.MAP is not None:
+            self.MAP.close()
+            self.MAP = None
+        self.FILE.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.CLOSE()
+
+    def __len__(self):
+        return len(self.DATA) // RECORD.size
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return RECORD.unpack_from(self.DATA, index * RECORD.size)
+
+    def __iter__(self):
+        return RECORD.iter_unpack(self.DATA)
+
+    @staticmethod
+    def FORMAT(record):
+        cycle, pc, opcode, i, changed = record[:5]
+        values = ' '.join(
+            'V{:X}={:02X}'.format(register, record[5 + register])
+            for register in range(16) if changed & (1 << register)
+        )
+        return '{:>10} {:03X}: {:04X}  I={:03X} {}'.format(cycle, pc, opcode, i, values).rstrip()
+
+
+def DIFF_TRACES(a, b):
+    """
+    Compare two traces and return (index, record_a, record_b) for the first
+    record that differs, or None if they are identical. When one trace is a
+    prefix of the other the missing record is returned as None.
+    """
+
+    # Compare large slices first, records are only unpacked around a difference
+    step = RECORD.size * 4096
+    length = min(len(a.DATA), len(b.DATA))
+
+    start = 0
+    while start < length and a.DATA[start:start + step] == b.DATA[start:start + step]:
+        start += step
+
+    for index in range(start // RECORD.size, length // RECORD.size):
+        offset = index * RECORD.size
+        if a.DATA[offset:offset + RECORD.size] != b.DATA[offset:offset + RECORD.size]:
+            return index, a[index], b[index]
+
+    if len(a) != len(b):
+        index = length // RECORD.size
+        return index, a[index] if index < len(a) else None, b[index] if index < len(b) else None
+
+    return None
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from chip8 import DEFAULT_FONT
+
+    parser = argparse.ArgumentParser(description='Record, print and compare CHIP-8 execution traces')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    record = commands.add_parser('record', help='run a ROM and record a trace')
+    record.add_argument('rom')
+    record.add_argument('output')
+    record.add_argument('--font', default=DEFAULT_FONT)
+    record.add_argument('--instructions', type=int, default=100000)
+    record.add_argument('--ring', type=int, metavar='N', help='only keep the last N instructions')
+
+    dump = commands.add_parser('dump', help='print a trace')
+    dump.add_argument('trace')
+    dump.add_argument('--limit', type=int)
+
+    diff = commands.add_parser('diff', help='report the first difference between two traces')
+    diff.add_argument('a')
+    diff.add_argument('b')
+
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        from architecture import Architecture
+
+        CPU = Architecture()
+        CPU.LOAD_ROMFILE(args.font, 0)
+        CPU.LOAD_ROMFILE(args.rom)
+
+        if args.ring:
+            tracer = Tracer(CPU, ring_size=args.ring)
+        else:
+            tracer = Tracer(CPU, filename=args.output)
+        tracer.ATTACH()
+
+        for count in range(args.instructions):
+            if CPU.EXECUTE() == 0x00FD:
+                break
+            if count % 10 == 9:
+                CPU.DECREMENT_TIMERS()
+                CPU.keypad.NEXT_FRAME()
+
+        tracer.CLOSE()
+        if args.ring:
+            tracer.SAVE(args.output)
+
+    if args.command == 'dump':
+        with TraceReader(args.trace) as reader:
+            for index, record in enumerate(reader):
+                if args.limit is not None and index >= args.limit:
+                    break
+                sys.stdout.write(TraceReader.FORMAT(record) + '\n')
+
+    if args.command == 'diff':
+        with TraceReader(args.a) as a, TraceReader(args.b) as b:
+            result = DIFF_TRACES(a, b)
+        if result is None:
+            print('Traces are identical')
+        else:
+            index, record_a, record_b = result
+            print('First divergence at record {}'.format(index))
+            print('  a: {}'.format(TraceReader.FORMAT(record_a) if record_a else '<end of trace>'))
+            print('  b: {}'.format(TraceReader.FORMAT(record_b) if record_b else '<end of trace>'))
+            sys.exit(1)